@@ -5,7 +5,6 @@ import logging
 
 from langgraph.graph import StateGraph, START, END
 from langgraph.graph.state import CompiledStateGraph
-from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
 from langgraph.types import Command
 from psycopg_pool import AsyncConnectionPool
 
@@ -13,6 +12,7 @@ from app.agent.state import HtsClassifyAgentState
 from app.agent.node import rewrite_item, retrieve_documents, determine_heading, determine_subheading, \
     determine_rate_line, final_output
 from app.agent.util.exception_handler import safe_raise_exception_node
+from app.agent.util.slim_checkpointer import SlimPostgresSaver
 from app.core.config import settings
 from app.agent.constants import HtsAgents, SupervisorNodes, DocumentTypes
 from app.service.hts_classify_supervisor_service import HtsClassifySupervisorService
@@ -127,13 +127,13 @@ async def build_hts_classify_graph() -> CompiledStateGraph:
     hts_classify_graph_builder.add_edge(HtsAgents.DETERMINE_RATE_LINE.code, SupervisorNodes.AGENT_ROUTER)
     hts_classify_graph_builder.add_edge(HtsAgents.GENERATE_FINAL_OUTPUT.code, SupervisorNodes.AGENT_ROUTER)
 
-    # 增加checkpoint
+    # 增加checkpoint，大文本按内容哈希单独保存
     pool = AsyncConnectionPool(conninfo=str(settings.postgres_database_uri),
                                max_size=10)
     async with await pool.getconn() as conn1:
         await conn1.set_autocommit(True)
-        checkpointer = AsyncPostgresSaver(conn1)
+        checkpointer = SlimPostgresSaver(conn1)
         await checkpointer.setup()
 
-    checkpointer = AsyncPostgresSaver(conn=pool)
+    checkpointer = SlimPostgresSaver(conn=pool)
     return hts_classify_graph_builder.compile(checkpointer=checkpointer)
@@ -2,6 +2,7 @@
 确定所属类目
 """
 import logging, json
+from functools import lru_cache
 
 from langgraph.graph.state import CompiledStateGraph
 from langgraph.graph import START, StateGraph, END
@@ -10,12 +11,15 @@ from app.agent.constants import DetermineHeadingNodes
 from app.agent.state import HtsClassifyAgentState
 from app.agent.constants import HtsAgents
 from app.agent.util.exception_handler import safe_raise_exception_node
-from app.core.llm import base_qwen_llm
+from app.agent.util.stream_writer import get_llm_stream_callback
+from app.core.llm import get_llm, BASE_QWEN, HEDGED_QWEN
 from app.service.determine_heading_service import DetermineHeadingService
 
 logger = logging.getLogger(__name__)
 
-determine_heading_service = DetermineHeadingService(llm=base_qwen_llm, embeddings=base_qwen_llm)
+@lru_cache(maxsize=1)
+def get_determine_heading_service() -> DetermineHeadingService:
+    return DetermineHeadingService(llm=get_llm(HEDGED_QWEN), embeddings=get_llm(BASE_QWEN))
 
 
 def start_determine_heading(state: HtsClassifyAgentState):
@@ -31,16 +35,17 @@ async def get_from_cache(state: HtsClassifyAgentState, config):
     if is_for_evaluation:
         return {"hit_heading_cache": False}
     else:
-        cache = await determine_heading_service.get_simil_cache(rewritten_item=state.get("rewritten_item"),
-                                                                chapter_codes=get_determined_chapter_codes(state))
+        cache = await get_determine_heading_service().get_simil_cache(rewritten_item=state.get("rewritten_item"),
+                                                                      chapter_codes=get_determined_chapter_codes(state))
         return cache
 
 
 @safe_raise_exception_node(logger=logger)
 async def ask_llm_to_determine_heading(state: HtsClassifyAgentState):
     heading_documents = state.get("heading_documents")
-    input_message, output_message, llm_response = await determine_heading_service.determine_use_llm(
-        state.get("rewritten_item"), heading_documents)
+    input_message, output_message, llm_response = await get_determine_heading_service().determine_use_llm(
+        state.get("rewritten_item"), heading_documents,
+        on_chunk=get_llm_stream_callback(HtsAgents.DETERMINE_HEADING.code))
 
     return {"messages": [input_message, output_message], "determine_heading_llm_response": llm_response}
 
@@ -70,11 +75,12 @@ async def save_llm_confirm_heading_for_evaluation(state: HtsClassifyAgentState,
     is_for_evaluation = config["configurable"].get("is_for_evaluation", False)
     evaluate_version = config["configurable"].get("evaluate_version", "-1")
     if is_for_evaluation:
-        await determine_heading_service.save_for_evaluation(evaluate_version=evaluate_version,
-                                                            origin_item_name=state.get("item"),
-                                                            heading_documents=state.get("heading_documents"),
-                                                            llm_response=state.get("determine_heading_llm_response"),
-                                                            actual_heading=config["configurable"].get("hscode", "")[:4])
+        await get_determine_heading_service().save_for_evaluation(
+            evaluate_version=evaluate_version,
+            origin_item_name=state.get("item"),
+            heading_documents=state.get("heading_documents"),
+            llm_response=state.get("determine_heading_llm_response"),
+            actual_heading=config["configurable"].get("hscode", "")[:4])
 
 
 @safe_raise_exception_node(logger=logger, ignore_exception=True)
@@ -84,10 +90,10 @@ async def save_layered_heading_cache(state: HtsClassifyAgentState):
     """
     determine_heading_success = state.get("determine_heading_success")
     if determine_heading_success:
-        await determine_heading_service.save_simil_cache(origin_item_name=state.get("item"),
-                                                         rewritten_item=state.get("rewritten_item"),
-                                                         chapter_codes=get_determined_chapter_codes(state),
-                                                         alternative_headings=state.get("alternative_headings"))
+        await get_determine_heading_service().save_simil_cache(origin_item_name=state.get("item"),
+                                                               rewritten_item=state.get("rewritten_item"),
+                                                               chapter_codes=get_determined_chapter_codes(state),
+                                                               alternative_headings=state.get("alternative_headings"))
     return {}
 
 
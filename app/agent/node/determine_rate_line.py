@@ -2,6 +2,7 @@
 确定所属税率线
 """
 import logging
+from functools import lru_cache
 
 from langgraph.graph.state import CompiledStateGraph
 from langgraph.graph import START, StateGraph, END
@@ -10,13 +11,16 @@ from app.agent.constants import DetermineRateLineNodes
 from app.agent.state import HtsClassifyAgentState
 from app.agent.constants import HtsAgents
 from app.agent.util.exception_handler import safe_raise_exception_node
-from app.core.llm import base_qwen_llm
-from app.llm.embedding.qwen import default_qwen_embeddings
+from app.agent.util.stream_writer import get_llm_stream_callback
+from app.core.llm import get_llm, HEDGED_QWEN
+from app.llm.embedding.micro_batching import default_batching_embeddings
 from app.service.determine_rate_line_service import DetermineRateLineService
 
 logger = logging.getLogger(__name__)
 
-determine_rate_line_service = DetermineRateLineService(llm=base_qwen_llm, embeddings=default_qwen_embeddings)
+@lru_cache(maxsize=1)
+def get_determine_rate_line_service() -> DetermineRateLineService:
+    return DetermineRateLineService(llm=get_llm(HEDGED_QWEN), embeddings=default_batching_embeddings)
 
 
 def start_determine_rate_line(state: HtsClassifyAgentState):
@@ -29,16 +33,17 @@ async def get_from_cache(state: HtsClassifyAgentState, config):
     if is_for_evaluation:
         return {"hit_rate_line_cache": False}
     else:
-        cache = await determine_rate_line_service.get_simil_cache(rewritten_item=state.get("rewritten_item"),
-                                                                  subheading_codes=get_confirmed_subheading_codes(
-                                                                      state))
+        cache = await get_determine_rate_line_service().get_simil_cache(rewritten_item=state.get("rewritten_item"),
+                                                                        subheading_codes=get_confirmed_subheading_codes(
+                                                                            state))
         return cache
 
 
 @safe_raise_exception_node(logger=logger)
 async def ask_llm_to_determine_rate_line(state: HtsClassifyAgentState):
-    input_message, output_message, llm_response = await determine_rate_line_service.determine_use_llm(
-        rewritten_item=state.get("rewritten_item"), rate_line_documents=state.get("rate_line_documents"))
+    input_message, output_message, llm_response = await get_determine_rate_line_service().determine_use_llm(
+        rewritten_item=state.get("rewritten_item"), rate_line_documents=state.get("rate_line_documents"),
+        on_chunk=get_llm_stream_callback(HtsAgents.DETERMINE_RATE_LINE.code))
     return {"messages": [input_message, output_message], "determine_rate_line_llm_response": llm_response}
 
 
@@ -59,10 +64,10 @@ async def save_layered_rate_line_cache(state: HtsClassifyAgentState):
     """
     保存分层的税率线缓存
     """
-    await determine_rate_line_service.save_simil_cache(origin_item_name=state.get("item"),
-                                                       rewritten_item=state.get("rewritten_item"),
-                                                       subheading_codes=get_confirmed_subheading_codes(state),
-                                                       rate_line_result=state.get("main_rate_line"))
+    await get_determine_rate_line_service().save_simil_cache(origin_item_name=state.get("item"),
+                                                             rewritten_item=state.get("rewritten_item"),
+                                                             subheading_codes=get_confirmed_subheading_codes(state),
+                                                             rate_line_result=state.get("main_rate_line"))
     return {}
 
 
@@ -71,7 +76,7 @@ async def save_for_evaluation(state: HtsClassifyAgentState, config):
     is_for_evaluation = config["configurable"].get("is_for_evaluation", False)
     evaluate_version = config["configurable"].get("evaluate_version", "-1")
     if is_for_evaluation:
-        await determine_rate_line_service.save_for_evaluation(
+        await get_determine_rate_line_service().save_for_evaluation(
             evaluate_version=evaluate_version,
             origin_item_name=state.get("item"),
             rate_line_documents=state.get("rate_line_documents"),
@@ -2,6 +2,7 @@
 确定所属子目
 """
 import logging
+from functools import lru_cache
 
 from langgraph.graph.state import CompiledStateGraph
 from langgraph.store.base import BaseStore
@@ -11,13 +12,16 @@ from app.agent.constants import DetermineSubheadingNodes
 from app.agent.state import HtsClassifyAgentState
 from app.agent.constants import HtsAgents
 from app.agent.util.exception_handler import safe_raise_exception_node
-from app.core.llm import base_qwen_llm
-from app.llm.embedding.qwen import default_qwen_embeddings
+from app.agent.util.stream_writer import get_llm_stream_callback
+from app.core.llm import get_llm, HEDGED_QWEN
+from app.llm.embedding.micro_batching import default_batching_embeddings
 from app.service.determine_subheading_service import DetermineSubheadingService
 
 logger = logging.getLogger(__name__)
 
-determine_subheading_service = DetermineSubheadingService(llm=base_qwen_llm, embeddings=default_qwen_embeddings)
+@lru_cache(maxsize=1)
+def get_determine_subheading_service() -> DetermineSubheadingService:
+    return DetermineSubheadingService(llm=get_llm(HEDGED_QWEN), embeddings=default_batching_embeddings)
 
 
 def start_determine_subheading(state: HtsClassifyAgentState):
@@ -30,15 +34,17 @@ async def get_from_cache(state: HtsClassifyAgentState, config):
     if is_for_evaluation:
         return {"hit_subheading_cache": False}
     else:
-        cache = await determine_subheading_service.get_simil_cache(rewritten_item=state.get("rewritten_item"),
-                                                                   heading_codes=get_confirmed_heading_codes(state))
+        cache = await get_determine_subheading_service().get_simil_cache(
+            rewritten_item=state.get("rewritten_item"),
+            heading_codes=get_confirmed_heading_codes(state))
         return cache
 
 
 @safe_raise_exception_node(logger=logger)
 async def ask_llm_to_determine_subheading(state: HtsClassifyAgentState):
-    input_message, output_message, llm_response = await determine_subheading_service.determine_use_llm(
-        rewritten_item=state.get("rewritten_item"), subheading_documents=state.get("subheading_documents"))
+    input_message, output_message, llm_response = await get_determine_subheading_service().determine_use_llm(
+        rewritten_item=state.get("rewritten_item"), subheading_documents=state.get("subheading_documents"),
+        on_chunk=get_llm_stream_callback(HtsAgents.DETERMINE_SUBHEADING.code))
     return {"messages": [input_message, output_message], "determine_subheading_llm_response": llm_response}
 
 
@@ -66,11 +72,12 @@ async def save_simil_cache(state: HtsClassifyAgentState):
     """
     保存语义匹配使用的缓存
     """
-    await determine_subheading_service.save_simil_cache(origin_item_name=state.get("item"),
-                                                        rewritten_item=state.get("rewritten_item"),
-                                                        heading_codes=get_confirmed_heading_codes(state),
-                                                        main_subheading=state.get("main_subheading"),
-                                                        alternative_subheadings=state.get("alternative_subheadings"))
+    await get_determine_subheading_service().save_simil_cache(
+        origin_item_name=state.get("item"),
+        rewritten_item=state.get("rewritten_item"),
+        heading_codes=get_confirmed_heading_codes(state),
+        main_subheading=state.get("main_subheading"),
+        alternative_subheadings=state.get("alternative_subheadings"))
     return {}
 
 
@@ -79,7 +86,7 @@ async def save_for_evaluation(state: HtsClassifyAgentState, config):
     is_for_evaluation = config["configurable"].get("is_for_evaluation", False)
     evaluate_version = config["configurable"].get("evaluate_version", "-1")
     if is_for_evaluation:
-        await determine_subheading_service.save_for_evaluation(
+        await get_determine_subheading_service().save_for_evaluation(
             evaluate_version=evaluate_version,
             origin_item_name=state.get("item"),
             subheading_documents=state.get("subheading_documents"),
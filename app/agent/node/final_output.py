@@ -2,6 +2,7 @@
 生成最终输出
 """
 import logging
+from functools import lru_cache
 
 from langgraph.graph.state import CompiledStateGraph
 from langgraph.store.base import BaseStore
@@ -11,13 +12,16 @@ from app.agent.constants import GenerateFinalOutputNodes
 from app.agent.state import HtsClassifyAgentState, state_has_error
 from app.agent.constants import HtsAgents
 from app.agent.util.exception_handler import safe_raise_exception_node
-from app.core.llm import base_qwen_llm
-from app.llm.embedding.qwen import default_qwen_embeddings
+from app.agent.util.stream_writer import get_llm_stream_callback
+from app.core.llm import get_llm, HEDGED_QWEN
+from app.llm.embedding.micro_batching import default_batching_embeddings
 from app.service.final_output_service import FinalOutputService
 
 logger = logging.getLogger(__name__)
 
-final_output_service = FinalOutputService(llm=base_qwen_llm, embeddings=default_qwen_embeddings)
+@lru_cache(maxsize=1)
+def get_final_output_service() -> FinalOutputService:
+    return FinalOutputService(llm=get_llm(HEDGED_QWEN), embeddings=default_batching_embeddings)
 
 
 def start_generate_final_output(state: HtsClassifyAgentState):
@@ -39,7 +43,7 @@ async def ask_llm_to_generate_final_output(state: HtsClassifyAgentState, config,
               ([state.get("main_subheading")] + (state.get("alternative_subheadings") or []))
               if subheading.get("subheading_code") == final_subheading_code), None)
 
-    input_message, output_message, llm_response = await final_output_service.get_final_output_from_llm(
+    input_message, output_message, llm_response = await get_final_output_service().get_final_output_from_llm(
         origin_item_name=state["item"],
         rewritten_item=state.get("rewritten_item"),
         heading_candidates=state.get("candidate_heading_codes").get(
@@ -53,7 +57,9 @@ async def ask_llm_to_generate_final_output(state: HtsClassifyAgentState, config,
         rate_line_candidates=state.get(
             "candidate_rate_line_codes").get(final_subheading_code),
         selected_rate_line=final_rate_line_code,
-        select_rate_line_reason=confirmed_rate_line.get("reason"))
+        select_rate_line_reason=confirmed_rate_line.get("reason"),
+        # 只推送最终说明的增量文本
+        on_chunk=get_llm_stream_callback(HtsAgents.GENERATE_FINAL_OUTPUT.code, text_field="final_output_reason"))
 
     return {"messages": [input_message, output_message], "final_output_llm_response": llm_response}
 
@@ -94,19 +100,19 @@ async def save_exact_e2e_cache(state: HtsClassifyAgentState, config):
         next((subheading.get("reason") for subheading in
               ([state.get("main_subheading")] + (state.get("alternative_subheadings") or []))
               if subheading.get("subheading_code") == final_subheading_code), None)
-    await final_output_service.save_e2e_exact_cache(origin_item_name=state.get("item"),
-                                                    rewritten_item=state.get("rewritten_item"),
-                                                    chapter_code=final_chapter_code,
-                                                    heading_code=final_heading_code,
-                                                    heading_title=final_heading_title,
-                                                    heading_reason=final_heading_reason,
-                                                    subheading_code=final_subheading_code,
-                                                    subheading_title=final_subheading_title,
-                                                    subheading_reason=final_subheading_reason,
-                                                    rate_line_code=final_rate_line_code,
-                                                    rate_line_title=confirmed_rate_line.get("rate_line_title"),
-                                                    rate_line_reason=confirmed_rate_line.get("reason"),
-                                                    final_output_response=state.get("final_output_llm_response"))
+    await get_final_output_service().save_e2e_exact_cache(origin_item_name=state.get("item"),
+                                                          rewritten_item=state.get("rewritten_item"),
+                                                          chapter_code=final_chapter_code,
+                                                          heading_code=final_heading_code,
+                                                          heading_title=final_heading_title,
+                                                          heading_reason=final_heading_reason,
+                                                          subheading_code=final_subheading_code,
+                                                          subheading_title=final_subheading_title,
+                                                          subheading_reason=final_subheading_reason,
+                                                          rate_line_code=final_rate_line_code,
+                                                          rate_line_title=confirmed_rate_line.get("rate_line_title"),
+                                                          rate_line_reason=confirmed_rate_line.get("reason"),
+                                                          final_output_response=state.get("final_output_llm_response"))
     return {}
 
 
@@ -116,11 +122,12 @@ async def save_simil_e2e_cache(state: HtsClassifyAgentState, config):
     if is_for_evaluation:
         return {}
 
-    await final_output_service.save_e2e_simil_cache(origin_item_name=state.get("item"),
-                                                    rewritten_item=state.get("rewritten_item"),
-                                                    rate_line_code=state.get("main_rate_line").get("rate_line_code"),
-                                                    rate_line_title=state.get("main_rate_line").get("rate_line_title"),
-                                                    final_output_response=state.get("final_description"))
+    await get_final_output_service().save_e2e_simil_cache(
+        origin_item_name=state.get("item"),
+        rewritten_item=state.get("rewritten_item"),
+        rate_line_code=state.get("main_rate_line").get("rate_line_code"),
+        rate_line_title=state.get("main_rate_line").get("rate_line_title"),
+        final_output_response=state.get("final_description"))
     return {}
 
 
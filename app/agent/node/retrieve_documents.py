@@ -2,6 +2,7 @@
 获取相关文档
 """
 import json, logging
+from functools import lru_cache
 from xml.dom.minidom import DocumentType
 
 from langgraph.graph.state import CompiledStateGraph
@@ -16,7 +17,9 @@ from app.service.retrieve_documents_service import RetrieveDocumentsService
 
 logger = logging.getLogger(__name__)
 
-retrieve_service = RetrieveDocumentsService(async_milvus_client=get_async_milvus_client())
+@lru_cache(maxsize=1)
+def get_retrieve_service() -> RetrieveDocumentsService:
+    return RetrieveDocumentsService(async_milvus_client=get_async_milvus_client())
 
 
 def start_retrieve_documents(state: HtsClassifyAgentState):
@@ -27,13 +30,13 @@ def start_retrieve_documents(state: HtsClassifyAgentState):
 @safe_raise_exception_node(logger=logger)
 async def retrieve_documents(state: HtsClassifyAgentState):
     if state.get("current_document_type") == DocumentTypes.HEADING:
-        heading_documents, candidate_heading_codes = await retrieve_service.retrieve_heading_documents(
-            state.get("rewritten_item"))
+        heading_documents, candidate_heading_codes = await get_retrieve_service().retrieve_heading_documents(
+            state.get("rewritten_item"), get_early_chapter_codes(state))
         return {"heading_documents": heading_documents, "candidate_heading_codes": candidate_heading_codes}
     if state.get("current_document_type") == DocumentTypes.SUBHEADING:
         # 从数据库获取heading下subheading信息
-        heading_codes = get_confirmed_heading_codes(state)
-        subheading_documents, candidate_subheading_codes = await retrieve_service.retrieve_subheading_documents(
+        heading_codes = get_ranked_heading_codes(state)
+        subheading_documents, candidate_subheading_codes = await get_retrieve_service().retrieve_subheading_documents(
             heading_codes)
         return {"subheading_documents": subheading_documents, "candidate_subheading_codes": candidate_subheading_codes}
     if state.get("current_document_type") == DocumentTypes.RATE_LINE:
@@ -42,7 +45,7 @@ async def retrieve_documents(state: HtsClassifyAgentState):
         if alternative_subheadings:
             subheading_codes.extend(
                 [alternative_subheading.get("subheading_code") for alternative_subheading in alternative_subheadings])
-        rate_line_document, candidate_rate_line_codes = await retrieve_service.retrieve_rate_line_documents(
+        rate_line_document, candidate_rate_line_codes = await get_retrieve_service().retrieve_rate_line_documents(
             subheading_codes)
         return {"rate_line_documents": rate_line_document, "candidate_rate_line_codes": candidate_rate_line_codes}
 
@@ -60,7 +63,7 @@ async def save_retrieve_result_for_evaluation(state: HtsClassifyAgentState, conf
             candidate_heading_codes_dict = state.get("candidate_heading_codes")
             candidate_heading_codes = [code for code_list in candidate_heading_codes_dict.values() for code in
                                        code_list]
-            await retrieve_service.save_heading_retrieve_evaluation(
+            await get_retrieve_service().save_heading_retrieve_evaluation(
                 evaluate_version,
                 origin_item_name=state.get("item"),
                 rewritten_item=state.get("rewritten_item"),
@@ -72,6 +75,23 @@ async def save_retrieve_result_for_evaluation(state: HtsClassifyAgentState, conf
 
 
 
+def get_early_chapter_codes(state: HtsClassifyAgentState):
+    """
+    获取改写期间提前检索到的chapter编码，同一个线程中检索的是之前的商品时忽略
+    """
+    if state.get("early_retrieval_item") and state.get("early_retrieval_item") == state.get("item"):
+        return state.get("early_chapter_codes")
+    return None
+
+
+def get_ranked_heading_codes(state: HtsClassifyAgentState):
+    """
+    获取上一环节确定的类目编码列表，按置信度从高到低排序
+    """
+    headings = sorted(state.get("alternative_headings"), key=lambda heading: -(heading.get("confidence_score") or 0))
+    return [heading.get("heading_code") for heading in headings]
+
+
 def get_confirmed_heading_codes(state: HtsClassifyAgentState):
     """
     获取上一环节确定的类目编码列表
@@ -2,6 +2,7 @@
 问题重写节点
 """
 import logging
+from functools import lru_cache
 
 from datetime import datetime
 
@@ -9,19 +10,23 @@ from langgraph.graph.state import CompiledStateGraph
 from langgraph.types import interrupt
 from langgraph.graph import START, StateGraph, END
 
-from app.agent.node.final_output import final_output_service
+from app.agent.node.final_output import get_final_output_service
+from app.agent.node.retrieve_documents import get_retrieve_service
 from app.agent.state import HtsClassifyAgentState, OutputMessage
 from app.agent.util.exception_handler import safe_raise_exception_node
-from app.core.llm import base_qwen_llm, deep_seek_llm
-from app.llm.embedding.qwen import default_qwen_embeddings
+from app.core.config import settings
+from app.core.llm import get_llm, HEDGED_QWEN, DEEP_SEEK
+from app.llm.embedding.micro_batching import default_batching_embeddings
 from app.agent.constants import HtsAgents, RewriteItemNodes
 from app.service.rewrite_item_service import ItemRewriteCacheService
 
 logger = logging.getLogger(__name__)
 
-item_rewrite_cache_service = ItemRewriteCacheService(embeddings=default_qwen_embeddings,
-                                                     llm=base_qwen_llm,
-                                                     backup_llm=deep_seek_llm)
+@lru_cache(maxsize=1)
+def get_item_rewrite_cache_service() -> ItemRewriteCacheService:
+    return ItemRewriteCacheService(embeddings=default_batching_embeddings,
+                                   llm=get_llm(HEDGED_QWEN),
+                                   backup_llm=get_llm(DEEP_SEEK))
 
 
 def start_rewrite_node(state: HtsClassifyAgentState):
@@ -35,7 +40,7 @@ async def get_from_cache_node(state: HtsClassifyAgentState):
     从OpenSearch中查询缓存信息
     """
     item = state.get("item")
-    cache = await item_rewrite_cache_service.get_from_cache(item)
+    cache = await get_item_rewrite_cache_service().get_from_cache(item)
     if cache and cache.get("hit_rewrite_cache", False):
         if cache.get("is_real_item", False):
             return {"hit_rewrite_cache": True, "rewrite_success": True, "rewritten_item": cache.get("rewritten_item"),
@@ -51,13 +56,22 @@ async def use_llm_to_rewrite_node(state: HtsClassifyAgentState):
     """
     获取商品信息重写节点
     """
-    input_message, output_message, rewritten_response = await item_rewrite_cache_service.rewrite_use_llm(
+    input_message, output_message, rewritten_response = await get_item_rewrite_cache_service().rewrite_use_llm(
         state.get("item"))
 
     return {"messages": [input_message, output_message], "rewrite_llm_response": rewritten_response,
             "current_output_message": OutputMessage(type="message", message="获取LLM改写商品结果...")}
 
 
+@safe_raise_exception_node(logger=logger, ignore_exception=True)
+async def early_retrieve_chapters_node(state: HtsClassifyAgentState):
+    """
+    与LLM改写并行，使用原始商品信息提前检索chapter，失败时改写后正常检索
+    """
+    chapter_codes = await get_retrieve_service().early_retrieve_chapter_codes(state.get("item"))
+    return {"early_retrieval_item": state.get("item"), "early_chapter_codes": chapter_codes}
+
+
 @safe_raise_exception_node(logger=logger)
 def process_llm_response_node(state: HtsClassifyAgentState):
     """
@@ -89,9 +103,9 @@ async def save_exact_rewrite_cache_node(state: HtsClassifyAgentState):
     """
     保存精确匹配的缓存结果，即使改写失败也会记录到数据库
     """
-    await item_rewrite_cache_service.save_exact_cache(item=state.get("item"),
-                                                      rewrite_success=state.get("rewrite_success"),
-                                                      rewritten_item=state.get("rewritten_item"))
+    await get_item_rewrite_cache_service().save_exact_cache(item=state.get("item"),
+                                                            rewrite_success=state.get("rewrite_success"),
+                                                            rewritten_item=state.get("rewritten_item"))
     return {}
 
 
@@ -100,9 +114,9 @@ async def save_simil_rewrite_cache_node(state: HtsClassifyAgentState, config):
     """
     保存语义匹配使用的缓存, 只有明确改写成功了才会执行到这个node
     """
-    await item_rewrite_cache_service.save_simil_cache(item=state.get("item"),
-                                                      rewritten_item=state.get("rewritten_item"),
-                                                      config=config)
+    await get_item_rewrite_cache_service().save_simil_cache(item=state.get("item"),
+                                                            rewritten_item=state.get("rewritten_item"),
+                                                            config=config)
     return {}
 
 
@@ -115,7 +129,7 @@ async def get_simil_e2e_cache(state: HtsClassifyAgentState, config):
     if is_for_evaluation:
         return {"hit_e2e_simil_cache": False}
     if state.get("rewrite_success"):
-        return await final_output_service.get_e2e_simil_cache(state.get("rewritten_item"))
+        return await get_final_output_service().get_e2e_simil_cache(state.get("rewritten_item"))
     return {"hit_e2e_simil_cache": False}
 
 
@@ -123,6 +137,8 @@ def after_query_cache_edge(state: HtsClassifyAgentState):
     hit_rewrite_cache = state.get("hit_rewrite_cache")
     if hit_rewrite_cache:
         return [RewriteItemNodes.GET_SIMIL_E2E_CACHE.value]
+    elif settings.EARLY_RETRIEVAL_MODE != "off":
+        return [RewriteItemNodes.USE_LLM_TO_REWRITE_ITEM.value, RewriteItemNodes.EARLY_RETRIEVE_CHAPTERS.value]
     else:
         return [RewriteItemNodes.USE_LLM_TO_REWRITE_ITEM.value]
 
@@ -147,6 +163,7 @@ def build_rewrite_item_graph() -> CompiledStateGraph:
     graph_builder.add_node(RewriteItemNodes.ENTER_REWRITE_ITEM, start_rewrite_node)
     graph_builder.add_node(RewriteItemNodes.GET_REWRITE_ITEM_FROM_CACHE, get_from_cache_node)
     graph_builder.add_node(RewriteItemNodes.USE_LLM_TO_REWRITE_ITEM, use_llm_to_rewrite_node)
+    graph_builder.add_node(RewriteItemNodes.EARLY_RETRIEVE_CHAPTERS, early_retrieve_chapters_node)
     graph_builder.add_node(RewriteItemNodes.PROCESS_LLM_RESPONSE, process_llm_response_node)
     graph_builder.add_node(RewriteItemNodes.SAVE_EXACT_REWRITE_CACHE, save_exact_rewrite_cache_node)
     graph_builder.add_node(RewriteItemNodes.SAVE_SIMIL_REWRITE_CACHE, save_simil_rewrite_cache_node)
@@ -159,9 +176,12 @@ def build_rewrite_item_graph() -> CompiledStateGraph:
                                         {
                                             RewriteItemNodes.USE_LLM_TO_REWRITE_ITEM.value:
                                                 RewriteItemNodes.USE_LLM_TO_REWRITE_ITEM,
+                                            RewriteItemNodes.EARLY_RETRIEVE_CHAPTERS.value:
+                                                RewriteItemNodes.EARLY_RETRIEVE_CHAPTERS,
                                             RewriteItemNodes.GET_SIMIL_E2E_CACHE.value:
                                                 RewriteItemNodes.GET_SIMIL_E2E_CACHE
                                         })
+    graph_builder.add_edge(RewriteItemNodes.EARLY_RETRIEVE_CHAPTERS, END)
     graph_builder.add_conditional_edges(RewriteItemNodes.USE_LLM_TO_REWRITE_ITEM,
                                         lambda state: "error" if state.get("unexpected_error") else "normal",
                                         {"error": END, "normal": RewriteItemNodes.PROCESS_LLM_RESPONSE})
@@ -27,6 +27,9 @@ class HtsClassifyAgentState(MessagesState):
     rewrite_llm_response: ItemRewriteResponse
     rewrite_success: bool
     rewritten_item: dict[str, str]
+    # 改写期间使用原始商品信息提前检索到的chapter编码，以及检索使用的商品信息
+    early_retrieval_item: str
+    early_chapter_codes: list[str]
     # 文档检索
     current_document_type: DocumentTypes
     heading_documents: str
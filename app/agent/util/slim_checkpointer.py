@@ -0,0 +1,189 @@
+"""
+精简的LangGraph checkpoint
+
+AsyncPostgresSaver每一步都会把字符串类型的状态(heading_documents等检索文档)内联写入checkpoint，
+messages中又包含完整的提示词，同样的大文本在一次运行中会被重复写入几十次。这里在写入前把超过指定长度的文本
+替换为内容哈希的引用，文本按哈希只保存一次，读取时再还原；命中e2e缓存的运行直接结束，不需要恢复，不写入checkpoint
+"""
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Sequence
+
+from langchain_core.messages import BaseMessage
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import ChannelVersions, Checkpoint, CheckpointMetadata, CheckpointTuple
+from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
+
+from app.core.config import settings
+from app.util.hash_utils import sha256_hash
+
+logger = logging.getLogger(__name__)
+
+CONTENT_REF_PREFIX = "$content_ref$:"
+# 同一进程内已经保存过的文本，间隔一段时间才再次更新last_used_at，供清理任务判断是否还在使用
+CONTENT_TOUCH_INTERVAL_SECONDS = 3600
+# 命中缓存后流程直接结束的状态
+CACHE_HIT_CHANNELS = ("hit_e2e_exact_cache", "hit_e2e_simil_cache")
+
+CREATE_CONTENT_BLOBS_SQL = [
+    """CREATE TABLE IF NOT EXISTS checkpoint_content_blobs (
+        content_hash TEXT PRIMARY KEY,
+        content TEXT NOT NULL,
+        created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+        last_used_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    )""",
+    "CREATE INDEX IF NOT EXISTS checkpoint_content_blobs_last_used_at_idx "
+    "ON checkpoint_content_blobs (last_used_at)",
+]
+
+UPSERT_CONTENT_BLOBS_SQL = """INSERT INTO checkpoint_content_blobs (content_hash, content) VALUES (%s, %s)
+ON CONFLICT (content_hash) DO UPDATE SET last_used_at = now()"""
+
+SELECT_CONTENT_BLOBS_SQL = "SELECT content_hash, content FROM checkpoint_content_blobs WHERE content_hash = ANY(%s)"
+
+
+class SlimPostgresSaver(AsyncPostgresSaver):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # 内容哈希 -> (文本, 最近一次写入数据库的时间)
+        self.content_cache: OrderedDict[str, tuple[str, float]] = OrderedDict()
+
+    async def setup(self) -> None:
+        await super().setup()
+        async with self._cursor() as cur:
+            for sql in CREATE_CONTENT_BLOBS_SQL:
+                await cur.execute(sql)
+
+    def cache_content(self, content_hash: str, content: str, touched_at: float):
+        self.content_cache[content_hash] = (content, touched_at)
+        self.content_cache.move_to_end(content_hash)
+        while len(self.content_cache) > settings.CHECKPOINT_CONTENT_BLOB_CACHE_SIZE:
+            self.content_cache.popitem(last=False)
+
+    def to_ref(self, content: str, contents: dict[str, str]) -> str:
+        if len(content) < settings.CHECKPOINT_CONTENT_BLOB_MIN_CHARS or content.startswith(CONTENT_REF_PREFIX):
+            return content
+        content_hash = sha256_hash(content)
+        contents[content_hash] = content
+        return CONTENT_REF_PREFIX + content_hash
+
+    def slim_value(self, value: Any, contents: dict[str, str]) -> Any:
+        """
+        替换字符串、消息内容中的大文本，返回新的对象，不修改图运行中的状态
+        """
+        if isinstance(value, str):
+            return self.to_ref(value, contents)
+        if isinstance(value, BaseMessage) and isinstance(value.content, str):
+            content = self.to_ref(value.content, contents)
+            return value if content is value.content else value.model_copy(update={"content": content})
+        if isinstance(value, list):
+            return [self.slim_value(item, contents) for item in value]
+        return value
+
+    async def store_contents(self, contents: dict[str, str]):
+        now = time.monotonic()
+        rows = []
+        for content_hash, content in contents.items():
+            cached = self.content_cache.get(content_hash)
+            if cached is None or now - cached[1] > CONTENT_TOUCH_INTERVAL_SECONDS:
+                rows.append((content_hash, content))
+                self.cache_content(content_hash, content, now)
+        if rows:
+            async with self._cursor() as cur:
+                await cur.executemany(UPSERT_CONTENT_BLOBS_SQL, rows)
+
+    @staticmethod
+    def collect_refs(value: Any, refs: set[str]):
+        if isinstance(value, str):
+            if value.startswith(CONTENT_REF_PREFIX):
+                refs.add(value[len(CONTENT_REF_PREFIX):])
+        elif isinstance(value, BaseMessage):
+            SlimPostgresSaver.collect_refs(value.content, refs)
+        elif isinstance(value, list):
+            for item in value:
+                SlimPostgresSaver.collect_refs(item, refs)
+
+    def rehydrate_value(self, value: Any, contents: dict[str, str]) -> Any:
+        if isinstance(value, str):
+            if not value.startswith(CONTENT_REF_PREFIX):
+                return value
+            content = contents.get(value[len(CONTENT_REF_PREFIX):])
+            if content is None:
+                logger.warning("Checkpoint content blob %s not found", value)
+                return value
+            return content
+        if isinstance(value, BaseMessage) and isinstance(value.content, str) \
+                and value.content.startswith(CONTENT_REF_PREFIX):
+            return value.model_copy(update={"content": self.rehydrate_value(value.content, contents)})
+        if isinstance(value, list):
+            return [self.rehydrate_value(item, contents) for item in value]
+        return value
+
+    async def load_contents(self, refs: set[str]) -> dict[str, str]:
+        contents = {}
+        missing = []
+        for content_hash in refs:
+            cached = self.content_cache.get(content_hash)
+            if cached is None:
+                missing.append(content_hash)
+            else:
+                contents[content_hash] = cached[0]
+        if missing:
+            async with self._cursor() as cur:
+                await cur.execute(SELECT_CONTENT_BLOBS_SQL, (missing,))
+                for row in await cur.fetchall():
+                    contents[row["content_hash"]] = row["content"]
+                    # 从数据库读取的文本不代表最近写入过，写入时间记为0
+                    self.cache_content(row["content_hash"], row["content"], 0)
+        return contents
+
+    async def rehydrate(self, checkpoint_tuple: CheckpointTuple | None) -> CheckpointTuple | None:
+        if checkpoint_tuple is None:
+            return None
+        refs = set()
+        for value in checkpoint_tuple.checkpoint["channel_values"].values():
+            self.collect_refs(value, refs)
+        for _, _, value in checkpoint_tuple.pending_writes or []:
+            self.collect_refs(value, refs)
+        if not refs:
+            return checkpoint_tuple
+        contents = await self.load_contents(refs)
+        checkpoint = {**checkpoint_tuple.checkpoint,
+                      "channel_values": {channel: self.rehydrate_value(value, contents)
+                                         for channel, value in checkpoint_tuple.checkpoint["channel_values"].items()}}
+        pending_writes = [(task_id, channel, self.rehydrate_value(value, contents))
+                          for task_id, channel, value in checkpoint_tuple.pending_writes or []]
+        return checkpoint_tuple._replace(checkpoint=checkpoint, pending_writes=pending_writes)
+
+    async def aput(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata,
+                   new_versions: ChannelVersions) -> RunnableConfig:
+        channel_values = checkpoint["channel_values"]
+        if any(channel_values.get(channel) for channel in CACHE_HIT_CHANNELS):
+            return {"configurable": {"thread_id": config["configurable"]["thread_id"],
+                                     "checkpoint_ns": config["configurable"].get("checkpoint_ns", ""),
+                                     "checkpoint_id": checkpoint["id"]}}
+        contents = {}
+        slim_checkpoint = {**checkpoint,
+                           "channel_values": {channel: self.slim_value(value, contents)
+                                              for channel, value in channel_values.items()}}
+        await self.store_contents(contents)
+        return await super().aput(config, slim_checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config: RunnableConfig, writes: Sequence[tuple[str, Any]], task_id: str,
+                          task_path: str = "") -> None:
+        if any(channel in CACHE_HIT_CHANNELS and value for channel, value in writes):
+            return
+        contents = {}
+        slim_writes = [(channel, self.slim_value(value, contents)) for channel, value in writes]
+        await self.store_contents(contents)
+        await super().aput_writes(config, slim_writes, task_id, task_path)
+
+    async def aget_tuple(self, config: RunnableConfig) -> CheckpointTuple | None:
+        return await self.rehydrate(await super().aget_tuple(config))
+
+    async def alist(self, config: RunnableConfig | None, *, filter: dict[str, Any] | None = None,
+                    before: RunnableConfig | None = None, limit: int | None = None) -> AsyncIterator[CheckpointTuple]:
+        async for checkpoint_tuple in super().alist(config, filter=filter, before=before, limit=limit):
+            yield await self.rehydrate(checkpoint_tuple)
@@ -0,0 +1,64 @@
+"""
+LLM输出的增量推送
+
+节点调用LLM时以流式方式获取输出，通过LangGraph的custom stream推送给SSE接口:
+    delta: 指定文本字段新增的内容(例如最终输出的说明)，客户端持续拼接
+    partial: 解析到的不完整的结构化结果(例如已经解析出的候选类目)，客户端整体替换
+"""
+import time
+from typing import Callable
+
+from langchain_core.utils.json import parse_json_markdown
+from langgraph.config import get_stream_writer
+
+from app.core.config import settings
+
+STREAM_TYPE_DELTA = "delta"
+STREAM_TYPE_PARTIAL = "partial"
+
+
+class PartialJsonStreamer:
+    """
+    接收LLM累积的输出内容，解析不完整的JSON，内容有变化时推送
+
+    text_field: 指定时只推送该字段新增的文本，否则推送解析到的整个结构(按时间间隔节流)
+    """
+
+    def __init__(self, stage: str, text_field: str | None = None):
+        self.writer = get_stream_writer()
+        self.stage = stage
+        self.text_field = text_field
+        self.sent_text_length = 0
+        self.last_partial = None
+        self.last_sent_at = 0.0
+
+    def __call__(self, content: str, final: bool = False):
+        try:
+            parsed = parse_json_markdown(content)
+        except Exception:
+            return
+        if not isinstance(parsed, dict):
+            return
+        if self.text_field:
+            text = parsed.get(self.text_field)
+            if isinstance(text, str) and len(text) > self.sent_text_length:
+                self.writer({"stage": self.stage, "type": STREAM_TYPE_DELTA,
+                             "content": text[self.sent_text_length:]})
+                self.sent_text_length = len(text)
+            return
+        now = time.monotonic()
+        if parsed == self.last_partial or (
+                not final and now - self.last_sent_at < settings.LLM_STREAM_PARTIAL_INTERVAL_MS / 1000):
+            return
+        self.writer({"stage": self.stage, "type": STREAM_TYPE_PARTIAL, "data": parsed})
+        self.last_partial = parsed
+        self.last_sent_at = now
+
+
+def get_llm_stream_callback(stage: str, text_field: str | None = None) -> Callable[..., None] | None:
+    """
+    未启用流式输出时返回None，LLM按原来的方式一次性调用
+    """
+    if not settings.LLM_STREAMING_ENABLED:
+        return None
+    return PartialJsonStreamer(stage, text_field)
@@ -1,4 +1,5 @@
 import secrets
+from typing import Literal
 
 from pydantic_core import MultiHostUrl
 from pydantic_settings import BaseSettings, SettingsConfigDict
@@ -56,7 +57,48 @@ class Settings(BaseSettings):
     HTS_CURRENT_RELEASE_URL: str = "https://hts.usitc.gov/reststop/currentRelease"
     HTS_EXPORT_CURRENT_JSON_URL: str = "https://hts.usitc.gov/reststop/exportList"
 
+    # WCO网站爬虫: 同一个host的最大并发数、每秒最多请求数、单个请求超时时间(秒)、最多尝试次数、html解析线程数
+    WCO_CRAWLER_MAX_CONCURRENCY: int = 8
+    WCO_CRAWLER_RATE_LIMIT_PER_SECOND: float = 10
+    WCO_CRAWLER_TIMEOUT_SECONDS: float = 30
+    WCO_CRAWLER_MAX_ATTEMPTS: int = 5
+    WCO_CRAWLER_PARSE_WORKERS: int = 2
+
+    # 进程内WCO HS分类树，多久检查一次数据库中的当前版本(秒)，其他worker切换版本后最迟在该时间后生效
+    WCO_HS_TAXONOMY_VERSION_CHECK_SECONDS: int = 60
+    # 进程内HTS税率线树缓存，多久检查一次数据库中的当前版本(秒)
+    HTS_RATE_LINE_TREE_VERSION_CHECK_SECONDS: int = 60
+    # 改写商品的同时使用原始商品信息提前检索chapter: off不检索，merge与改写后的检索结果合并，
+    # reuse直接复用(改写后不再检索，Milvus检索不在关键路径上)
+    EARLY_RETRIEVAL_MODE: Literal["off", "merge", "reuse"] = "off"
+    # 各环节提示词中文档的token预算，超过时按相关度截断；PROMPT_TOKENIZER=dashscope时使用qwen分词器计算token数
+    PROMPT_TOKEN_BUDGET_HEADING: int = 6000
+    PROMPT_TOKEN_BUDGET_SUBHEADING: int = 3000
+    PROMPT_TOKEN_BUDGET_RATE_LINE: int = 3000
+    PROMPT_TOKENIZER: Literal["heuristic", "dashscope"] = "heuristic"
+    # HTS导入时每批插入并提交的行数
+    HTS_IMPORT_BATCH_SIZE: int = 5000
+
     DASHSCOPE_API_KEY: str
+    # DashScope文本向量接口: 单次请求最多的文本数(接口上限10)、同时发送的请求数、单个请求超时时间(秒)、最多尝试次数
+    DASHSCOPE_EMBEDDING_URL: str = \
+        "https://dashscope.aliyuncs.com/api/v1/services/embeddings/text-embedding/text-embedding"
+    DASHSCOPE_EMBEDDING_BATCH_SIZE: int = 10
+    DASHSCOPE_EMBEDDING_MAX_CONCURRENCY: int = 8
+    DASHSCOPE_EMBEDDING_TIMEOUT_SECONDS: float = 30
+    DASHSCOPE_EMBEDDING_MAX_ATTEMPTS: int = 4
+    # 跨请求合并embedding调用: 每批最多的文本数、第一个文本最多等待的时间(毫秒)
+    EMBEDDING_MICRO_BATCH_MAX_SIZE: int = 10
+    EMBEDDING_MICRO_BATCH_MAX_WAIT_MS: float = 5
+    # redis中embedding缓存的过期时间(秒)
+    EMBEDDINGS_CACHE_TTL_SECONDS: int = 30 * 24 * 3600
+    # embedding缓存的key版本号及向量存储类型(float32/float16)，修改编码格式时需要升级版本号
+    EMBEDDINGS_CACHE_KEY_VERSION: str = "v2"
+    EMBEDDINGS_CACHE_DTYPE: str = "float32"
+    # 启动时在后台将旧的JSON格式embedding缓存转换为二进制格式
+    EMBEDDINGS_CACHE_MIGRATE_ON_STARTUP: bool = True
+    # 进程内embedding缓存最多占用的内存(字节)
+    EMBEDDINGS_LOCAL_CACHE_MAX_BYTES: int = 64 * 1024 * 1024
 
     DEEPSEEK_API_KEY: str
 
@@ -69,7 +111,79 @@ class Settings(BaseSettings):
     OPEN_SEARCH_HOSTS: list[str]
     OPEN_SEARCH_USERNAME: str
     OPEN_SEARCH_PASSWORD: str
+    # 共享异步客户端每个节点的连接池大小(连接保持keep-alive复用)、单个请求超时时间(秒)、失败重试次数
+    OPEN_SEARCH_POOL_SIZE: int = 20
+    OPEN_SEARCH_TIMEOUT_SECONDS: float = 5
+    OPEN_SEARCH_MAX_RETRIES: int = 2
+    # 同步客户端只用于索引初始化等管理操作
+    OPEN_SEARCH_SYNC_POOL_SIZE: int = 2
+    OPEN_SEARCH_ADMIN_TIMEOUT_SECONDS: float = 30
+    # e2e相似度缓存的进程内FAISS副本: 是否启用、HNSW参数、拉取新文档的间隔及回溯时间(秒)、每页文档数
+    E2E_CACHE_REPLICA_ENABLED: bool = True
+    E2E_CACHE_REPLICA_HNSW_M: int = 32
+    E2E_CACHE_REPLICA_HNSW_EF_SEARCH: int = 64
+    E2E_CACHE_REPLICA_TAIL_INTERVAL_SECONDS: float = 5
+    E2E_CACHE_REPLICA_TAIL_LOOKBACK_SECONDS: int = 30
+    E2E_CACHE_REPLICA_PAGE_SIZE: int = 500
 
     REDIS_CONNECTION_URL: str
+    # LLM响应缓存: 是否启用、过期时间(秒)、进程内最多缓存的响应数
+    LLM_RESPONSE_CACHE_ENABLED: bool = True
+    LLM_RESPONSE_CACHE_TTL_SECONDS: int = 7 * 24 * 3600
+    LLM_RESPONSE_CACHE_LOCAL_MAX_ENTRIES: int = 1000
+    # 聊天模型注册表: 名称 -> 配置，首次使用时才创建客户端。provider为tongyi/deepseek，其余参数传给模型客户端；
+    # 配置primary/secondary(其他模型的名称)的是对冲模型
+    LLM_MODELS: dict[str, dict[str, str]] = {
+        "base_qwen": {"provider": "tongyi", "model": "qwen-flash"},
+        "qwen_turbo": {"provider": "tongyi", "model": "qwen-turbo"},
+        "qwen_plus": {"provider": "tongyi", "model": "qwen-plus"},
+        "qwen_max": {"provider": "tongyi", "model": "qwen-max-latest"},
+        "deep_seek": {"provider": "deepseek", "model": "deepseek-chat"},
+        # 主模型qwen，备用deepseek，主模型响应慢、失败或者熔断时使用deepseek
+        "hedged_qwen": {"primary": "base_qwen", "secondary": "deep_seek"},
+    }
+    # LLM输出流式推送: 是否启用、推送不完整结构化结果的最小间隔(毫秒)
+    LLM_STREAMING_ENABLED: bool = True
+    LLM_STREAM_PARTIAL_INTERVAL_MS: int = 200
+    # LLM对冲请求: 主模型超过最近调用耗时的p95(样本不足时使用默认值，且不低于最小值)仍未返回时，向备用模型发送同样的请求
+    LLM_HEDGE_ENABLED: bool = True
+    LLM_HEDGE_DEFAULT_DELAY_SECONDS: float = 15
+    LLM_HEDGE_MIN_DELAY_SECONDS: float = 2
+    LLM_HEDGE_MIN_SAMPLES: int = 20
+    # LLM熔断: 连续失败次数达到阈值后熔断，经过恢复时间后放行一次试探请求
+    LLM_CIRCUIT_BREAKER_FAILURE_THRESHOLD: int = 5
+    LLM_CIRCUIT_BREAKER_RECOVERY_SECONDS: float = 30
+    # LLM及embedding请求调度: 每个模型默认的并发上限、每秒请求数(为空时不限制速率，按供应商配额在
+    # LLM_SCHEDULER_MODEL_LIMITS中为具体模型开启)、令牌桶容量，为用户问答保留的并发数
+    LLM_SCHEDULER_DEFAULT_MAX_CONCURRENCY: int = 8
+    LLM_SCHEDULER_DEFAULT_REQUESTS_PER_SECOND: float | None = None
+    LLM_SCHEDULER_DEFAULT_BURST: int = 10
+    LLM_SCHEDULER_INTERACTIVE_RESERVED: int = 2
+    # 按模型名称覆盖默认限制，例如{"qwen-max-latest": {"max_concurrency": 2, "requests_per_second": 1}}
+    LLM_SCHEDULER_MODEL_LIMITS: dict[str, dict[str, float]] = {}
+    # 图运行的checkpoint: 写入时机(sync/async每一步都写入，exit只在运行结束或中断时写入)，
+    # 超过指定字符数的文本(文档、提示词)按内容哈希单独保存一次，checkpoint中只保存引用，进程内缓存的文本数
+    CHECKPOINT_DURABILITY: Literal["sync", "async", "exit"] = "exit"
+    CHECKPOINT_CONTENT_BLOB_MIN_CHARS: int = 1024
+    CHECKPOINT_CONTENT_BLOB_CACHE_SIZE: int = 1000
+    # checkpoint清理: 是否启用、执行间隔(秒)、thread保留天数、空闲多久(分钟)后只保留最新的checkpoint、
+    # 每批处理的thread数、批次之间的间隔(秒)、每次执行最多处理的批次数
+    CHECKPOINT_RETENTION_ENABLED: bool = True
+    CHECKPOINT_RETENTION_INTERVAL_SECONDS: int = 3600
+    CHECKPOINT_RETENTION_DAYS: int = 30
+    CHECKPOINT_COMPACT_IDLE_MINUTES: int = 60
+    CHECKPOINT_RETENTION_BATCH_SIZE: int = 100
+    CHECKPOINT_RETENTION_BATCH_PAUSE_SECONDS: float = 0.5
+    CHECKPOINT_RETENTION_MAX_BATCHES: int = 100
+    # 向量知识库: 启动时数据版本或构建逻辑有变化是否在后台构建，构建失败后重试的间隔(秒)
+    KNOWLEDGE_BUILD_ON_STARTUP: bool = True
+    KNOWLEDGE_BUILD_RETRY_SECONDS: int = 300
+    # 向量知识库: 其他进程正在构建时，检查构建锁是否释放的间隔(秒)
+    KNOWLEDGE_BUILD_LOCK_WAIT_SECONDS: int = 30
+    # 向量知识库构建流水线: 同时进行的LLM扩展数、每批获取embedding及写入milvus的条目数
+    KNOWLEDGE_BUILD_LLM_CONCURRENCY: int = 8
+    KNOWLEDGE_BUILD_BATCH_SIZE: int = 50
+    # 启动时设置redis的maxmemory-policy(例如allkeys-lru)，为空时不修改，托管redis不允许CONFIG命令时忽略
+    REDIS_MAXMEMORY_POLICY: str | None = None
 
 settings = Settings()
\ No newline at end of file
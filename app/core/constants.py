@@ -16,6 +16,9 @@ class IndexName(str, Enum):
 
 
 class RedisKeyPrefix(str, Enum):
+    EMBEDDINGS = "embeddings"
+    LLM_RESPONSE = "llm_response"
+    # 旧的embedding缓存key前缀，只用于迁移
     REWRITTEN_ITEM_EMBEDDINGS = "rewritten_item_embeddings"
     USER_INPUT_EMBEDDINGS = "user_input_embeddings"
 
@@ -23,4 +26,7 @@ class RedisKeyPrefix(str, Enum):
 class MilvusCollectionName(str, Enum):
     KNOWLEDGE_CHAPTER = "hts_knowledge_chapter"
     KNOWLEDGE_HEADING = "hts_knowledge_heading"
-    CACHE_E2E = "hts_cache_e2e"
\ No newline at end of file
+    CACHE_E2E = "hts_cache_e2e"
+
+# 评估运行的thread_id前缀，评估结束后checkpoint立即删除
+EVALUATION_THREAD_ID_PREFIX = "evaluation-"
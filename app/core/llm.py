@@ -1,50 +1,94 @@
+"""
+聊天模型注册表
+
+模型按settings.LLM_MODELS中的配置在首次使用时创建，供应商的客户端(dashscope、openai等)也在此时才导入，
+不增加进程启动及模块导入的耗时。全局无状态模型，所有模型都通过调度器调用，共享各模型的速率及并发限制
+"""
+from typing import Any, Callable
+
+from langchain_core.language_models import BaseChatModel
+
 from app.core.config import settings
-from langchain_community.chat_models import ChatTongyi
-from langchain.callbacks.tracers import ConsoleCallbackHandler
-from langchain_deepseek.chat_models import ChatDeepSeek
-from app.llm.callback.capture_chat_messages import CaptureChatMessagesCallbackHandler
+from app.llm.chat.hedged import HedgedChatModel
+from app.llm.scheduler import ScheduledChatModel
+
+BASE_QWEN = "base_qwen"
+QWEN_TURBO = "qwen_turbo"
+QWEN_PLUS = "qwen_plus"
+QWEN_MAX = "qwen_max"
+DEEP_SEEK = "deep_seek"
+HEDGED_QWEN = "hedged_qwen"
+
+
+def console_callbacks() -> list:
+    from langchain.callbacks.tracers import ConsoleCallbackHandler
+    return [ConsoleCallbackHandler()]
+
 
 ############################# qwen model ######################################
-# 全局无状态模型
-base_qwen_config = dict(
-    model="qwen-flash",
-    api_key=settings.DASHSCOPE_API_KEY,
-    # 任何其它你需要传给 ChatTongyi 的参数比如 temperature, streaming 等
-    callbacks=[ConsoleCallbackHandler()],
-)
-
-base_qwen_llm = ChatTongyi(**base_qwen_config)
-
-qwen_turbo_llm = ChatTongyi(
-    model="qwen-turbo",
-    api_key=settings.DASHSCOPE_API_KEY,
-    callbacks=[ConsoleCallbackHandler()],)
-
-qwen_plus_llm = ChatTongyi(
-    model="qwen-plus",
-    api_key=settings.DASHSCOPE_API_KEY,
-    callbacks=[ConsoleCallbackHandler()],
-)
-
-qwen_max_llm = ChatTongyi(
-    model="qwen-max-latest",
-    api_key=settings.DASHSCOPE_API_KEY,
-    callbacks=[ConsoleCallbackHandler()],
-)
+def create_tongyi_llm(callbacks: list | None = None, **kwargs: Any) -> BaseChatModel:
+    from langchain_community.chat_models import ChatTongyi
+    return ChatTongyi(api_key=settings.DASHSCOPE_API_KEY, callbacks=console_callbacks() + (callbacks or []),
+                      **kwargs)
+
+
+############################# deepseek model ######################################
+def create_deepseek_llm(callbacks: list | None = None, **kwargs: Any) -> BaseChatModel:
+    from langchain_deepseek.chat_models import ChatDeepSeek
+    return ChatDeepSeek(api_key=settings.DEEPSEEK_API_KEY, callbacks=console_callbacks() + (callbacks or []),
+                        **kwargs)
+
+
+LLM_PROVIDERS: dict[str, Callable[..., BaseChatModel]] = {
+    "tongyi": create_tongyi_llm,
+    "deepseek": create_deepseek_llm,
+}
+
+
+def create_llm(name: str, callbacks: list | None = None) -> BaseChatModel:
+    if name not in settings.LLM_MODELS:
+        raise ValueError(f"Unknown llm: {name}")
+    config = dict(settings.LLM_MODELS[name])
+    if "primary" in config:
+        secondary = config.get("secondary")
+        return HedgedChatModel(primary=get_llm(config["primary"]),
+                               secondary=get_llm(secondary) if secondary else None)
+    provider = config.pop("provider")
+    if provider not in LLM_PROVIDERS:
+        raise ValueError(f"Unknown llm provider: {provider}")
+    return ScheduledChatModel(llm=LLM_PROVIDERS[provider](callbacks=callbacks, **config))
+
+
+__llms: dict[str, BaseChatModel] = dict()
+
+
+def get_llm(name: str) -> BaseChatModel:
+    """
+    同一名称共用一个模型实例
+    """
+    if name not in __llms:
+        __llms[name] = create_llm(name)
+    return __llms[name]
+
 
 def get_qwen_llm_with_capture():
+    from app.llm.callback.capture_chat_messages import CaptureChatMessagesCallbackHandler
     capture = CaptureChatMessagesCallbackHandler()
-    cfg = base_qwen_config.copy()
-    cfg["callbacks"] = cfg.get("callbacks", []) + [capture]
-    return ChatTongyi(**cfg), capture
+    return create_llm(BASE_QWEN, callbacks=[capture]), capture
 
 
+# 兼容原有的模块属性，例如from app.core.llm import qwen_max_llm(导入时即创建模型，新代码应使用get_llm)
+__legacy_names = {
+    "base_qwen_llm": BASE_QWEN,
+    "qwen_turbo_llm": QWEN_TURBO,
+    "qwen_plus_llm": QWEN_PLUS,
+    "qwen_max_llm": QWEN_MAX,
+    "deep_seek_llm": DEEP_SEEK,
+    "hedged_qwen_llm": HEDGED_QWEN,
+}
 
 
-############################# deepseek model ######################################
-deep_seek_llm = ChatDeepSeek(
-    model="deepseek-chat",
-    api_key=settings.DEEPSEEK_API_KEY,
-    callbacks=[ConsoleCallbackHandler()],
-)
-
+def __getattr__(name: str) -> BaseChatModel:
+    if name in __legacy_names:
+        return get_llm(__legacy_names[name])
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,113 @@
+"""
+进程内的简单指标统计
+
+每个指标只保留最近window次的记录(调用耗时、提示词token数等)，用于/metrics接口查看平均值及分位数，不依赖外部监控系统
+"""
+import time
+from collections import deque
+from contextlib import contextmanager
+
+DEFAULT_WINDOW_SIZE = 1024
+
+
+class LatencyRecorder:
+    def __init__(self, name: str, window_size: int = DEFAULT_WINDOW_SIZE):
+        self.name = name
+        self.samples: deque[float] = deque(maxlen=window_size)
+        self.count = 0
+        self.error_count = 0
+
+    def observe(self, seconds: float, success: bool = True):
+        self.samples.append(seconds)
+        self.count += 1
+        if not success:
+            self.error_count += 1
+
+    @contextmanager
+    def time(self):
+        """
+        统计with块的耗时，块内抛出异常时记为失败
+        """
+        start = time.perf_counter()
+        success = False
+        try:
+            yield
+            success = True
+        finally:
+            self.observe(time.perf_counter() - start, success)
+
+    def percentile(self, q: float, min_samples: int = 1) -> float | None:
+        """
+        最近window次调用耗时(秒)的分位数，记录数少于min_samples时返回None
+        """
+        if len(self.samples) < min_samples:
+            return None
+        return _percentile(sorted(self.samples), q)
+
+    def snapshot(self) -> dict:
+        samples = sorted(self.samples)
+        result = {"count": self.count, "error_count": self.error_count, "window": len(samples)}
+        if samples:
+            result.update({
+                "avg_ms": round(sum(samples) / len(samples) * 1000, 2),
+                "p50_ms": round(_percentile(samples, 0.50) * 1000, 2),
+                "p95_ms": round(_percentile(samples, 0.95) * 1000, 2),
+                "p99_ms": round(_percentile(samples, 0.99) * 1000, 2),
+                "max_ms": round(samples[-1] * 1000, 2),
+            })
+        return result
+
+
+class ValueRecorder:
+    """
+    记录数值(例如提示词token数)的分布
+    """
+
+    def __init__(self, name: str, window_size: int = DEFAULT_WINDOW_SIZE):
+        self.name = name
+        self.samples: deque[float] = deque(maxlen=window_size)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value: float):
+        self.samples.append(value)
+        self.count += 1
+        self.total += value
+
+    def snapshot(self) -> dict:
+        samples = sorted(self.samples)
+        result = {"count": self.count, "total": self.total, "window": len(samples)}
+        if samples:
+            result.update({
+                "avg": round(sum(samples) / len(samples), 2),
+                "p50": _percentile(samples, 0.50),
+                "p95": _percentile(samples, 0.95),
+                "max": samples[-1],
+            })
+        return result
+
+
+def _percentile(sorted_samples: list[float], q: float) -> float:
+    index = min(len(sorted_samples) - 1, int(q * len(sorted_samples)))
+    return sorted_samples[index]
+
+
+__latency_recorders: dict[str, LatencyRecorder] = dict()
+__value_recorders: dict[str, ValueRecorder] = dict()
+
+
+def get_latency_recorder(name: str) -> LatencyRecorder:
+    if name not in __latency_recorders:
+        __latency_recorders[name] = LatencyRecorder(name)
+    return __latency_recorders[name]
+
+
+def get_value_recorder(name: str) -> ValueRecorder:
+    if name not in __value_recorders:
+        __value_recorders[name] = ValueRecorder(name)
+    return __value_recorders[name]
+
+
+def get_metrics_snapshot() -> dict:
+    return {"latency": {name: recorder.snapshot() for name, recorder in sorted(__latency_recorders.items())},
+            "values": {name: recorder.snapshot() for name, recorder in sorted(__value_recorders.items())}}
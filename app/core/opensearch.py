@@ -9,18 +9,67 @@ from app.core.constants import IndexName, DEFAULT_EMBEDDINGS_DIMENSION
 logger = logging.getLogger(__name__)
 
 
+__async_opensearch_client: AsyncOpenSearch | None = None
+__sync_opensearch_client: OpenSearch | None = None
+
+
+def init_opensearch_clients():
+    """
+    创建共享的OpenSearch客户端，连接池在整个应用生命周期中复用，避免每次请求都重新建立连接及TLS握手
+    """
+    global __async_opensearch_client, __sync_opensearch_client
+    if __async_opensearch_client is None:
+        __async_opensearch_client = AsyncOpenSearch(hosts=settings.OPEN_SEARCH_HOSTS,
+                                                    http_auth=(settings.OPEN_SEARCH_USERNAME,
+                                                               settings.OPEN_SEARCH_PASSWORD),
+                                                    use_ssl=True,
+                                                    verify_certs=False,
+                                                    ssl_show_warn=False,
+                                                    maxsize=settings.OPEN_SEARCH_POOL_SIZE,
+                                                    timeout=settings.OPEN_SEARCH_TIMEOUT_SECONDS,
+                                                    max_retries=settings.OPEN_SEARCH_MAX_RETRIES,
+                                                    retry_on_timeout=True,
+                                                    headers={"Connection": "keep-alive"})
+    if __sync_opensearch_client is None:
+        __sync_opensearch_client = OpenSearch(hosts=settings.OPEN_SEARCH_HOSTS,
+                                              http_auth=(settings.OPEN_SEARCH_USERNAME,
+                                                         settings.OPEN_SEARCH_PASSWORD),
+                                              use_ssl=True,
+                                              verify_certs=False,
+                                              ssl_show_warn=False,
+                                              pool_maxsize=settings.OPEN_SEARCH_SYNC_POOL_SIZE,
+                                              timeout=settings.OPEN_SEARCH_ADMIN_TIMEOUT_SECONDS,
+                                              max_retries=settings.OPEN_SEARCH_MAX_RETRIES,
+                                              retry_on_timeout=True,
+                                              headers={"Connection": "keep-alive"})
+
+
 def get_async_opensearch_client() -> AsyncOpenSearch:
-    return AsyncOpenSearch(hosts=settings.OPEN_SEARCH_HOSTS,
-                           http_auth=(settings.OPEN_SEARCH_USERNAME, settings.OPEN_SEARCH_PASSWORD),
-                           use_ssl=True,
-                           verify_certs=False)
+    """
+    获取共享的异步客户端，不要关闭它(也不要使用async with)，由lifespan统一关闭
+    """
+    if __async_opensearch_client is None:
+        init_opensearch_clients()
+    return __async_opensearch_client
 
 
 def get_sync_opensearch_client() -> OpenSearch:
-    return OpenSearch(hosts=settings.OPEN_SEARCH_HOSTS,
-                      http_auth=(settings.OPEN_SEARCH_USERNAME, settings.OPEN_SEARCH_PASSWORD),
-                      use_ssl=True,
-                      verify_certs=False)
+    """
+    获取共享的同步客户端，只用于索引初始化等管理操作
+    """
+    if __sync_opensearch_client is None:
+        init_opensearch_clients()
+    return __sync_opensearch_client
+
+
+async def close_opensearch_clients():
+    global __async_opensearch_client, __sync_opensearch_client
+    if __async_opensearch_client is not None:
+        await __async_opensearch_client.close()
+        __async_opensearch_client = None
+    if __sync_opensearch_client is not None:
+        __sync_opensearch_client.close()
+        __sync_opensearch_client = None
 
 
 def init_indices(app):
@@ -56,56 +105,56 @@ def init_item_rewrite_index():
     初始化重写商品索引
     """
     index_name = IndexName.ITEM_REWRITE.value
-    with get_sync_opensearch_client() as sync_client:
-        if sync_client.indices.exists(index=index_name):
-            logger.debug(f"OpenSearch索引{index_name}已存在")
-        else:
-            body = {
-                "settings": {
-                    "index": {
-                        "number_of_shards": 1,
-                        "number_of_replicas": 1,
-                        "knn": True
-                    }
-                },
-                "mappings": {
-                    "properties": {
-                        "origin_item_name": {
-                            "type": "keyword",
-                        },
-                        "origin_item_ch_name": {
-                            "type": "text",
-                            "analyzer": "ik_smart"
-                        },
-                        "origin_item_ch_name_vector": {
-                            "type": "knn_vector",
-                            "dimension": DEFAULT_EMBEDDINGS_DIMENSION,
-                            "space_type": "cosinesimil",
-                        },
-                        "origin_item_en_name": {
-                            "type": "text",
-                            "analyzer": "standard"
-                        },
-                        "origin_item_en_name_vector": {
-                            "type": "knn_vector",
-                            "dimension": DEFAULT_EMBEDDINGS_DIMENSION,
-                            "space_type": "cosinesimil",
-                        },
-                        "rewritten_item": rewritten_item_body,
-                        "user_id": {
-                            "type": "keyword"
-                        },
-                        "thread_id": {
-                            "type": "keyword"
-                        },
-                        "created_at": {
-                            "type": "date"
-                        }
+    sync_client = get_sync_opensearch_client()
+    if sync_client.indices.exists(index=index_name):
+        logger.debug(f"OpenSearch索引{index_name}已存在")
+    else:
+        body = {
+            "settings": {
+                "index": {
+                    "number_of_shards": 1,
+                    "number_of_replicas": 1,
+                    "knn": True
+                }
+            },
+            "mappings": {
+                "properties": {
+                    "origin_item_name": {
+                        "type": "keyword",
+                    },
+                    "origin_item_ch_name": {
+                        "type": "text",
+                        "analyzer": "ik_smart"
+                    },
+                    "origin_item_ch_name_vector": {
+                        "type": "knn_vector",
+                        "dimension": DEFAULT_EMBEDDINGS_DIMENSION,
+                        "space_type": "cosinesimil",
+                    },
+                    "origin_item_en_name": {
+                        "type": "text",
+                        "analyzer": "standard"
+                    },
+                    "origin_item_en_name_vector": {
+                        "type": "knn_vector",
+                        "dimension": DEFAULT_EMBEDDINGS_DIMENSION,
+                        "space_type": "cosinesimil",
+                    },
+                    "rewritten_item": rewritten_item_body,
+                    "user_id": {
+                        "type": "keyword"
+                    },
+                    "thread_id": {
+                        "type": "keyword"
+                    },
+                    "created_at": {
+                        "type": "date"
                     }
                 }
             }
-            sync_client.indices.create(index=index_name, body=body)
-            logger.debug(f"OpenSearch索引{index_name}创建成功")
+        }
+        sync_client.indices.create(index=index_name, body=body)
+        logger.debug(f"OpenSearch索引{index_name}创建成功")
 
 
 def init_heading_classify_result_index():
@@ -113,47 +162,47 @@ def init_heading_classify_result_index():
     初始化商品heading分类结果索引
     """
     index_name = IndexName.HEADING_CLASSIFY.value
-    with get_sync_opensearch_client() as sync_client:
-        if sync_client.indices.exists(index=index_name):
-            logger.debug(f"OpenSearch索引{index_name}已存在")
-        else:
-            heading = {
-                "properties": {
-                    "heading_code": {"type": "keyword"},
-                    "heading_title": {"type": "text"},
-                    "reason": {"type": "text"},
-                    "confidence_score": {"type": "text"},
-                }
+    sync_client = get_sync_opensearch_client()
+    if sync_client.indices.exists(index=index_name):
+        logger.debug(f"OpenSearch索引{index_name}已存在")
+    else:
+        heading = {
+            "properties": {
+                "heading_code": {"type": "keyword"},
+                "heading_title": {"type": "text"},
+                "reason": {"type": "text"},
+                "confidence_score": {"type": "text"},
             }
-            body = {
-                "settings": {
-                    "index": {
-                        "number_of_shards": 1,
-                        "number_of_replicas": 1,
-                        "knn": True
-                    }
-                },
-                "mappings": {
-                    "properties": {
-                        "origin_item_name": {
-                            "type": "keyword",
-                        },
-                        "rewritten_item": rewritten_item_body,
-                        "rewritten_item_vector": {
-                            "type": "knn_vector",
-                            "dimension": DEFAULT_EMBEDDINGS_DIMENSION,
-                            "space_type": "cosinesimil",
-                        },
-                        "chapter_codes": {"type": "keyword"},
-                        "alternative_headings": heading,
-                        "created_at": {
-                            "type": "date"
-                        }
+        }
+        body = {
+            "settings": {
+                "index": {
+                    "number_of_shards": 1,
+                    "number_of_replicas": 1,
+                    "knn": True
+                }
+            },
+            "mappings": {
+                "properties": {
+                    "origin_item_name": {
+                        "type": "keyword",
+                    },
+                    "rewritten_item": rewritten_item_body,
+                    "rewritten_item_vector": {
+                        "type": "knn_vector",
+                        "dimension": DEFAULT_EMBEDDINGS_DIMENSION,
+                        "space_type": "cosinesimil",
+                    },
+                    "chapter_codes": {"type": "keyword"},
+                    "alternative_headings": heading,
+                    "created_at": {
+                        "type": "date"
                     }
                 }
             }
-            sync_client.indices.create(index=index_name, body=body)
-            logger.debug(f"OpenSearch索引{index_name}创建成功")
+        }
+        sync_client.indices.create(index=index_name, body=body)
+        logger.debug(f"OpenSearch索引{index_name}创建成功")
 
 
 def init_subheading_classify_result_index():
@@ -161,48 +210,48 @@ def init_subheading_classify_result_index():
     初始化商品subheading分类结果索引
     """
     index_name = IndexName.SUBHEADING_CLASSIFY.value
-    with get_sync_opensearch_client() as sync_client:
-        if sync_client.indices.exists(index=index_name):
-            logger.debug(f"OpenSearch索引{index_name}已存在")
-        else:
-            subheading = {
-                "properties": {
-                    "subheading_code": {"type": "keyword"},
-                    "subheading_title": {"type": "text"},
-                    "reason": {"type": "text"},
-                    "confidence_score": {"type": "text"},
-                }
+    sync_client = get_sync_opensearch_client()
+    if sync_client.indices.exists(index=index_name):
+        logger.debug(f"OpenSearch索引{index_name}已存在")
+    else:
+        subheading = {
+            "properties": {
+                "subheading_code": {"type": "keyword"},
+                "subheading_title": {"type": "text"},
+                "reason": {"type": "text"},
+                "confidence_score": {"type": "text"},
             }
-            body = {
-                "settings": {
-                    "index": {
-                        "number_of_shards": 1,
-                        "number_of_replicas": 1,
-                        "knn": True
-                    }
-                },
-                "mappings": {
-                    "properties": {
-                        "origin_item_name": {
-                            "type": "keyword",
-                        },
-                        "rewritten_item": rewritten_item_body,
-                        "rewritten_item_vector": {
-                            "type": "knn_vector",
-                            "dimension": DEFAULT_EMBEDDINGS_DIMENSION,
-                            "space_type": "cosinesimil",
-                        },
-                        "heading_codes": {"type": "keyword"},
-                        "main_subheading": subheading,
-                        "alternative_subheadings": subheading,
-                        "created_at": {
-                            "type": "date"
-                        }
+        }
+        body = {
+            "settings": {
+                "index": {
+                    "number_of_shards": 1,
+                    "number_of_replicas": 1,
+                    "knn": True
+                }
+            },
+            "mappings": {
+                "properties": {
+                    "origin_item_name": {
+                        "type": "keyword",
+                    },
+                    "rewritten_item": rewritten_item_body,
+                    "rewritten_item_vector": {
+                        "type": "knn_vector",
+                        "dimension": DEFAULT_EMBEDDINGS_DIMENSION,
+                        "space_type": "cosinesimil",
+                    },
+                    "heading_codes": {"type": "keyword"},
+                    "main_subheading": subheading,
+                    "alternative_subheadings": subheading,
+                    "created_at": {
+                        "type": "date"
                     }
                 }
             }
-            sync_client.indices.create(index=index_name, body=body)
-            logger.debug(f"OpenSearch索引{index_name}创建成功")
+        }
+        sync_client.indices.create(index=index_name, body=body)
+        logger.debug(f"OpenSearch索引{index_name}创建成功")
 
 
 def init_rate_line_classify_result_index():
@@ -210,47 +259,47 @@ def init_rate_line_classify_result_index():
     初始化商品RateLine分类结果索引
     """
     index_name = IndexName.RATE_LINE_CLASSIFY.value
-    with get_sync_opensearch_client() as sync_client:
-        if sync_client.indices.exists(index=index_name):
-            logger.debug(f"OpenSearch索引{index_name}已存在")
-        else:
-            body = {
-                "settings": {
-                    "index": {
-                        "number_of_shards": 1,
-                        "number_of_replicas": 1,
-                        "knn": True
-                    }
-                },
-                "mappings": {
-                    "properties": {
-                        "origin_item_name": {
-                            "type": "keyword",
-                        },
-                        "rewritten_item": rewritten_item_body,
-                        "rewritten_item_vector": {
-                            "type": "knn_vector",
-                            "dimension": DEFAULT_EMBEDDINGS_DIMENSION,
-                            "space_type": "cosinesimil",
-                        },
-                        "subheading_codes": {"type": "keyword"},
-                        "rate_line_result": {
-                            "properties": {
-                                "rate_line_code": {"type": "keyword"},
-                                "rate_line_title": {"type": "keyword"},
-                                "reason": {"type": "keyword"},
-                                "confidence_score": {"type": "keyword"},
-                                "disqualification_others_reason": {"type": "keyword"},
-                            }
-                        },
-                        "created_at": {
-                            "type": "date"
+    sync_client = get_sync_opensearch_client()
+    if sync_client.indices.exists(index=index_name):
+        logger.debug(f"OpenSearch索引{index_name}已存在")
+    else:
+        body = {
+            "settings": {
+                "index": {
+                    "number_of_shards": 1,
+                    "number_of_replicas": 1,
+                    "knn": True
+                }
+            },
+            "mappings": {
+                "properties": {
+                    "origin_item_name": {
+                        "type": "keyword",
+                    },
+                    "rewritten_item": rewritten_item_body,
+                    "rewritten_item_vector": {
+                        "type": "knn_vector",
+                        "dimension": DEFAULT_EMBEDDINGS_DIMENSION,
+                        "space_type": "cosinesimil",
+                    },
+                    "subheading_codes": {"type": "keyword"},
+                    "rate_line_result": {
+                        "properties": {
+                            "rate_line_code": {"type": "keyword"},
+                            "rate_line_title": {"type": "keyword"},
+                            "reason": {"type": "keyword"},
+                            "confidence_score": {"type": "keyword"},
+                            "disqualification_others_reason": {"type": "keyword"},
                         }
+                    },
+                    "created_at": {
+                        "type": "date"
                     }
                 }
             }
-            sync_client.indices.create(index=index_name, body=body)
-            logger.debug(f"OpenSearch索引{index_name}创建成功")
+        }
+        sync_client.indices.create(index=index_name, body=body)
+        logger.debug(f"OpenSearch索引{index_name}创建成功")
 
 
 def init_e2e_cache_index():
@@ -258,40 +307,40 @@ def init_e2e_cache_index():
     初始化商品RateLine分类结果索引
     """
     index_name = IndexName.CLASSIFY_E2E_CACHE.value
-    with get_sync_opensearch_client() as sync_client:
-        if sync_client.indices.exists(index=index_name):
-            logger.debug(f"OpenSearch索引{index_name}已存在")
-        else:
-            body = {
-                "settings": {
-                    "index": {
-                        "number_of_shards": 1,
-                        "number_of_replicas": 1,
-                        "knn": True
-                    }
-                },
-                "mappings": {
-                    "properties": {
-                        "origin_item_name": {
-                            "type": "keyword",
-                        },
-                        "rewritten_item": rewritten_item_body,
-                        "rewritten_item_vector": {
-                            "type": "knn_vector",
-                            "dimension": DEFAULT_EMBEDDINGS_DIMENSION,
-                            "space_type": "cosinesimil",
-                        },
-                        "rate_line_code": {"type": "keyword"},
-                        "rate_line_title": {"type": "text"},
-                        "final_description": {"type": "text"},
-                        "created_at": {
-                            "type": "date"
-                        }
+    sync_client = get_sync_opensearch_client()
+    if sync_client.indices.exists(index=index_name):
+        logger.debug(f"OpenSearch索引{index_name}已存在")
+    else:
+        body = {
+            "settings": {
+                "index": {
+                    "number_of_shards": 1,
+                    "number_of_replicas": 1,
+                    "knn": True
+                }
+            },
+            "mappings": {
+                "properties": {
+                    "origin_item_name": {
+                        "type": "keyword",
+                    },
+                    "rewritten_item": rewritten_item_body,
+                    "rewritten_item_vector": {
+                        "type": "knn_vector",
+                        "dimension": DEFAULT_EMBEDDINGS_DIMENSION,
+                        "space_type": "cosinesimil",
+                    },
+                    "rate_line_code": {"type": "keyword"},
+                    "rate_line_title": {"type": "text"},
+                    "final_description": {"type": "text"},
+                    "created_at": {
+                        "type": "date"
                     }
                 }
             }
-            sync_client.indices.create(index=index_name, body=body)
-            logger.debug(f"OpenSearch索引{index_name}创建成功")
+        }
+        sync_client.indices.create(index=index_name, body=body)
+        logger.debug(f"OpenSearch索引{index_name}创建成功")
 
 
 
@@ -306,43 +355,43 @@ def init_evaluate_retrieve_heading_index():
     初始化用于评估章节检索是否准确的索引
     """
     index_name = IndexName.EVALUATE_RETRIEVE_HEADING.value
-    with get_sync_opensearch_client() as sync_client:
-        if sync_client.indices.exists(index=index_name):
-            logger.debug(f"OpenSearch索引{index_name}已存在")
-        else:
-            body = {
-                "settings": {
-                    "index": {
-                        "number_of_shards": 1,
-                        "number_of_replicas": 1,
-                    }
-                },
-                "mappings": {
-                    "properties": {
-                        "evaluate_version": {
-                            "type": "keyword",
-                        },
-                        "origin_item_name": {
-                            "type": "keyword",
-                        },
-                        "rewritten_item": rewritten_item_body,
-                        "candidate_heading_codes": {
-                            "type": "keyword",
-                        },
-                        "actual_heading": {
-                            "type": "keyword"
-                        },
-                        "matches": {
-                            "type": "boolean"
-                        },
-                        "created_at": {
-                            "type": "date"
-                        }
+    sync_client = get_sync_opensearch_client()
+    if sync_client.indices.exists(index=index_name):
+        logger.debug(f"OpenSearch索引{index_name}已存在")
+    else:
+        body = {
+            "settings": {
+                "index": {
+                    "number_of_shards": 1,
+                    "number_of_replicas": 1,
+                }
+            },
+            "mappings": {
+                "properties": {
+                    "evaluate_version": {
+                        "type": "keyword",
+                    },
+                    "origin_item_name": {
+                        "type": "keyword",
+                    },
+                    "rewritten_item": rewritten_item_body,
+                    "candidate_heading_codes": {
+                        "type": "keyword",
+                    },
+                    "actual_heading": {
+                        "type": "keyword"
+                    },
+                    "matches": {
+                        "type": "boolean"
+                    },
+                    "created_at": {
+                        "type": "date"
                     }
                 }
             }
-            sync_client.indices.create(index=index_name, body=body)
-            logger.debug(f"OpenSearch索引{index_name}创建成功")
+        }
+        sync_client.indices.create(index=index_name, body=body)
+        logger.debug(f"OpenSearch索引{index_name}创建成功")
 
 
 def init_evaluate_llm_confirm_heading_index():
@@ -350,55 +399,55 @@ def init_evaluate_llm_confirm_heading_index():
     初始化用于评估LLM决策类目是否准确的索引
     """
     index_name = IndexName.EVALUATE_LLM_CONFIRM_HEADING.value
-    with get_sync_opensearch_client() as sync_client:
-        if sync_client.indices.exists(index=index_name):
-            logger.debug(f"OpenSearch索引{index_name}已存在")
-        else:
-            heading_detail = {
-                "properties": {
-                    "heading_code": {"type": "keyword"},
-                    "heading_title": {"type": "text"},
-                    "reason": {"type": "text"},
-                    "confidence_score": {"type": "float"},
-                }
+    sync_client = get_sync_opensearch_client()
+    if sync_client.indices.exists(index=index_name):
+        logger.debug(f"OpenSearch索引{index_name}已存在")
+    else:
+        heading_detail = {
+            "properties": {
+                "heading_code": {"type": "keyword"},
+                "heading_title": {"type": "text"},
+                "reason": {"type": "text"},
+                "confidence_score": {"type": "float"},
             }
-            body = {
-                "settings": {
-                    "index": {
-                        "number_of_shards": 1,
-                        "number_of_replicas": 1,
-                    }
-                },
-                "mappings": {
-                    "properties": {
-                        "evaluate_version": {
-                            "type": "keyword",
-                        },
-                        "origin_item_name": {
-                            "type": "keyword",
-                        },
-                        "heading_documents": {
-                            "type": "text"
-                        },
-                        "llm_response": {
-                            "properties": {
-                                "alternative_headings": heading_detail,
-                            }
-                        },
-                        "actual_heading": {
-                            "type": "keyword"
-                        },
-                        "matches": {
-                            "type": "boolean"
-                        },
-                        "created_at": {
-                            "type": "date"
+        }
+        body = {
+            "settings": {
+                "index": {
+                    "number_of_shards": 1,
+                    "number_of_replicas": 1,
+                }
+            },
+            "mappings": {
+                "properties": {
+                    "evaluate_version": {
+                        "type": "keyword",
+                    },
+                    "origin_item_name": {
+                        "type": "keyword",
+                    },
+                    "heading_documents": {
+                        "type": "text"
+                    },
+                    "llm_response": {
+                        "properties": {
+                            "alternative_headings": heading_detail,
                         }
+                    },
+                    "actual_heading": {
+                        "type": "keyword"
+                    },
+                    "matches": {
+                        "type": "boolean"
+                    },
+                    "created_at": {
+                        "type": "date"
                     }
                 }
             }
-            sync_client.indices.create(index=index_name, body=body)
-            logger.debug(f"OpenSearch索引{index_name}创建成功")
+        }
+        sync_client.indices.create(index=index_name, body=body)
+        logger.debug(f"OpenSearch索引{index_name}创建成功")
 
 
 def init_evaluate_llm_confirm_subheading_index():
@@ -406,57 +455,57 @@ def init_evaluate_llm_confirm_subheading_index():
     初始化用于评估LLM决策子目是否准确的索引
     """
     index_name = IndexName.EVALUATE_LLM_CONFIRM_SUBHEADING.value
-    with get_sync_opensearch_client() as sync_client:
-        if sync_client.indices.exists(index=index_name):
-            logger.debug(f"OpenSearch索引{index_name}已存在")
-        else:
-            subheading_detail = {
-                "properties": {
-                    "subheading_code": {"type": "keyword"},
-                    "subheading_title": {"type": "text"},
-                    "reason": {"type": "text"},
-                    "confidence_score": {"type": "float"},
-                }
+    sync_client = get_sync_opensearch_client()
+    if sync_client.indices.exists(index=index_name):
+        logger.debug(f"OpenSearch索引{index_name}已存在")
+    else:
+        subheading_detail = {
+            "properties": {
+                "subheading_code": {"type": "keyword"},
+                "subheading_title": {"type": "text"},
+                "reason": {"type": "text"},
+                "confidence_score": {"type": "float"},
             }
-            body = {
-                "settings": {
-                    "index": {
-                        "number_of_shards": 1,
-                        "number_of_replicas": 1,
-                    }
-                },
-                "mappings": {
-                    "properties": {
-                        "evaluate_version": {
-                            "type": "keyword",
-                        },
-                        "origin_item_name": {
-                            "type": "keyword",
-                        },
-                        "subheading_documents": {
-                            "type": "text"
-                        },
-                        "llm_response": {
-                            "properties": {
-                                "main_subheading": subheading_detail,
-                                "alternative_subheadings": subheading_detail,
-                                "reason": {"type": "text"},
-                            }
-                        },
-                        "actual_subheading": {
-                            "type": "keyword"
-                        },
-                        "matches": {
-                            "type": "boolean"
-                        },
-                        "created_at": {
-                            "type": "date"
+        }
+        body = {
+            "settings": {
+                "index": {
+                    "number_of_shards": 1,
+                    "number_of_replicas": 1,
+                }
+            },
+            "mappings": {
+                "properties": {
+                    "evaluate_version": {
+                        "type": "keyword",
+                    },
+                    "origin_item_name": {
+                        "type": "keyword",
+                    },
+                    "subheading_documents": {
+                        "type": "text"
+                    },
+                    "llm_response": {
+                        "properties": {
+                            "main_subheading": subheading_detail,
+                            "alternative_subheadings": subheading_detail,
+                            "reason": {"type": "text"},
                         }
+                    },
+                    "actual_subheading": {
+                        "type": "keyword"
+                    },
+                    "matches": {
+                        "type": "boolean"
+                    },
+                    "created_at": {
+                        "type": "date"
                     }
                 }
             }
-            sync_client.indices.create(index=index_name, body=body)
-            logger.debug(f"OpenSearch索引{index_name}创建成功")
+        }
+        sync_client.indices.create(index=index_name, body=body)
+        logger.debug(f"OpenSearch索引{index_name}创建成功")
 
 
 def init_evaluate_llm_confirm_rate_line_index():
@@ -464,42 +513,42 @@ def init_evaluate_llm_confirm_rate_line_index():
     初始化用于评估LLM决策税率线是否准确的索引
     """
     index_name = IndexName.EVALUATE_LLM_CONFIRM_RATE_LINE.value
-    with get_sync_opensearch_client() as sync_client:
-        if sync_client.indices.exists(index=index_name):
-            logger.debug(f"OpenSearch索引{index_name}已存在")
-        else:
-            body = {
-                "settings": {
-                    "index": {
-                        "number_of_shards": 1,
-                        "number_of_replicas": 1,
-                    }
-                },
-                "mappings": {
-                    "properties": {
-                        "evaluate_version": {
-                            "type": "keyword",
-                        },
-                        "origin_item_name": {
-                            "type": "keyword",
-                        },
-                        "rate_line_documents": {
-                            "type": "text"
-                        },
-                        "llm_response": {
-                            "properties": {
-                                "rate_line_code": {"type": "keyword"},
-                                "rate_line_title": {"type": "keyword"},
-                                "reason": {"type": "keyword"},
-                                "confidence_score": {"type": "keyword"},
-                                "disqualification_others_reason": {"type": "keyword"},
-                            }
-                        },
-                        "created_at": {
-                            "type": "date"
+    sync_client = get_sync_opensearch_client()
+    if sync_client.indices.exists(index=index_name):
+        logger.debug(f"OpenSearch索引{index_name}已存在")
+    else:
+        body = {
+            "settings": {
+                "index": {
+                    "number_of_shards": 1,
+                    "number_of_replicas": 1,
+                }
+            },
+            "mappings": {
+                "properties": {
+                    "evaluate_version": {
+                        "type": "keyword",
+                    },
+                    "origin_item_name": {
+                        "type": "keyword",
+                    },
+                    "rate_line_documents": {
+                        "type": "text"
+                    },
+                    "llm_response": {
+                        "properties": {
+                            "rate_line_code": {"type": "keyword"},
+                            "rate_line_title": {"type": "keyword"},
+                            "reason": {"type": "keyword"},
+                            "confidence_score": {"type": "keyword"},
+                            "disqualification_others_reason": {"type": "keyword"},
                         }
+                    },
+                    "created_at": {
+                        "type": "date"
                     }
                 }
             }
-            sync_client.indices.create(index=index_name, body=body)
-            logger.debug(f"OpenSearch索引{index_name}创建成功")
+        }
+        sync_client.indices.create(index=index_name, body=body)
+        logger.debug(f"OpenSearch索引{index_name}创建成功")
@@ -1,7 +1,12 @@
+import logging
+
 import redis.asyncio
+from redis.exceptions import ResponseError
 
 from app.core.config import settings
 
+logger = logging.getLogger(__name__)
+
 async_redis: redis.asyncio.Redis | None = None
 
 async def init_async_redis():
@@ -9,6 +14,19 @@ async def init_async_redis():
     if async_redis is None:
         async_redis_pool = redis.asyncio.ConnectionPool.from_url(settings.REDIS_CONNECTION_URL)
         async_redis = redis.asyncio.Redis(connection_pool=async_redis_pool)
+        await apply_maxmemory_policy(async_redis)
+
+
+async def apply_maxmemory_policy(client: redis.asyncio.Redis):
+    """
+    embedding缓存等数据量较大，设置淘汰策略避免redis内存无限增长
+    """
+    if not settings.REDIS_MAXMEMORY_POLICY:
+        return
+    try:
+        await client.config_set("maxmemory-policy", settings.REDIS_MAXMEMORY_POLICY)
+    except ResponseError as e:
+        logger.warning("Set redis maxmemory-policy failed: %s", e)
 
 async def get_async_redis():
     if not async_redis:
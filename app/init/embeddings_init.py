@@ -1,7 +1,6 @@
 """
 构建用于检索商品所属分类的向量数据库
 """
-import asyncio
 import json
 import logging
 
@@ -9,96 +8,77 @@ from pymilvus import AsyncMilvusClient
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.core.constants import MilvusCollectionName
-from app.llm.embedding import default_embeddings_service
+from app.init.knowledge_pipeline import KnowledgePipeline, MILVUS_MAX_QUERY_LIMIT
+from app.llm.scheduler import Priority, with_priority
 from app.model.milvus.knowledge_model import ChapterKnowledge, HeadingKnowledge
 from app.service.wco_hs_service import get_current_version_chapters, get_headings_by_chapter_code
 from app.llm.chain.expand_hs_title import get_chapter_extends, get_heading_extends
-from app.schema.llm.llm import HeadingExtends
+from app.schema.llm.llm import ChapterExtends, HeadingExtends
 
 logger = logging.getLogger(__name__)
 
 
+def chapter_to_record(item: dict, extends: ChapterExtends) -> dict:
+    return ChapterKnowledge(chapter_code=item["chapter_code"], chapter_title=item["chapter_title"],
+                            section_code=item["section_code"],
+                            includes=extends.includes, common_examples=extends.common_examples,
+                            content=extends.model_dump_json()).model_dump()
+
+
+def heading_to_record(item: dict, extends: HeadingExtends) -> dict:
+    description = json.dumps({
+        "heading_title": item["heading_title"],
+        "includes": extends.includes,
+        "common_examples": extends.common_examples,
+    }, ensure_ascii=False)
+    return HeadingKnowledge(heading_code=item["heading_code"], heading_title=item["heading_title"],
+                            heading_includes=extends.includes, heading_common_examples=extends.common_examples,
+                            heading_description=description, heading_description_vector=[],
+                            chapter_code=item["chapter_code"], chapter_title=item["chapter_title"],
+                            chapter_description=item["chapter_description"]).model_dump()
+
+
+@with_priority(Priority.BACKGROUND)
 async def build_chapter_knowledge_collection(session: AsyncSession, async_milvus_client: AsyncMilvusClient):
     chapters = await get_current_version_chapters(session)
-    # 从LLM将chapter信息补充完整
-    for index, chapter in enumerate(chapters):
-        # 索引已经存在的编码不再重复初始化
-        filtered_docs = await async_milvus_client.query(collection_name=MilvusCollectionName.KNOWLEDGE_CHAPTER.value,
-                                                        filter=f"chapter_code=='{chapter.chapter_code}'",
-                                                        limit=1)
-        if filtered_docs:
-            logger.debug("Skip init exist expend of chapter: %s", chapter.chapter_code)
-            continue
-
-        logger.info("Start init expend of chapter: %s", chapter.chapter_code)
-        extends = await get_chapter_extends(chapter.chapter_title)
+    items = []
+    for chapter in chapters:
         section = await chapter.awaitable_attrs.section
-        content = extends.model_dump_json()
-        data = ChapterKnowledge(chapter_code=chapter.chapter_code, chapter_title=chapter.chapter_title,
-                                section_code=section.section_code,
-                                includes=extends.includes, common_examples=extends.common_examples,
-                                content=content,
-                                content_vector=await default_embeddings_service.get_embeddings_for_str(content, False))
-        await async_milvus_client.insert(collection_name=MilvusCollectionName.KNOWLEDGE_CHAPTER.value,
-                                         data=[data.model_dump()])
+        items.append({"chapter_code": chapter.chapter_code, "chapter_title": chapter.chapter_title,
+                      "section_code": section.section_code})
+    # 从LLM将chapter信息补充完整，索引中内容一致的编码不再重复初始化
+    pipeline = KnowledgePipeline(async_milvus_client, MilvusCollectionName.KNOWLEDGE_CHAPTER,
+                                 code_field="chapter_code", record_fields=("chapter_title", "section_code"),
+                                 input_fields=("chapter_title",),
+                                 extends_type=ChapterExtends,
+                                 expand=lambda item: get_chapter_extends(item["chapter_title"]),
+                                 to_record=chapter_to_record,
+                                 text_field="content", vector_field="content_vector")
+    await pipeline.run(items)
 
 
+@with_priority(Priority.BACKGROUND)
 async def build_heading_knowledge_collection(session: AsyncSession, async_milvus_client: AsyncMilvusClient):
     """
     构建混合的heading(在heading中挂在chapter信息)
     """
     chapters = await async_milvus_client.query(collection_name=MilvusCollectionName.KNOWLEDGE_CHAPTER.value,
-                                               limit=100,
+                                               limit=MILVUS_MAX_QUERY_LIMIT,
                                                output_fields=["chapter_code", "chapter_title", "content"])
+    items = []
     for chapter in chapters:
-        chapter_code = chapter["chapter_code"]
-        chapter_title = chapter["chapter_title"]
-        chapter_description = chapter["content"]
         # 获取chapter下的章节列表
-        headings = await get_headings_by_chapter_code(session, chapter_code)
-        if headings:
-            data = []
-            for heading in headings:
-                data.append(HeadingKnowledge(heading_code=heading.heading_code,
-                                             heading_title=heading.heading_title,
-                                             heading_description="{}",
-                                             heading_description_vector=[],
-                                             chapter_code=chapter_code,
-                                             chapter_title=chapter_title,
-                                             chapter_description=chapter_description)
-                            .model_dump())
-
-            # 去除已经初始化过的heading
-            exist_headings = await async_milvus_client.query(
-                collection_name=MilvusCollectionName.KNOWLEDGE_HEADING.value,
-                filter=f"chapter_code=='{chapter_code}'",
-                output_fields=["heading_code"],
-                limit=1000)
-            if exist_headings:
-                exists_heading_codes = [heading["heading_code"] for heading in exist_headings]
-                data = [d for d in data if d["heading_code"] not in exists_heading_codes]
-            if data:
-                group_size = 10
-                grouped_data = [data[i:i + group_size] for i in range(0, len(data), group_size)]
-                for group in grouped_data:
-                    # 批量获取heading 补充信息
-                    tasks = []
-                    for heading in group:
-                        tasks.append(get_heading_extends(chapter_title, heading["heading_title"]))
-                    result: list[HeadingExtends] = await asyncio.gather(*tasks)
-                    # 将结果更新到 heading
-                    for i, heading_extend in enumerate(result):
-                        group[i].update({"heading_includes": heading_extend.includes})
-                        group[i].update({"heading_common_examples": heading_extend.common_examples})
-                        description = json.dumps({
-                            "heading_title": group[i]["heading_title"],
-                            "includes": heading_extend.includes,
-                            "common_examples": heading_extend.common_examples,
-                        }, ensure_ascii=False)
-                        description_vector = await default_embeddings_service.get_embeddings_for_str(description, False)
-                        group[i].update({"heading_description": description})
-                        group[i].update({"heading_description_vector": description_vector})
-                    # 批量插入索引
-                    await async_milvus_client.insert(
-                        collection_name=MilvusCollectionName.KNOWLEDGE_HEADING.value,
-                        data=group)
+        headings = await get_headings_by_chapter_code(session, chapter["chapter_code"])
+        for heading in headings or []:
+            items.append({"heading_code": heading.heading_code, "heading_title": heading.heading_title,
+                          "chapter_code": chapter["chapter_code"], "chapter_title": chapter["chapter_title"],
+                          "chapter_description": chapter["content"]})
+    pipeline = KnowledgePipeline(async_milvus_client, MilvusCollectionName.KNOWLEDGE_HEADING,
+                                 code_field="heading_code",
+                                 record_fields=("heading_title", "chapter_code", "chapter_title", "chapter_description"),
+                                 input_fields=("chapter_title", "heading_title"),
+                                 extends_type=HeadingExtends,
+                                 expand=lambda item: get_heading_extends(item["chapter_title"], item["heading_title"]),
+                                 to_record=heading_to_record,
+                                 text_field="heading_description", vector_field="heading_description_vector")
+    await pipeline.run(items)
@@ -0,0 +1,194 @@
+"""
+向量知识库的分阶段构建流水线
+
+    1. 比较: 一次查询collection中已有的记录，与当前条目一致的记录保留；源数据中已经删除的编码先从collection中删除，
+       内容变化或由旧版本构建逻辑写入的条目重新处理，新的记录写入后再删除旧的记录，替换期间仍然可以检索到该编码
+    2. 扩展: 有并发上限地调用LLM补充信息，结果写入构建日志(knowledge_build_journal)，中断后重新构建时直接使用日志中的结果
+    3. 向量: 扩展完成的条目攒够一批后一次批量获取embedding
+    4. 写入: 每批一次写入milvus，删除被替换的旧记录，并在日志中标记为已写入
+扩展与向量、写入之间通过队列连接，同时进行；个别条目扩展失败不影响其他条目，全部处理完成后再抛出
+"""
+import asyncio
+import json
+import logging
+from typing import Awaitable, Callable
+
+from pydantic import BaseModel
+from pymilvus import AsyncMilvusClient
+
+from app.core.config import settings
+from app.core.constants import MilvusCollectionName
+from app.db.session import AsyncSessionLocal
+from app.llm.embedding import default_embeddings_service
+from app.repo.knowledge_build_repo import select_journal_entries, insert_journal_entry, update_journal_status
+from app.util.hash_utils import sha256_hash
+
+logger = logging.getLogger(__name__)
+
+# 构建逻辑(提示词、embedding模型、记录结构)变化时修改，写入记录的build_version字段，版本不一致的记录会重新构建
+KNOWLEDGE_BUILD_VERSION = "1"
+# 写入build_version字段之前构建的记录视为第1版
+INITIAL_BUILD_VERSION = "1"
+
+JOURNAL_STATUS_EXPANDED = "expanded"
+JOURNAL_STATUS_INSERTED = "inserted"
+# milvus单次查询返回的最大条数
+MILVUS_MAX_QUERY_LIMIT = 16384
+
+
+class KnowledgePipeline:
+    """
+    collection: 写入的collection
+    code_field: 条目编码的字段，用于判断是否已经写入
+    record_fields: 从条目复制到记录中的字段，与已有记录比较，不一致时重新写入该编码
+    input_fields: LLM扩展使用的字段，这些字段及构建逻辑版本不变时复用日志中的扩展结果
+    expand: 调用LLM扩展条目
+    to_record: 由条目及扩展结果生成写入milvus的记录(不含向量)
+    text_field/vector_field: 记录中获取embedding的文本字段及向量字段
+    """
+
+    def __init__(self, client: AsyncMilvusClient, collection: MilvusCollectionName, code_field: str,
+                 record_fields: tuple[str, ...], input_fields: tuple[str, ...], extends_type: type[BaseModel],
+                 expand: Callable[[dict], Awaitable[BaseModel]], to_record: Callable[[dict, BaseModel], dict],
+                 text_field: str, vector_field: str):
+        self.client = client
+        self.collection = collection
+        self.code_field = code_field
+        self.record_fields = record_fields
+        self.input_fields = input_fields
+        self.extends_type = extends_type
+        self.expand = expand
+        self.to_record = to_record
+        self.text_field = text_field
+        self.vector_field = vector_field
+
+    def input_hash(self, item: dict) -> str:
+        return sha256_hash(json.dumps([KNOWLEDGE_BUILD_VERSION, *(item[field] for field in self.input_fields)],
+                                      ensure_ascii=False))
+
+    def is_current(self, item: dict, record: dict) -> bool:
+        return (record.get("build_version", INITIAL_BUILD_VERSION) == KNOWLEDGE_BUILD_VERSION
+                and all(record.get(field) == item[field] for field in self.record_fields))
+
+    async def select_existing_records(self) -> dict[str, list[dict]]:
+        """
+        按编码分组返回已有的记录(只含主键及比较的字段)
+        """
+        records = await self.client.query(collection_name=self.collection.value,
+                                          output_fields=["id", self.code_field, "build_version", *self.record_fields],
+                                          limit=MILVUS_MAX_QUERY_LIMIT)
+        existing: dict[str, list[dict]] = {}
+        for record in records:
+            existing.setdefault(record[self.code_field], []).append(record)
+        return existing
+
+    async def delete_records(self, ids: list[int]):
+        if ids:
+            await self.client.delete(collection_name=self.collection.value, ids=ids)
+
+    def compare(self, items: list[dict],
+                existing: dict[str, list[dict]]) -> tuple[list[tuple[dict, list[int]]], list[int]]:
+        """
+        返回(需要写入的条目及其替换的旧记录id, 需要删除的记录id)
+
+        需要删除的记录包括源数据中已经删除的编码，以及同一编码重复写入的多余记录
+        """
+        codes = {item[self.code_field] for item in items}
+        deleted_ids = [record["id"] for code, records in existing.items() if code not in codes for record in records]
+        pending = []
+        for item in items:
+            records = existing.get(item[self.code_field], [])
+            current = next((record for record in records if self.is_current(item, record)), None)
+            if current is None:
+                pending.append((item, [record["id"] for record in records]))
+            else:
+                deleted_ids.extend(record["id"] for record in records if record is not current)
+        return pending, deleted_ids
+
+    async def expand_item(self, item: dict, replaced_ids: list[int], journal: dict[tuple[str, str], tuple[int, str]],
+                          semaphore: asyncio.Semaphore) -> tuple[int, dict, list[int]]:
+        """
+        返回(日志id, 待写入的记录, 替换的旧记录id)
+        """
+        code = item[self.code_field]
+        input_hash = self.input_hash(item)
+        if (code, input_hash) in journal:
+            entry_id, expansion = journal[(code, input_hash)]
+            return entry_id, self.to_record(item, self.extends_type.model_validate_json(expansion)), replaced_ids
+        async with semaphore:
+            logger.info("Start expand %s: %s", self.collection.value, code)
+            extends = await self.expand(item)
+        async with AsyncSessionLocal() as session:
+            async with session.begin():
+                entry = await insert_journal_entry(session, self.collection.value, code, input_hash,
+                                                   extends.model_dump_json(), JOURNAL_STATUS_EXPANDED)
+        return entry.id, self.to_record(item, extends), replaced_ids
+
+    async def insert_batch(self, batch: list[tuple[int, dict, list[int]]]):
+        records = [{**record, "build_version": KNOWLEDGE_BUILD_VERSION} for _, record, _ in batch]
+        vectors = await default_embeddings_service.get_embeddings_for_list(
+            [record[self.text_field] for record in records], False)
+        for record, vector in zip(records, vectors):
+            record[self.vector_field] = vector
+        await self.client.insert(collection_name=self.collection.value, data=records)
+        await self.delete_records([record_id for _, _, replaced_ids in batch for record_id in replaced_ids])
+        async with AsyncSessionLocal() as session:
+            async with session.begin():
+                await update_journal_status(session, [entry_id for entry_id, _, _ in batch], JOURNAL_STATUS_INSERTED)
+        logger.info("Inserted %s records into %s", len(records), self.collection.value)
+
+    async def run(self, items: list[dict]) -> int:
+        """
+        返回写入的条数
+        """
+        pending, deleted_ids = self.compare(items, await self.select_existing_records())
+        if deleted_ids:
+            logger.info("Delete %s outdated records from %s", len(deleted_ids), self.collection.value)
+            await self.delete_records(deleted_ids)
+        if not pending:
+            logger.debug("Skip build %s, all items are up to date", self.collection.value)
+            return 0
+        async with AsyncSessionLocal() as session:
+            entries = await select_journal_entries(session, self.collection.value,
+                                                   [item[self.code_field] for item, _ in pending])
+        journal = {(entry.item_code, entry.input_hash): (entry.id, entry.expansion) for entry in entries}
+        logger.info("Start build %s: %s items (%s replaced), %s expanded before", self.collection.value, len(pending),
+                    sum(1 for _, replaced_ids in pending if replaced_ids),
+                    sum(1 for item, _ in pending if (item[self.code_field], self.input_hash(item)) in journal))
+
+        queue: asyncio.Queue[tuple[int, dict, list[int]] | None] = asyncio.Queue()
+        semaphore = asyncio.Semaphore(settings.KNOWLEDGE_BUILD_LLM_CONCURRENCY)
+
+        async def expand_and_enqueue(item: dict, replaced_ids: list[int]):
+            queue.put_nowait(await self.expand_item(item, replaced_ids, journal, semaphore))
+
+        async def produce() -> list[BaseException]:
+            try:
+                results = await asyncio.gather(*(expand_and_enqueue(item, replaced_ids)
+                                                 for item, replaced_ids in pending),
+                                               return_exceptions=True)
+            finally:
+                queue.put_nowait(None)
+            return [result for result in results if isinstance(result, BaseException)]
+
+        producer = asyncio.create_task(produce())
+        inserted = 0
+        batch = []
+        try:
+            while (entry := await queue.get()) is not None:
+                batch.append(entry)
+                if len(batch) >= settings.KNOWLEDGE_BUILD_BATCH_SIZE:
+                    await self.insert_batch(batch)
+                    inserted += len(batch)
+                    batch = []
+            if batch:
+                await self.insert_batch(batch)
+                inserted += len(batch)
+        except BaseException:
+            producer.cancel()
+            raise
+        errors = await producer
+        if errors:
+            logger.warning("Expand %s items of %s failed: %s", len(errors), self.collection.value, errors[0])
+            raise errors[0]
+        return inserted
@@ -6,7 +6,7 @@ from langchain_core.prompts import PromptTemplate
 
 from app.schema.llm.llm import ChapterExtends, HeadingExtends
 from app.llm.prompt.prompt_template import expend_chapter_template, expend_heading_template
-from app.core.llm import qwen_max_llm
+from app.core.llm import get_llm, QWEN_MAX
 
 
 async def get_chapter_extends(title: str) -> ChapterExtends:
@@ -17,7 +17,7 @@ async def get_chapter_extends(title: str) -> ChapterExtends:
         input_variables=["title"],
         partial_variables={"format_instructions": format_instructions}
     )
-    chain = prompt | qwen_max_llm | pydantic_parser
+    chain = prompt | get_llm(QWEN_MAX) | pydantic_parser
     return await chain.ainvoke({"title": title})
 
 
@@ -29,5 +29,5 @@ async def get_heading_extends(chapter_title: str, heading_title: str) -> Heading
         input_variables=["chapter_title", "heading_title"],
         partial_variables={"format_instructions": format_instructions}
     )
-    chain = prompt | qwen_max_llm | pydantic_parser
+    chain = prompt | get_llm(QWEN_MAX) | pydantic_parser
     return await chain.ainvoke({"chapter_title": chapter_title, "heading_title": heading_title})
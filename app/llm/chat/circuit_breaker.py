@@ -0,0 +1,89 @@
+"""
+LLM供应商熔断器
+
+连续失败次数达到阈值后进入熔断(open)状态，熔断期间不再向该供应商发送请求；经过恢复时间后进入半开(half_open)
+状态，只放行一个试探请求，试探成功后恢复(closed)，失败则重新熔断
+"""
+import time
+
+from app.core.config import settings
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """
+    熔断期间拒绝请求
+    """
+
+
+class CircuitBreaker:
+
+    def __init__(self, name: str, failure_threshold: int, recovery_seconds: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_seconds = recovery_seconds
+        self.consecutive_failures = 0
+        self.opened_at: float | None = None
+        self.trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return STATE_CLOSED
+        if time.monotonic() - self.opened_at >= self.recovery_seconds:
+            return STATE_HALF_OPEN
+        return STATE_OPEN
+
+    def is_available(self) -> bool:
+        """
+        只检查是否可以发送请求，不占用半开状态的试探名额
+        """
+        state = self.state
+        return state == STATE_CLOSED or (state == STATE_HALF_OPEN and not self.trial_in_flight)
+
+    def acquire(self):
+        """
+        发送请求前调用，半开状态下占用试探名额，不允许发送时抛出CircuitOpenError
+        """
+        if not self.is_available():
+            raise CircuitOpenError(f"Circuit breaker {self.name} is open")
+        if self.state == STATE_HALF_OPEN:
+            self.trial_in_flight = True
+
+    def record_success(self):
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        if self.trial_in_flight or self.consecutive_failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+        self.trial_in_flight = False
+
+    def release(self):
+        """
+        请求被取消(例如对冲请求中较慢的一方)，不计入成功或失败，只释放试探名额
+        """
+        self.trial_in_flight = False
+
+    def snapshot(self) -> dict:
+        return {"state": self.state, "consecutive_failures": self.consecutive_failures}
+
+
+__circuit_breakers: dict[str, CircuitBreaker] = dict()
+
+
+def get_circuit_breaker(name: str) -> CircuitBreaker:
+    if name not in __circuit_breakers:
+        __circuit_breakers[name] = CircuitBreaker(name,
+                                                  failure_threshold=settings.LLM_CIRCUIT_BREAKER_FAILURE_THRESHOLD,
+                                                  recovery_seconds=settings.LLM_CIRCUIT_BREAKER_RECOVERY_SECONDS)
+    return __circuit_breakers[name]
+
+
+def get_circuit_breaker_states() -> dict:
+    return {name: breaker.snapshot() for name, breaker in sorted(__circuit_breakers.items())}
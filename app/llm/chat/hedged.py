@@ -0,0 +1,201 @@
+"""
+对冲请求的聊天模型
+
+先向主模型发送请求，超过主模型最近调用耗时的p95仍未返回(或者已经失败)时，向备用模型发送同样的请求，
+使用先返回的结果并取消另一个请求。每个供应商有独立的熔断器，熔断的供应商不再参与请求。
+流式调用以首个片段的耗时判断是否对冲，选定供应商后不再切换
+耗时及对冲延迟都从调度器中获得并发后开始计算，限流排队不会触发对冲；被对冲取消的请求以已经执行的时间计入耗时统计
+"""
+import asyncio
+import logging
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, TypeVar
+
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import BaseMessage, BaseMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from app.core.config import settings
+from app.core.metrics import get_latency_recorder
+from app.llm.chat.circuit_breaker import get_circuit_breaker, CircuitOpenError
+from app.llm.scheduler import ScheduledChatModel, on_slot_acquired
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+def get_llm_name(llm: BaseChatModel) -> str:
+    return getattr(llm, "model_name", None) or getattr(llm, "model", None) or type(llm).__name__
+
+
+class HedgedChatModel(BaseChatModel):
+    primary: BaseChatModel
+    secondary: BaseChatModel | None = None
+
+    @property
+    def _llm_type(self) -> str:
+        return "hedged-chat-model"
+
+    @property
+    def model_name(self) -> str:
+        # 与主模型使用同一个名称，LLM响应缓存的key不受影响
+        return get_llm_name(self.primary)
+
+    def candidate_models(self) -> list[BaseChatModel]:
+        """
+        未熔断的模型，主模型在前；全部熔断时直接拒绝请求
+        """
+        models = [model for model in (self.primary, self.secondary) if model is not None]
+        available = [model for model in models if get_circuit_breaker(get_llm_name(model)).is_available()]
+        if not available:
+            raise CircuitOpenError(f"All llm providers are unavailable: {[get_llm_name(m) for m in models]}")
+        return available
+
+    @staticmethod
+    def hedge_delay(metric_name: str) -> float:
+        p95 = get_latency_recorder(metric_name).percentile(0.95, settings.LLM_HEDGE_MIN_SAMPLES)
+        if p95 is None:
+            return settings.LLM_HEDGE_DEFAULT_DELAY_SECONDS
+        return max(p95, settings.LLM_HEDGE_MIN_DELAY_SECONDS)
+
+    @staticmethod
+    async def call_model(model_call: "ModelCall", call: Callable[[BaseChatModel], Awaitable[T]], metric: str) -> T:
+        """
+        通过熔断器调用模型并记录耗时(从调度器中获得并发开始计算，不包括排队时间)，被取消的请求不计入成功或失败
+        """
+        model = model_call.model
+        breaker = get_circuit_breaker(get_llm_name(model))
+        breaker.acquire()
+        recorder = get_latency_recorder(f"llm.{get_llm_name(model)}{metric}")
+        if not isinstance(model, ScheduledChatModel):
+            # 不经过调度器的模型没有排队时间
+            model_call.on_started()
+        try:
+            with on_slot_acquired(model_call.on_started):
+                result = await call(model)
+        except asyncio.CancelledError:
+            breaker.release()
+            raise
+        except Exception:
+            if model_call.started_at is not None:
+                recorder.observe(model_call.elapsed(), success=False)
+            breaker.record_failure()
+            raise
+        recorder.observe(model_call.elapsed())
+        breaker.record_success()
+        return result
+
+    async def hedge(self, call: Callable[[BaseChatModel], Awaitable[T]], metric: str = "",
+                    discard: Callable[[T], Awaitable[Any]] | None = None) -> T:
+        """
+        metric: 耗时指标的后缀，用于区分完整调用与流式调用的首个片段
+        discard: 两个请求同时成功时，用于释放未被使用的结果
+        """
+        models = self.candidate_models()
+        if not settings.LLM_HEDGE_ENABLED or len(models) == 1:
+            return await self.call_model(ModelCall(models[0]), call, metric)
+
+        calls = [ModelCall(models[0])]
+        tasks = [asyncio.ensure_future(self.call_model(calls[0], call, metric))]
+        winner = None
+        try:
+            # 主模型在调度器中排队(限流)的时间不计入对冲延迟，开始调用后才计时
+            started = asyncio.ensure_future(calls[0].started.wait())
+            try:
+                await asyncio.wait([tasks[0], started], return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                started.cancel()
+            await asyncio.wait(tasks, timeout=self.hedge_delay(f"llm.{get_llm_name(models[0])}{metric}"))
+            if tasks[0].done() and tasks[0].exception() is None:
+                winner = tasks[0]
+                return winner.result()
+            # 主模型超时未返回或者已经失败，向备用模型发送请求
+            logger.info("Hedge llm request from %s to %s", get_llm_name(models[0]), get_llm_name(models[1]))
+            calls.append(ModelCall(models[1]))
+            tasks.append(asyncio.ensure_future(self.call_model(calls[1], call, metric)))
+            errors = [tasks[0].exception()] if tasks[0].done() else []
+            pending = {task for task in tasks if not task.done()}
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        winner = task
+                        return winner.result()
+                    errors.append(task.exception())
+            raise errors[0]
+        finally:
+            for model_call, task in zip(calls, tasks):
+                if not task.done():
+                    task.cancel()
+                    # 被取消的请求已经执行的时间是它耗时的下限，同样计入统计，
+                    # 否则只剩下较快的调用，p95持续下降，对冲的请求越来越多
+                    if winner is not None and model_call.started_at is not None:
+                        get_latency_recorder(f"llm.{get_llm_name(model_call.model)}{metric}").observe(
+                            model_call.elapsed())
+                elif (discard and task is not winner and not task.cancelled()
+                      and task.exception() is None):
+                    await discard(task.result())
+
+    async def _agenerate(self, messages: list[BaseMessage], stop: list[str] | None = None,
+                         run_manager: AsyncCallbackManagerForLLMRun | None = None, **kwargs: Any) -> ChatResult:
+        message = await self.hedge(lambda model: model.ainvoke(messages, stop=stop, **kwargs))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _generate(self, messages: list[BaseMessage], stop: list[str] | None = None,
+                  run_manager: CallbackManagerForLLMRun | None = None, **kwargs: Any) -> ChatResult:
+        # 同步调用不做对冲，只跳过熔断的模型
+        model = self.candidate_models()[0]
+        message = model.invoke(messages, stop=stop, **kwargs)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _astream(self, messages: list[BaseMessage], stop: list[str] | None = None,
+                       run_manager: AsyncCallbackManagerForLLMRun | None = None,
+                       **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        iterator, chunk = await self.hedge(lambda model: open_stream(model, messages, stop=stop, **kwargs),
+                                           metric=".first_chunk", discard=close_stream)
+        try:
+            while chunk is not None:
+                generation_chunk = ChatGenerationChunk(message=chunk)
+                if run_manager:
+                    await run_manager.on_llm_new_token(chunk.content, chunk=generation_chunk)
+                yield generation_chunk
+                chunk = await anext(iterator, None)
+        finally:
+            await iterator.aclose()
+
+
+class ModelCall:
+    """
+    一次模型调用，记录在调度器中获得并发(开始调用模型)的时间
+    """
+
+    def __init__(self, model: BaseChatModel):
+        self.model = model
+        self.started = asyncio.Event()
+        self.started_at: float | None = None
+
+    def on_started(self):
+        self.started_at = time.perf_counter()
+        self.started.set()
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started_at if self.started_at is not None else 0.0
+
+
+async def open_stream(model: BaseChatModel, messages: list[BaseMessage],
+                      **kwargs: Any) -> tuple[AsyncIterator[BaseMessageChunk], BaseMessageChunk | None]:
+    """
+    开始流式调用并等待首个片段
+    """
+    iterator = model.astream(messages, **kwargs)
+    try:
+        return iterator, await anext(iterator, None)
+    except BaseException:
+        await iterator.aclose()
+        raise
+
+
+async def close_stream(result: tuple[AsyncIterator[BaseMessageChunk], BaseMessageChunk | None]):
+    await result[0].aclose()
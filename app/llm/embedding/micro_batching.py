@@ -0,0 +1,85 @@
+"""
+跨请求合并embedding调用
+
+并发的图运行各自为改写商品、中文名称、英文名称单独调用aembed_query，接口本身支持批量，
+这里把几毫秒内所有协程提交的文本收集起来合并成一次批量请求，再把结果分别返回给各个调用方
+"""
+import asyncio
+import logging
+from typing import List
+
+from langchain.embeddings.base import Embeddings
+
+from app.core.config import settings
+from app.llm.embedding.qwen import default_qwen_embeddings
+from app.llm.scheduler import Priority, get_request_priority, request_priority
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatchingEmbeddings(Embeddings):
+
+    def __init__(self, embeddings: Embeddings, max_batch_size: int, max_wait_ms: float):
+        self.embeddings = embeddings
+        self.max_batch_size = max_batch_size
+        self.max_wait_seconds = max_wait_ms / 1000
+        self._pending: list[tuple[str, asyncio.Future, Priority]] = []
+        self._flush_handle: asyncio.TimerHandle | None = None
+        # 保存正在执行的批次任务的引用，避免任务被垃圾回收
+        self._running_batches: set[asyncio.Task] = set()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embeddings.embed_query(text)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, future, get_request_priority()))
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.max_wait_seconds, self._flush)
+        return await future
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        # 本身已经是一整批的直接请求，少量文本与其他请求合并
+        if len(texts) >= self.max_batch_size:
+            return await self.embeddings.aembed_documents(texts)
+        return list(await asyncio.gather(*(self.aembed_query(text) for text in texts)))
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.get_running_loop().create_task(self._embed_batch(batch))
+            self._running_batches.add(task)
+            task.add_done_callback(self._running_batches.discard)
+
+    async def _embed_batch(self, batch: list[tuple[str, asyncio.Future, Priority]]):
+        # 同一批次中相同的文本只请求一次
+        texts = list(dict.fromkeys(text for text, _, _ in batch))
+        try:
+            # 合并后的批次使用其中最高的优先级，用户请求不会因为和后台任务合并而被延后
+            with request_priority(min(priority for _, _, priority in batch)):
+                vectors = await self.embeddings.aembed_documents(texts)
+        except Exception as e:
+            logger.warning("Embedding batch of %s texts failed: %s", len(texts), e)
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        vector_dict = dict(zip(texts, vectors))
+        for text, future, _ in batch:
+            # 调用方已经取消(例如缓存查询已命中)时跳过
+            if not future.done():
+                future.set_result(list(vector_dict[text]))
+
+
+default_batching_embeddings = MicroBatchingEmbeddings(default_qwen_embeddings,
+                                                      max_batch_size=settings.EMBEDDING_MICRO_BATCH_MAX_SIZE,
+                                                      max_wait_ms=settings.EMBEDDING_MICRO_BATCH_MAX_WAIT_MS)
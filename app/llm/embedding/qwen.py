@@ -1,47 +1,132 @@
-from langchain.embeddings.base import Embeddings
+import asyncio
+import logging
 from typing import List
-import dashscope
+
+import httpx
+from langchain.embeddings.base import Embeddings
+from tenacity import retry, stop_after_attempt, wait_exponential_jitter, retry_if_exception
 
 from app.core.config import settings
 from app.core import constants
+from app.core.metrics import get_latency_recorder
+from app.llm.scheduler import get_model_scheduler
+
+logger = logging.getLogger(__name__)
+
+
+def is_transient_error(e: BaseException) -> bool:
+    """
+    网络异常、超时、429(限流)以及5xx可以重试，其他错误直接抛出
+    """
+    if isinstance(e, httpx.HTTPStatusError):
+        return e.response.status_code == 429 or e.response.status_code >= 500
+    return isinstance(e, httpx.TransportError)
+
+
+# 指数退避并增加随机抖动，避免同时被限流的批次一起重试
+embedding_retry = retry(stop=stop_after_attempt(settings.DASHSCOPE_EMBEDDING_MAX_ATTEMPTS),
+                        wait=wait_exponential_jitter(initial=0.5, max=10),
+                        retry=retry_if_exception(is_transient_error),
+                        reraise=True)
 
 
 class QwenEmbeddings(Embeddings):
+    """
+    直接调用DashScope文本向量HTTP接口
+
+    同步和异步各使用一个长连接的http客户端，批量请求按接口上限分组后并发发送
+    """
+
     def __init__(self, api_key: str, model_name: str = "text-embedding-v4", dimension: int = 1024):
-        dashscope.api_key = api_key
+        self.api_key = api_key
         self.model_name = model_name
         self.dimension = dimension
+        self.url = settings.DASHSCOPE_EMBEDDING_URL
+        self.group_size = settings.DASHSCOPE_EMBEDDING_BATCH_SIZE
+        self.max_concurrency = settings.DASHSCOPE_EMBEDDING_MAX_CONCURRENCY
+        self.latency = get_latency_recorder(f"embedding.{model_name}")
+        self._client: httpx.Client | None = None
+        self._async_client: httpx.AsyncClient | None = None
+
+    def _client_kwargs(self) -> dict:
+        return dict(headers={"Authorization": f"Bearer {self.api_key}"},
+                    timeout=httpx.Timeout(settings.DASHSCOPE_EMBEDDING_TIMEOUT_SECONDS),
+                    limits=httpx.Limits(max_connections=self.max_concurrency,
+                                        max_keepalive_connections=self.max_concurrency))
+
+    def get_client(self) -> httpx.Client:
+        if self._client is None:
+            self._client = httpx.Client(**self._client_kwargs())
+        return self._client
+
+    def get_async_client(self) -> httpx.AsyncClient:
+        if self._async_client is None:
+            self._async_client = httpx.AsyncClient(**self._client_kwargs())
+        return self._async_client
+
+    async def aclose(self):
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+
+    def _request_body(self, texts: List[str]) -> dict:
+        return {"model": self.model_name,
+                "input": {"texts": texts},
+                "parameters": {"dimension": self.dimension}}
+
+    @staticmethod
+    def _parse_response(response: httpx.Response, size: int) -> List[List[float]]:
+        response.raise_for_status()
+        output = response.json().get("output") or {}
+        embeddings = sorted(output.get("embeddings") or [], key=lambda e: e["text_index"])
+        if len(embeddings) != size:
+            raise ValueError(f"Embedding 请求失败: {response.text}")
+        return [e["embedding"] for e in embeddings]
+
+    def _group(self, texts: List[str]) -> List[List[str]]:
+        return [texts[i:i + self.group_size] for i in range(0, len(texts), self.group_size)]
+
+    @embedding_retry
+    def _embed_group(self, texts: List[str]) -> List[List[float]]:
+        with self.latency.time():
+            response = self.get_client().post(self.url, json=self._request_body(texts))
+            return self._parse_response(response, len(texts))
+
+    @embedding_retry
+    async def _aembed_group(self, texts: List[str]) -> List[List[float]]:
+        # 与LLM请求共用调度器，按当前上下文的优先级排队
+        async with get_model_scheduler(self.model_name, max_concurrency=self.max_concurrency).slot():
+            with self.latency.time():
+                response = await self.get_async_client().post(self.url, json=self._request_body(texts))
+                return self._parse_response(response, len(texts))
 
     def embed_documents(self, texts: List[str]) -> List[List[float]]:
         """批量生成文本的 Embeddings"""
         embeddings = []
-        group_size = 10
-        grouped_texts = [texts[i:i + group_size] for i in range(0, len(texts), group_size)]
-        for grouped in grouped_texts:
-            resp = dashscope.TextEmbedding.call(
-                model=self.model_name,
-                input=grouped,
-                dimension=self.dimension
-            )
-            if resp.status_code == 200:
-                for output_embedding in resp.output["embeddings"]:
-                    embeddings.append(output_embedding["embedding"])
-            else:
-                raise ValueError(f"Embedding 请求失败: {resp.message}")
+        for grouped in self._group(texts):
+            embeddings.extend(self._embed_group(grouped))
         return embeddings
 
     def embed_query(self, text: str) -> List[float]:
         """生成单个查询文本的 Embedding"""
-        resp = dashscope.TextEmbedding.call(
-            model=self.model_name,
-            input=text,
-            dimension=self.dimension
-        )
-        if resp.status_code == 200:
-            return resp.output["embeddings"][0]["embedding"]
-        else:
-            raise ValueError(f"Embedding 请求失败: {resp.message}")
+        return self._embed_group([text])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        """批量生成文本的 Embeddings，各组并发请求(并发数及速率受调度器限制)，结果保持输入顺序"""
+        grouped_embeddings = await asyncio.gather(*(self._aembed_group(grouped) for grouped in self._group(texts)))
+        return [embedding for embeddings in grouped_embeddings for embedding in embeddings]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        """生成单个查询文本的 Embedding"""
+        return (await self._aembed_group([text]))[0]
 
 
 default_qwen_embeddings = QwenEmbeddings(api_key=settings.DASHSCOPE_API_KEY,
                                          dimension=constants.DEFAULT_EMBEDDINGS_DIMENSION)
+
+
+async def close_qwen_embeddings():
+    await default_qwen_embeddings.aclose()
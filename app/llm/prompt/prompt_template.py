@@ -80,10 +80,10 @@ determine_heading_template = """
 **税号范围说明**:
    - 数据以`chapter:chapter_title`为键名，对应章节的`heading`列表为值
    - 每个税号包含以下字段:
-     - heading_code: 4位税号
-     - heading_title: 类目标题
-     - heading_includes: 常见的商品分类列表
-     - heading_common_examples:常见的商品示例列表
+     - c: 4位税号(heading_code)
+     - t: 类目标题(heading_title)
+     - i: 常见的商品分类列表(heading_includes)
+     - e: 常见的商品示例列表(heading_common_examples)
 
 **税号范围**:
 
@@ -0,0 +1,262 @@
+"""
+LLM及embedding请求调度
+
+所有模型请求按模型名称排队，每个模型有独立的并发上限(按配置开启令牌桶限制请求速率)，排队的请求按优先级放行:
+    INTERACTIVE: 用户问答(默认)
+    BATCH: 评估等批量任务
+    BACKGROUND: 知识库构建等后台任务
+同一优先级按先后顺序放行，并为INTERACTIVE保留一部分并发，批量及后台任务不会占满所有并发
+"""
+import asyncio
+import heapq
+import itertools
+import time
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from enum import IntEnum
+from functools import wraps
+from typing import Any, AsyncIterator, Callable
+
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from app.core.config import settings
+from app.core.metrics import get_latency_recorder, get_value_recorder
+
+
+class Priority(IntEnum):
+    INTERACTIVE = 0
+    BATCH = 1
+    BACKGROUND = 2
+
+
+__request_priority: ContextVar[Priority] = ContextVar("request_priority", default=Priority.INTERACTIVE)
+
+
+def get_request_priority() -> Priority:
+    return __request_priority.get()
+
+
+@contextmanager
+def request_priority(priority: Priority):
+    """
+    with块内(包括块内创建的任务)发起的模型请求使用指定的优先级
+    """
+    token = __request_priority.set(priority)
+    try:
+        yield
+    finally:
+        __request_priority.reset(token)
+
+
+def with_priority(priority: Priority):
+    """
+    异步函数内发起的模型请求使用指定的优先级
+    """
+
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            with request_priority(priority):
+                return await func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+__slot_listener: ContextVar[Callable[[], None] | None] = ContextVar("slot_listener", default=None)
+
+
+@contextmanager
+def on_slot_acquired(callback: Callable[[], None]):
+    """
+    with块内的模型请求在调度器中获得并发(结束排队、开始调用模型)时调用callback，用于排除排队时间统计模型耗时
+    """
+    token = __slot_listener.set(callback)
+    try:
+        yield
+    finally:
+        __slot_listener.reset(token)
+
+
+def notify_slot_acquired():
+    listener = __slot_listener.get()
+    if listener is not None:
+        listener()
+
+
+class TokenBucket:
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def time_until_available(self) -> float:
+        self.refill()
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self):
+        self.tokens -= 1
+
+
+class ModelScheduler:
+
+    def __init__(self, name: str, max_concurrency: int, requests_per_second: float | None, burst: int,
+                 interactive_reserved: int):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        # 并发上限较小时至少给批量及后台任务留一个
+        self.shared_concurrency = max(1, max_concurrency - interactive_reserved)
+        # 没有配置速率时只限制并发
+        self.bucket = TokenBucket(requests_per_second, burst) if requests_per_second else None
+        self.running = 0
+        # (优先级, 序号, future)，序号保证同一优先级先进先出
+        self.waiters: list[tuple[int, int, asyncio.Future]] = []
+        self.sequence = itertools.count()
+        self.timer: asyncio.TimerHandle | None = None
+
+    def queue_depth(self) -> dict[str, int]:
+        depth = {priority.name.lower(): 0 for priority in Priority}
+        for priority, _, future in self.waiters:
+            if not future.done():
+                depth[Priority(priority).name.lower()] += 1
+        return depth
+
+    def dispatch(self):
+        while self.waiters:
+            priority, _, future = self.waiters[0]
+            if future.done():
+                # 已经取消的请求
+                heapq.heappop(self.waiters)
+                continue
+            limit = self.max_concurrency if priority == Priority.INTERACTIVE else self.shared_concurrency
+            if self.running >= limit:
+                return
+            if self.bucket is not None:
+                wait_seconds = self.bucket.time_until_available()
+                if wait_seconds > 0:
+                    if self.timer is None:
+                        self.timer = asyncio.get_running_loop().call_later(wait_seconds, self.on_timer)
+                    return
+                self.bucket.consume()
+            heapq.heappop(self.waiters)
+            self.running += 1
+            future.set_result(None)
+
+    def on_timer(self):
+        self.timer = None
+        self.dispatch()
+
+    async def acquire(self, priority: Priority):
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, (priority, next(self.sequence), future))
+        get_value_recorder(f"scheduler.{self.name}.queue_depth").observe(len(self.waiters))
+        start = time.perf_counter()
+        self.dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # 放行之后、开始执行之前被取消
+                self.release()
+            raise
+        get_latency_recorder(f"scheduler.{self.name}.wait.{priority.name.lower()}").observe(
+            time.perf_counter() - start)
+
+    def release(self):
+        self.running -= 1
+        self.dispatch()
+
+    @asynccontextmanager
+    async def slot(self, priority: Priority | None = None):
+        """
+        未指定优先级时使用当前上下文的优先级
+        """
+        await self.acquire(get_request_priority() if priority is None else priority)
+        notify_slot_acquired()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def snapshot(self) -> dict:
+        return {"running": self.running, "max_concurrency": self.max_concurrency,
+                "queue_depth": self.queue_depth()}
+
+
+__model_schedulers: dict[str, ModelScheduler] = dict()
+
+
+def get_model_scheduler(name: str, **defaults) -> ModelScheduler:
+    """
+    同一个模型共用一个调度器，限制参数优先使用LLM_SCHEDULER_MODEL_LIMITS中的配置，其次是defaults，最后是默认配置
+    """
+    if name not in __model_schedulers:
+        limits = {"max_concurrency": settings.LLM_SCHEDULER_DEFAULT_MAX_CONCURRENCY,
+                  "requests_per_second": settings.LLM_SCHEDULER_DEFAULT_REQUESTS_PER_SECOND,
+                  "burst": settings.LLM_SCHEDULER_DEFAULT_BURST,
+                  **defaults,
+                  **settings.LLM_SCHEDULER_MODEL_LIMITS.get(name, {})}
+        __model_schedulers[name] = ModelScheduler(name,
+                                                  max_concurrency=int(limits["max_concurrency"]),
+                                                  requests_per_second=float(limits["requests_per_second"])
+                                                  if limits["requests_per_second"] else None,
+                                                  burst=int(limits["burst"]),
+                                                  interactive_reserved=settings.LLM_SCHEDULER_INTERACTIVE_RESERVED)
+    return __model_schedulers[name]
+
+
+def get_scheduler_states() -> dict:
+    return {name: scheduler.snapshot() for name, scheduler in sorted(__model_schedulers.items())}
+
+
+class ScheduledChatModel(BaseChatModel):
+    """
+    通过调度器调用的聊天模型，流式调用在整个输出过程中占用并发
+    """
+    llm: BaseChatModel
+
+    @property
+    def _llm_type(self) -> str:
+        return "scheduled-chat-model"
+
+    @property
+    def model_name(self) -> str:
+        return getattr(self.llm, "model_name", None) or getattr(self.llm, "model", None) or type(self.llm).__name__
+
+    def scheduler(self) -> ModelScheduler:
+        return get_model_scheduler(self.model_name)
+
+    async def _agenerate(self, messages: list[BaseMessage], stop: list[str] | None = None,
+                         run_manager: AsyncCallbackManagerForLLMRun | None = None, **kwargs: Any) -> ChatResult:
+        async with self.scheduler().slot():
+            message = await self.llm.ainvoke(messages, stop=stop, **kwargs)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _generate(self, messages: list[BaseMessage], stop: list[str] | None = None,
+                  run_manager: CallbackManagerForLLMRun | None = None, **kwargs: Any) -> ChatResult:
+        # 同步调用没有事件循环，不经过调度器
+        message = self.llm.invoke(messages, stop=stop, **kwargs)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _astream(self, messages: list[BaseMessage], stop: list[str] | None = None,
+                       run_manager: AsyncCallbackManagerForLLMRun | None = None,
+                       **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        async with self.scheduler().slot():
+            async for chunk in self.llm.astream(messages, stop=stop, **kwargs):
+                generation_chunk = ChatGenerationChunk(message=chunk)
+                if run_manager:
+                    await run_manager.on_llm_new_token(chunk.content, chunk=generation_chunk)
+                yield generation_chunk
@@ -1,22 +1,34 @@
+import asyncio
+
 from fastapi import FastAPI, Depends
+from fastapi.responses import JSONResponse
 
 from app.agent.hts_graph import build_hts_classify_graph
-from app.core.constants import MilvusCollectionName
+from app.core.config import settings
 from app.core.handlers import init_exception_handlers
-from app.core.milvus import get_knowledge_client, init_milvus_client
-from app.core.opensearch import init_indices
+from app.core.metrics import get_metrics_snapshot
+from app.core.milvus import init_milvus_client
+from app.core.opensearch import init_indices, init_opensearch_clients, close_opensearch_clients
 from app.core.redis import init_async_redis, close_async_redis
 from app.db.session import get_async_session
 from app.core.middleware import init_middleware
 from app.dep.db import init_db
 from contextlib import asynccontextmanager
 
-from app.init.embeddings_init import build_chapter_knowledge_collection, build_heading_knowledge_collection
+from app.llm.chat.circuit_breaker import get_circuit_breaker_states
+from app.llm.embedding.qwen import close_qwen_embeddings
+from app.llm.scheduler import get_scheduler_states
+from app.llm.embedding import default_embeddings_service
+from app.service.e2e_cache_replica_service import start_e2e_cache_replica, stop_e2e_cache_replica
+from app.service.checkpoint_retention_service import start_checkpoint_retention, stop_checkpoint_retention
+from app.service.knowledge_build_service import default_knowledge_build_service, is_knowledge_ready, \
+    start_knowledge_build, stop_knowledge_build
 from app.router.agent import agent_router
 from app.router.schedule import schedule_router
 from app.router.vectorstore import vector_store_router
 from app.router.hts import hts_router
 from app.router.evaluation import evaluation_router
+from app.util.wco_crawler_utils import close_wco_crawler
 import logging
 from app.core import logging_config
 
@@ -33,24 +45,49 @@ async def lifespan(app: FastAPI):
         await init_db(session)
         await session.close()
 
-        # 初始化向量知识库
-        await build_chapter_knowledge_collection(session,
-                                                 await get_knowledge_client(MilvusCollectionName.KNOWLEDGE_CHAPTER))
-        await build_heading_knowledge_collection(session,
-                                                 await get_knowledge_client(MilvusCollectionName.KNOWLEDGE_HEADING))
+    # 检查向量知识库的构建清单，需要构建时在后台执行
+    await start_knowledge_build()
 
-    # 初始化opensearch索引
+    # 初始化opensearch客户端及索引
+    init_opensearch_clients()
     init_indices(app)
+    # 后台加载e2e相似度缓存的本地副本
+    start_e2e_cache_replica()
 
     # 初始化redis连接
     await init_async_redis()
+    # 后台转换旧格式的embedding缓存
+    migrate_task = None
+    if settings.EMBEDDINGS_CACHE_MIGRATE_ON_STARTUP:
+        migrate_task = asyncio.create_task(default_embeddings_service.migrate_legacy_cache())
 
     app.state.hts_graph = await build_hts_classify_graph()
+    # 后台定时清理checkpoint
+    start_checkpoint_retention()
     yield
 
+    await stop_checkpoint_retention()
+
+    await stop_knowledge_build()
+
+    if migrate_task and not migrate_task.done():
+        migrate_task.cancel()
+
     # 关闭redis连接
     await close_async_redis()
 
+    # 停止e2e相似度缓存副本的后台同步
+    await stop_e2e_cache_replica()
+
+    # 关闭opensearch连接池
+    await close_opensearch_clients()
+
+    # 关闭embedding接口的http客户端
+    await close_qwen_embeddings()
+
+    # 关闭爬虫的http客户端及解析线程池
+    await close_wco_crawler()
+
     logger.info("lifespan end")
 
 
@@ -64,6 +101,21 @@ async def say_hello():
     return {"message": "Hello World"}
 
 
+@app.get("/ready")
+async def ready():
+    """
+    向量知识库加载完成前返回503，负载均衡不转发请求
+    """
+    return JSONResponse(status_code=200 if is_knowledge_ready() else 503,
+                        content=default_knowledge_build_service.snapshot())
+
+
+@app.get("/metrics")
+async def metrics():
+    return {**get_metrics_snapshot(), "circuit_breakers": get_circuit_breaker_states(),
+            "schedulers": get_scheduler_states()}
+
+
 app.include_router(schedule_router, prefix="/schedule", tags=["schedule"])
 app.include_router(vector_store_router, prefix="/vector-store", tags=["vector-store"])
 app.include_router(agent_router, prefix="/agent", tags=["agent"])
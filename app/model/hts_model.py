@@ -1,5 +1,5 @@
 from datetime import datetime
-from sqlalchemy import Integer, String, DateTime, ForeignKey, Boolean
+from sqlalchemy import Integer, String, DateTime, ForeignKey, Boolean, Text, UniqueConstraint
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from app.core.db import Base
 
@@ -62,7 +62,7 @@ class HtsUpdateRecord(Base):
     update_version: Mapped[str] = mapped_column(String(50), comment="更新版本: 2022", nullable=False)
     update_status: Mapped[str] = mapped_column(String(50), comment="更新结果: doing/success/fail", nullable=False)
     fail_message: Mapped[str] = mapped_column(String(2000), comment="更新失败原因", nullable=True)
-    fail_row: Mapped[int] = mapped_column(Integer, comment="更新失败行数", nullable=True)
+    fail_row: Mapped[int] = mapped_column(Integer, comment="断点行数:按批次提交，此行之前的数据都已经提交", nullable=True)
     can_continue: Mapped[bool] = mapped_column(Boolean, comment="是否可以继续更新", nullable=True)
     create_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now, nullable=False)
     updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now, nullable=False)
@@ -76,4 +76,14 @@ class HtsVersionHistory(Base):
     enabled_time: Mapped[datetime] = mapped_column(DateTime, default=datetime.now, nullable=False)
     disabled_time: Mapped[datetime] = mapped_column(DateTime, default=None, nullable=True)
     create_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now, nullable=False)
-    update_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now, nullable=False)
\ No newline at end of file
+    update_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now, nullable=False)
+
+class HtsRateLineTree(Base):
+    """WCO子目对应的HTS税率线树(序列化后的json)，HTS更新完成后预先构建，检索时直接按子目获取"""
+    __tablename__ = "base_hts_rate_line_tree"
+    __table_args__ = (UniqueConstraint("version", "wco_hs_subheading", name="uq_hts_rate_line_tree_version_subheading"),)
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True, autoincrement=True)
+    wco_hs_subheading: Mapped[str] = mapped_column(String(10), nullable=False, comment="WCO HS子目")
+    rate_line_tree: Mapped[str] = mapped_column(Text, nullable=False, comment="子目下的税率线树(json)")
+    version: Mapped[str] = mapped_column(String(50), comment="更新版本: 2025 Revision 16", nullable=False)
+    create_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now, nullable=False)
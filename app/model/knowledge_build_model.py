@@ -0,0 +1,41 @@
+"""
+向量知识库构建记录
+"""
+from datetime import datetime
+from sqlalchemy import Integer, String, DateTime, Text, UniqueConstraint
+from sqlalchemy.orm import Mapped, mapped_column
+from app.core.db import Base
+
+
+class KnowledgeBuildManifest(Base):
+    """向量知识库(milvus collection)的构建清单，启动时据此判断是否需要重新构建"""
+    __tablename__ = "knowledge_build_manifest"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True, autoincrement=True)
+    collection_name: Mapped[str] = mapped_column(String(100), index=True, unique=True, nullable=False,
+                                                 comment="milvus collection名称")
+    build_version: Mapped[str] = mapped_column(String(20), nullable=False, comment="构建逻辑的版本")
+    source_version: Mapped[str] = mapped_column(String(50), nullable=True, comment="构建使用的WCO HS数据版本")
+    content_hash: Mapped[str] = mapped_column(String(64), nullable=True, comment="构建使用的源数据内容哈希")
+    status: Mapped[str] = mapped_column(String(20), nullable=False, comment="构建状态: building/ready/failed")
+    item_count: Mapped[int] = mapped_column(Integer, nullable=True, comment="源数据条数")
+    error_message: Mapped[str] = mapped_column(String(2000), nullable=True, comment="构建失败的原因")
+    built_at: Mapped[datetime] = mapped_column(DateTime, nullable=True,
+                                               comment="最近一次构建成功的时间，不为空时collection中已有可用的数据")
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now, nullable=False)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now, nullable=False)
+
+
+class KnowledgeBuildJournal(Base):
+    """向量知识库构建日志，保存每个条目的LLM扩展结果及写入进度，构建中断后从这里继续"""
+    __tablename__ = "knowledge_build_journal"
+    __table_args__ = (UniqueConstraint("collection_name", "item_code", "input_hash",
+                                       name="uq_knowledge_build_journal_collection_item_input"),)
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True, autoincrement=True)
+    collection_name: Mapped[str] = mapped_column(String(100), index=True, nullable=False,
+                                                 comment="milvus collection名称")
+    item_code: Mapped[str] = mapped_column(String(20), nullable=False, comment="条目编码(chapter/heading编码)")
+    input_hash: Mapped[str] = mapped_column(String(64), nullable=False, comment="LLM扩展输入的内容哈希")
+    expansion: Mapped[str] = mapped_column(Text, nullable=False, comment="LLM扩展的结果(json)")
+    status: Mapped[str] = mapped_column(String(20), nullable=False, comment="进度: expanded/inserted")
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now, nullable=False)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now, nullable=False)
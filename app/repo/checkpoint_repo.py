@@ -0,0 +1,147 @@
+"""
+LangGraph checkpoint表(checkpoints/checkpoint_blobs/checkpoint_writes)及checkpoint_content_blobs的清理
+
+checkpoint表由AsyncPostgresSaver创建，没有对应的ORM模型，这里直接使用SQL；
+清理查询使用的索引(checkpoints_ts_idx、checkpoints_thread_id_pattern_idx)由清理任务每次执行前检查并创建
+"""
+from datetime import datetime
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+
+CHECKPOINT_TABLES = ("checkpoint_writes", "checkpoint_blobs", "checkpoints")
+
+# 清理查询按写入时间及thread_id前缀查询使用的索引
+CHECKPOINT_INDEXES = {
+    "checkpoints_ts_idx": "ON checkpoints ((checkpoint->>'ts'))",
+    "checkpoints_thread_id_pattern_idx": "ON checkpoints (thread_id text_pattern_ops)",
+}
+
+
+async def ensure_checkpoint_indexes(connection: AsyncConnection) -> list[str]:
+    """
+    创建缺少的索引，重建之前并发创建失败遗留的无效索引(indisvalid为false且没有正在进行的创建)，返回创建的索引
+
+    表已经较大时使用CONCURRENTLY不阻塞写入，connection需要是AUTOCOMMIT的
+    """
+    created = []
+    for name, definition in CHECKPOINT_INDEXES.items():
+        result = await connection.execute(text(
+            "SELECT i.indisvalid, EXISTS (SELECT 1 FROM pg_stat_progress_create_index p "
+            "                             WHERE p.index_relid = i.indexrelid) "
+            "FROM pg_index i WHERE i.indexrelid = to_regclass(:name)"), {"name": name})
+        row = result.first()
+        if row is not None and (row[0] or row[1]):
+            continue
+        if row is not None:
+            await connection.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+        await connection.execute(text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} {definition}"))
+        created.append(name)
+    return created
+
+
+async def set_lock_timeout(session: AsyncSession, timeout_ms: int):
+    """
+    当前事务等待锁的最长时间，清理任务不能阻塞在线的checkpoint写入
+    """
+    await session.execute(text(f"SET LOCAL lock_timeout = {int(timeout_ms)}"))
+
+
+async def select_thread_ids_by_prefix(session: AsyncSession, prefix: str, limit: int) -> list[str]:
+    """
+    使用checkpoints_thread_id_pattern_idx按前缀查询
+    """
+    result = await session.execute(
+        text("SELECT DISTINCT thread_id FROM checkpoints WHERE thread_id LIKE :pattern "
+             "ORDER BY thread_id LIMIT :limit"),
+        {"pattern": f"{prefix}%", "limit": limit})
+    return list(result.scalars())
+
+
+async def select_expired_thread_ids(session: AsyncSession, before_ts: str, limit: int,
+                                    thread_ids: list[str] | None = None) -> list[str]:
+    """
+    最后一个checkpoint早于before_ts(ISO格式UTC时间，与checkpoint中的ts格式相同)的thread
+
+    通过checkpoints_ts_idx只扫描早于before_ts的checkpoint，再按主键确认thread没有更新的checkpoint；
+    指定thread_ids时只在其中重新确认(删除前thread可能已经恢复运行)
+    """
+    params = {"before_ts": before_ts, "limit": limit}
+    thread_filter = ""
+    if thread_ids is not None:
+        params["thread_ids"] = thread_ids
+        thread_filter = "AND c.thread_id = ANY(:thread_ids) "
+    result = await session.execute(
+        text("SELECT DISTINCT c.thread_id FROM checkpoints c "
+             "WHERE c.checkpoint->>'ts' < :before_ts " + thread_filter +
+             "AND NOT EXISTS (SELECT 1 FROM checkpoints n "
+             "                WHERE n.thread_id = c.thread_id AND n.checkpoint->>'ts' >= :before_ts) "
+             "ORDER BY c.thread_id LIMIT :limit"),
+        params)
+    return list(result.scalars())
+
+
+async def select_compactable_thread_ids(session: AsyncSession, before_ts: str, limit: int) -> list[str]:
+    """
+    空闲(最后一个checkpoint早于before_ts)且同一命名空间下还有多个checkpoint的thread
+    """
+    result = await session.execute(
+        text("SELECT c.thread_id FROM checkpoints c "
+             "WHERE c.checkpoint->>'ts' < :before_ts "
+             "AND NOT EXISTS (SELECT 1 FROM checkpoints n "
+             "                WHERE n.thread_id = c.thread_id AND n.checkpoint->>'ts' >= :before_ts) "
+             "GROUP BY c.thread_id HAVING count(*) > count(DISTINCT c.checkpoint_ns) "
+             "ORDER BY c.thread_id LIMIT :limit"),
+        {"before_ts": before_ts, "limit": limit})
+    return list(result.scalars())
+
+
+async def delete_threads(session: AsyncSession, thread_ids: list[str]) -> int:
+    deleted = 0
+    for table in CHECKPOINT_TABLES:
+        result = await session.execute(text(f"DELETE FROM {table} WHERE thread_id = ANY(:thread_ids)"),
+                                       {"thread_ids": thread_ids})
+        deleted += result.rowcount
+    return deleted
+
+
+async def compact_threads(session: AsyncSession, thread_ids: list[str]) -> int:
+    """
+    每个thread的每个命名空间只保留最新的checkpoint，以及它的pending writes和引用的channel版本
+    """
+    params = {"thread_ids": thread_ids}
+    result = await session.execute(text("""
+        DELETE FROM checkpoints c USING (
+            SELECT thread_id, checkpoint_ns, checkpoint_id,
+                   row_number() OVER (PARTITION BY thread_id, checkpoint_ns ORDER BY checkpoint_id DESC) AS rn
+            FROM checkpoints WHERE thread_id = ANY(:thread_ids)
+        ) ranked
+        WHERE c.thread_id = ranked.thread_id AND c.checkpoint_ns = ranked.checkpoint_ns
+          AND c.checkpoint_id = ranked.checkpoint_id AND ranked.rn > 1"""), params)
+    deleted = result.rowcount
+    result = await session.execute(text("""
+        DELETE FROM checkpoint_writes w
+        WHERE w.thread_id = ANY(:thread_ids) AND NOT EXISTS (
+            SELECT 1 FROM checkpoints c
+            WHERE c.thread_id = w.thread_id AND c.checkpoint_ns = w.checkpoint_ns
+              AND c.checkpoint_id = w.checkpoint_id)"""), params)
+    deleted += result.rowcount
+    result = await session.execute(text("""
+        DELETE FROM checkpoint_blobs b
+        WHERE b.thread_id = ANY(:thread_ids) AND NOT EXISTS (
+            SELECT 1 FROM checkpoints c
+            WHERE c.thread_id = b.thread_id AND c.checkpoint_ns = b.checkpoint_ns
+              AND c.checkpoint->'channel_versions'->>b.channel = b.version)"""), params)
+    deleted += result.rowcount
+    return deleted
+
+
+async def delete_unused_content_blobs(session: AsyncSession, before: datetime, limit: int) -> int:
+    """
+    删除last_used_at早于before的大文本，引用它们的checkpoint已经被清理
+    """
+    result = await session.execute(text("""
+        DELETE FROM checkpoint_content_blobs WHERE content_hash IN (
+            SELECT content_hash FROM checkpoint_content_blobs WHERE last_used_at < :before LIMIT :limit)"""),
+                                   {"before": before, "limit": limit})
+    return result.rowcount
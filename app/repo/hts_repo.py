@@ -1,9 +1,11 @@
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from sqlalchemy import delete, update
+from sqlalchemy import delete, update, text
+from sqlalchemy.dialects.postgresql import insert
 from datetime import datetime
 
-from app.model.hts_model import HtsRateLine, HtsUpdateRecord, HtsRateLineFootnote, HtsStatSuffix, HtsVersionHistory
+from app.model.hts_model import HtsRateLine, HtsUpdateRecord, HtsRateLineFootnote, HtsStatSuffix, HtsVersionHistory, \
+    HtsRateLineTree
 
 
 async def select_current_version(session: AsyncSession) -> HtsVersionHistory | None:
@@ -21,30 +23,44 @@ async def save_update_record(session: AsyncSession, record: HtsUpdateRecord) ->
     return record
 
 
-async def select_rate_line_by_row_index(session: AsyncSession, row_index: int) -> HtsRateLine | None:
-    result = await session.execute(select(HtsRateLine).filter(HtsRateLine.row_index == row_index))
-    return result.scalar_one_or_none()
+async def select_rate_line_ids_by_row_indexes(session: AsyncSession, version: str,
+                                              row_indexes: list[int]) -> dict[int, int]:
+    result = await session.execute(select(HtsRateLine.row_index, HtsRateLine.id)
+                                   .filter(HtsRateLine.version == version, HtsRateLine.row_index.in_(row_indexes)))
+    return {row.row_index: row.id for row in result.all()}
 
 
-async def select_stat_suffix_by_row_index(session: AsyncSession, row_index: int) -> HtsStatSuffix | None:
-    result = await session.execute(select(HtsStatSuffix).filter(HtsStatSuffix.row_index == row_index))
-    return result.scalar_one_or_none()
+async def select_rate_line_id_block(session: AsyncSession, size: int) -> list[int]:
+    """
+    从税率线主键序列中一次性分配一批id
+    """
+    if size <= 0:
+        return []
+    result = await session.execute(
+        text("SELECT nextval(pg_get_serial_sequence(:table_name, 'id')) FROM generate_series(1, :size)"),
+        {"table_name": HtsRateLine.__tablename__, "size": size})
+    return list(result.scalars().all())
 
 
-async def insert_rate_line(session: AsyncSession, record: HtsRateLine) -> HtsRateLine:
-    session.add(record)
-    await session.flush()
-    return record
+async def insert_rate_lines(session: AsyncSession, rate_lines: list[dict]):
+    if rate_lines:
+        await session.execute(insert(HtsRateLine), rate_lines)
 
 
-async def insert_rate_line_footnotes(session: AsyncSession, footnotes: list[HtsRateLineFootnote]):
-    session.add_all(footnotes)
+async def insert_rate_line_footnotes(session: AsyncSession, footnotes: list[dict]):
+    if footnotes:
+        await session.execute(insert(HtsRateLineFootnote), footnotes)
 
 
-async def insert_stat_suffix(session: AsyncSession, record: HtsStatSuffix) -> HtsStatSuffix:
-    session.add(record)
-    await session.flush()
-    return record
+async def insert_stat_suffixes(session: AsyncSession, stat_suffixes: list[dict]):
+    if stat_suffixes:
+        await session.execute(insert(HtsStatSuffix), stat_suffixes)
+
+
+async def update_record_checkpoint(session: AsyncSession, record_id: int, checkpoint_row: int):
+    await session.execute(update(HtsUpdateRecord)
+                          .where(HtsUpdateRecord.id == record_id)
+                          .values(fail_row=checkpoint_row, updated_at=datetime.now()))
 
 
 async def disable_last_version(session: AsyncSession):
@@ -66,15 +82,30 @@ async def select_last_update_record(session: AsyncSession, version: str) -> HtsU
     return result.scalar_one_or_none()
 
 
-async def select_current_rate_lines_by_subheadings(session: AsyncSession, current_version: str, subheadings: list[str]):
+async def select_rate_line_nodes_by_version(session: AsyncSession, version: str):
+    """
+    只查询构建税率线树需要的列，避免加载整个实体(以及children关系的join)
+    """
     result = await session.execute(
-        select(HtsRateLine).filter(HtsRateLine.version == current_version, HtsRateLine.wco_hs_subheading.in_(subheadings)))
-    return result.scalars().all()
+        select(HtsRateLine.id, HtsRateLine.parent_id, HtsRateLine.rate_line_code, HtsRateLine.rate_line_description,
+               HtsRateLine.is_superior, HtsRateLine.wco_hs_subheading)
+        .filter(HtsRateLine.version == version)
+        .order_by(HtsRateLine.row_index.asc()))
+    return result.all()
 
-async def select_rate_line_by_id(session: AsyncSession, id: int):
-    result = await session.execute(select(HtsRateLine).filter(HtsRateLine.id == id))
-    return result.scalar_one_or_none()
 
-async def select_children_rate_lines_by_parent_id(session: AsyncSession, parent_id: int):
-    result = await session.execute(select(HtsRateLine).filter(HtsRateLine.parent_id == parent_id))
-    return result.scalars().all()
\ No newline at end of file
+async def delete_rate_line_trees_by_version(session: AsyncSession, version: str):
+    await session.execute(delete(HtsRateLineTree).filter(HtsRateLineTree.version == version))
+
+
+async def insert_rate_line_trees(session: AsyncSession, trees: list[dict]):
+    if trees:
+        await session.execute(insert(HtsRateLineTree).on_conflict_do_nothing(
+            constraint="uq_hts_rate_line_tree_version_subheading"), trees)
+
+
+async def select_rate_line_trees_by_version(session: AsyncSession, version: str):
+    result = await session.execute(
+        select(HtsRateLineTree.wco_hs_subheading, HtsRateLineTree.rate_line_tree)
+        .filter(HtsRateLineTree.version == version))
+    return result.all()
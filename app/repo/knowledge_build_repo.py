@@ -0,0 +1,64 @@
+from datetime import datetime
+
+from sqlalchemy import text, update
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+from sqlalchemy.future import select
+
+from app.model.knowledge_build_model import KnowledgeBuildManifest, KnowledgeBuildJournal
+
+
+async def select_manifests(session: AsyncSession) -> dict[str, KnowledgeBuildManifest]:
+    result = await session.execute(select(KnowledgeBuildManifest))
+    return {manifest.collection_name: manifest for manifest in result.scalars().all()}
+
+
+async def save_manifest(session: AsyncSession, collection_name: str, **values) -> KnowledgeBuildManifest:
+    result = await session.execute(
+        select(KnowledgeBuildManifest).filter(KnowledgeBuildManifest.collection_name == collection_name))
+    manifest = result.scalar_one_or_none()
+    if manifest is None:
+        manifest = KnowledgeBuildManifest(collection_name=collection_name)
+        session.add(manifest)
+    for key, value in values.items():
+        setattr(manifest, key, value)
+    manifest.updated_at = datetime.now()
+    await session.flush()
+    return manifest
+
+
+async def select_journal_entries(session: AsyncSession, collection_name: str,
+                                 item_codes: list[str]) -> list[KnowledgeBuildJournal]:
+    result = await session.execute(
+        select(KnowledgeBuildJournal).filter(KnowledgeBuildJournal.collection_name == collection_name,
+                                             KnowledgeBuildJournal.item_code.in_(item_codes)))
+    return list(result.scalars().all())
+
+
+async def insert_journal_entry(session: AsyncSession, collection_name: str, item_code: str, input_hash: str,
+                               expansion: str, status: str) -> KnowledgeBuildJournal:
+    entry = KnowledgeBuildJournal(collection_name=collection_name, item_code=item_code, input_hash=input_hash,
+                                  expansion=expansion, status=status)
+    session.add(entry)
+    await session.flush()
+    return entry
+
+
+async def update_journal_status(session: AsyncSession, entry_ids: list[int], status: str):
+    await session.execute(update(KnowledgeBuildJournal)
+                          .where(KnowledgeBuildJournal.id.in_(entry_ids))
+                          .values(status=status, updated_at=datetime.now()))
+
+
+async def try_advisory_lock(connection: AsyncConnection, key: int) -> bool:
+    """
+    会话级的锁，在释放或连接断开前一直持有，获取后提交事务，不在事务中长时间空闲
+    """
+    result = await connection.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": key})
+    locked = bool(result.scalar())
+    await connection.commit()
+    return locked
+
+
+async def advisory_unlock(connection: AsyncConnection, key: int):
+    await connection.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": key})
+    await connection.commit()
@@ -113,6 +113,11 @@ async def select_subheading_by_code(session: AsyncSession, code: str):
     return result.scalar_one_or_none()
 
 
+async def select_all_subheading_codes(session: AsyncSession) -> list[str]:
+    result = await session.execute(select(WcoHsSubheading.subheading_code))
+    return list(result.scalars().all())
+
+
 async def select_all_chapters(session: AsyncSession, version: str):
     result = await session.execute(select(WcoHsChapter).filter(WcoHsChapter.version == version))
     return result.scalars().all()
@@ -129,19 +134,6 @@ async def select_current_version_chapters_by_codes(session: AsyncSession, curren
     return result.scalars().all()
 
 
-async def select_current_version_headings_by_codes(session: AsyncSession, current_version: str, codes: list[str]):
-    result = await session.execute(
-        select(WcoHsHeading).filter(WcoHsHeading.version == current_version, WcoHsHeading.heading_code.in_(codes)))
-    return result.scalars().all()
-
-
-async def select_subheadings_by_heading(session: AsyncSession, heading_id: str):
-    result = await session.execute(select(WcoHsSubheading).filter(WcoHsSubheading.heading_id == heading_id))
-    return result.scalars().all()
-
-
-async def select_current_version_subheadings_by_codes(session: AsyncSession, current_version: str, codes: list[str]):
-    result = await session.execute(
-        select(WcoHsSubheading).filter(WcoHsSubheading.version == current_version,
-                                       WcoHsSubheading.subheading_code.in_(codes)))
+async def select_all_subheadings(session: AsyncSession, version: str):
+    result = await session.execute(select(WcoHsSubheading).filter(WcoHsSubheading.version == version))
     return result.scalars().all()
@@ -7,12 +7,17 @@ from langgraph.graph.state import CompiledStateGraph
 
 from typing_extensions import Annotated
 import json
+import logging
 
 from app.agent.constants import HtsAgents, RewriteItemNodes, RetrieveDocumentsNodes, \
     DetermineHeadingNodes, DetermineSubheadingNodes, DetermineRateLineNodes, GenerateFinalOutputNodes, SupervisorNodes
+from app.core.config import settings
+from app.agent.util.stream_writer import STREAM_TYPE_DELTA, STREAM_TYPE_PARTIAL
 from app.schema.ask_response import SSEResponse, SSEMessageTypeEnum
 from app.util.json_utils import pydantic_to_dict
 
+logger = logging.getLogger(__name__)
+
 agent_router = APIRouter()
 
 
@@ -21,7 +26,8 @@ async def ask_item_hts(request: Request, thread_id: Annotated[str, Header()], me
     # get user & thread_id
     config = {"configurable": {"thread_id": thread_id}}
     graph: CompiledStateGraph = request.app.state.hts_graph
-    stream = graph.astream({"item": message.content}, config, stream_mode="updates", subgraphs=True)
+    stream = graph.astream({"item": message.content}, config, stream_mode=["updates", "custom"],
+                           subgraphs=True, durability=settings.CHECKPOINT_DURABILITY)
     return StreamingResponse(sse_generator(stream), media_type="text/event-stream")
 
 
@@ -30,15 +36,22 @@ async def resume_ask_item_hts(request: Request, thread_id: Annotated[str, Header
                               additional_messages: Annotated[HumanMessage, Body()]):
     config = {"configurable": {"thread_id": thread_id}}
     graph: CompiledStateGraph = request.app.state.hts_graph
-    stream = graph.astream(Command(resume=additional_messages.content), config, stream_mode="updates", subgraphs=True)
+    stream = graph.astream(Command(resume=additional_messages.content), config, stream_mode=["updates", "custom"],
+                           subgraphs=True, durability=settings.CHECKPOINT_DURABILITY)
     return StreamingResponse(sse_generator(stream), media_type="text/event-stream")
 
 
 async def sse_generator(stream):
     # yield "retry: 100000\n\n"  # 设置客户端重连等待时间为10秒
-    async for step in stream:
-        print(step)
-        path, updates = step
+    async for path, mode, chunk in stream:
+        # 节点推送的LLM增量输出
+        if mode == "custom":
+            response = format_stream_chunk(chunk)
+            if response:
+                yield response
+            continue
+        updates = chunk
+        logger.debug("Graph update %s: %s", path, updates)
         # 主图节点
         if not path:
             for node, update_data in updates.items():
@@ -175,6 +188,19 @@ async def sse_generator(stream):
                                     f"{update_data.get('final_description')}\n"))
 
 
+def format_stream_chunk(chunk: dict) -> str | None:
+    """
+    delta: 文本增量，partial: 不完整的结构化结果
+    """
+    metadata = {"stage": chunk.get("stage")}
+    if chunk.get("type") == STREAM_TYPE_DELTA:
+        return format_response(SSEMessageTypeEnum.DELTA, SSEResponse(message=chunk.get("content"), metadata=metadata))
+    if chunk.get("type") == STREAM_TYPE_PARTIAL:
+        metadata["data"] = chunk.get("data")
+        return format_response(SSEMessageTypeEnum.PARTIAL, SSEResponse(message="", metadata=metadata))
+    return None
+
+
 def format_response(message_type: SSEMessageTypeEnum, sse_response: SSEResponse) -> str:
     message = sse_response.model_dump_json()
     return (f"event:{message_type.value}\n"
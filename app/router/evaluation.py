@@ -1,6 +1,5 @@
 import uuid
 from typing import Annotated
-import pandas as pd
 import asyncio
 
 from fastapi import APIRouter, Request, Header
@@ -8,7 +7,10 @@ from fastapi.params import Header
 
 from langgraph.graph.state import CompiledStateGraph
 
-from app.service.evaluation_service import get_hts_classify_evaluation_result, do_batch_hts_classify_evaluation
+from app.core.config import settings
+from app.llm.scheduler import Priority, request_priority
+from app.service.evaluation_service import get_hts_classify_evaluation_result, do_batch_hts_classify_evaluation, \
+    new_evaluation_thread_id, delete_evaluation_thread
 
 evaluation_router = APIRouter()
 
@@ -20,11 +22,17 @@ async def hts_classify_evaluation(request: Request,
     对商品分类进行评估
     """
     graph: CompiledStateGraph = request.app.state.hts_graph
-    config = {"configurable": {"thread_id": str(uuid.uuid4()), "is_for_evaluation": True, "evaluate_version": str(uuid.uuid4())}}
-    stream = graph.astream({"item": item_name}, config, stream_mode="updates", subgraphs=True)
+    thread_id = new_evaluation_thread_id()
+    config = {"configurable": {"thread_id": thread_id, "is_for_evaluation": True, "evaluate_version": str(uuid.uuid4())}}
+    stream = graph.astream({"item": item_name}, config, stream_mode="updates", subgraphs=True,
+                          durability=settings.CHECKPOINT_DURABILITY)
     result = ""
-    async for step in stream:
-        result += str(step) + "\n"
+    try:
+        with request_priority(Priority.BATCH):
+            async for step in stream:
+                result += str(step) + "\n"
+    finally:
+        await delete_evaluation_thread(graph, thread_id)
     return result
 
 
@@ -3,6 +3,7 @@ from fastapi import APIRouter, BackgroundTasks
 from app.dep.db import SessionDep
 
 from app.service import wco_hs_service, hts_service
+from app.service.checkpoint_retention_service import default_checkpoint_retention_service
 
 schedule_router = APIRouter()
 
@@ -18,4 +19,13 @@ async def check_hts_update(session: SessionDep, background_tasks: BackgroundTask
     """
     检查HTS数据是否有更新
     """
-    return await hts_service.check_hts_update(session, background_tasks)
\ No newline at end of file
+    return await hts_service.check_hts_update(session, background_tasks)
+
+
+@schedule_router.post("/prune_checkpoints")
+async def prune_checkpoints(background_tasks: BackgroundTasks):
+    """
+    立即执行一次checkpoint清理
+    """
+    background_tasks.add_task(default_checkpoint_retention_service.run_once)
+    return "started"
@@ -80,17 +80,20 @@ async def transfer_old_heading_to_new(async_milvus_client: MilvusHeadingKnowledg
                                                               "chapter_code", "chapter_title", "chapter_description"])
     tasks = []
     for record in response:
-        await async_milvus_client.delete(collection_name="hts_knowledge_heading_temp", ids=record["id"])
-        record["id"] = None
-        record["heading_includes"] = []
-        record["heading_common_examples"] = []
         record["heading_description"] = json.dumps({
             "heading_title": record["heading_title"],
             "includes": [],
             "common_examples": []
         }, ensure_ascii=False)
-        record["heading_description_vector"] = await default_embeddings_service.get_embeddings_for_str(
-            record.get("heading_description"))
+    # 所有描述一次批量获取embedding
+    description_vectors = await default_embeddings_service.get_embeddings_for_list(
+        [record["heading_description"] for record in response])
+    for record, description_vector in zip(response, description_vectors):
+        await async_milvus_client.delete(collection_name="hts_knowledge_heading_temp", ids=record["id"])
+        record["id"] = None
+        record["heading_includes"] = []
+        record["heading_common_examples"] = []
+        record["heading_description_vector"] = description_vector
         heading = HeadingKnowledge(**record)
         tasks.append(
             async_milvus_client.insert(collection_name="hts_knowledge_heading_temp", data=[heading.model_dump()]))
@@ -21,6 +21,10 @@ class SSEMessageTypeEnum(Enum):
     ERROR = "error"
     # 过程消息，不显示给用户，用于记录过程信息
     HIDDEN = "hidden"
+    # 增量消息，LLM生成过程中的文本片段，客户端持续拼接预览，该环节完成后以后续的完整消息为准
+    DELTA = "delta"
+    # 不完整的结构化结果，metadata.data为目前已解析出的内容，客户端每次整体替换
+    PARTIAL = "partial"
 
 
 class SSEResponse(BaseModel):
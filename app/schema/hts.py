@@ -42,4 +42,5 @@ class HtsInheritanceDequeElement(BaseModel):
     type: int = Field(title="类型-0:rate_line,1:stat_suffix", default=0)
     general: str | None = Field(title="一般税率", description="除了other中的4个国家都适用的税率")
     special: str | None = Field(title="特殊税率", description="根据标注(A+,AU,BH,CL,CO,D,E,IL,JO,KR,MA,OM,P,PA,PE,S,SG)等等指定的税率")
-    other: str | None = Field(title="其他税率", description="目前只有朝鲜、古巴、白俄罗斯、俄罗斯四个国家")
\ No newline at end of file
+    other: str | None = Field(title="其他税率", description="目前只有朝鲜、古巴、白俄罗斯、俄罗斯四个国家")
+    row_index: int = Field(title="json文件中的第几个对象", default=0)
\ No newline at end of file
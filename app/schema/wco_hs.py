@@ -1,4 +1,4 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 
 
 # 检查更新相应参数
@@ -22,4 +22,26 @@ class WcoHeading(BaseModel):
     heading_code: str = Field(title="类目编码", default="")
     heading_title: str = Field(title="类目标题", default="")
     chapter_code: str = Field(title="所属章节编码", default="")
-    chapter_title: str = Field(title="所属章节标题", default="")
\ No newline at end of file
+    chapter_title: str = Field(title="所属章节标题", default="")
+
+class WcoTaxonomyChapter(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
+    chapter_code: str = Field(title="章节编码")
+    chapter_title: str = Field(title="章节标题")
+
+
+class WcoTaxonomyHeading(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
+    heading_code: str = Field(title="类目编码")
+    heading_title: str = Field(title="类目标题")
+    chapter_code: str = Field(title="所属章节编码")
+
+
+class WcoTaxonomySubheading(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
+    subheading_code: str = Field(title="子目编码")
+    subheading_title: str = Field(title="子目标题")
+    heading_code: str = Field(title="所属类目编码")
@@ -0,0 +1,156 @@
+"""
+LangGraph checkpoint的保留及清理
+
+定时执行:
+    1. 删除评估运行的thread(评估结束时会立即删除，这里清理异常退出遗留的数据)
+    2. 删除最后一次写入超过保留天数的thread
+    3. 空闲的thread每个命名空间只保留最新的checkpoint(仍然可以从中断处恢复)
+    4. 删除超过保留天数没有被使用的大文本
+每次执行前检查清理查询使用的索引(写入时间及thread_id前缀)，缺少或无效时重新创建；
+每项清理每次执行只查询一次候选thread，再分批处理，
+每批一个事务并设置lock_timeout，批次之间暂停，避免长时间锁住在线写入的表
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.core.constants import EVALUATION_THREAD_ID_PREFIX
+from app.core.db import async_engine
+from app.db.session import AsyncSessionLocal
+from app.repo.checkpoint_repo import ensure_checkpoint_indexes, set_lock_timeout, select_thread_ids_by_prefix, select_expired_thread_ids, \
+    select_compactable_thread_ids, delete_threads, compact_threads, delete_unused_content_blobs
+
+logger = logging.getLogger(__name__)
+
+LOCK_TIMEOUT_MS = 2000
+# 大文本的last_used_at在进程内最多延迟一小时更新，多保留一天
+CONTENT_BLOB_EXTRA_RETENTION = timedelta(days=1)
+
+
+class CheckpointRetentionService:
+
+    @staticmethod
+    async def ensure_indexes():
+        async with async_engine.connect() as connection:
+            connection = await connection.execution_options(isolation_level="AUTOCOMMIT")
+            created = await ensure_checkpoint_indexes(connection)
+        if created:
+            logger.info("Checkpoint retention created indexes %s", created)
+
+    async def run_in_batches(self, name: str,
+                             select: Callable[[AsyncSession, int], Awaitable[list[str]]],
+                             process: Callable[[AsyncSession, list[str]], Awaitable[int]]) -> int:
+        """
+        每次执行只查询一次候选thread(最多批次数*每批数量)，再分批处理，每批一个事务，返回删除的行数
+        """
+        async with AsyncSessionLocal() as session:
+            thread_ids = await select(session, settings.CHECKPOINT_RETENTION_BATCH_SIZE
+                                      * settings.CHECKPOINT_RETENTION_MAX_BATCHES)
+        deleted = 0
+        for start in range(0, len(thread_ids), settings.CHECKPOINT_RETENTION_BATCH_SIZE):
+            if start:
+                await asyncio.sleep(settings.CHECKPOINT_RETENTION_BATCH_PAUSE_SECONDS)
+            async with AsyncSessionLocal() as session:
+                async with session.begin():
+                    await set_lock_timeout(session, LOCK_TIMEOUT_MS)
+                    deleted += await process(session,
+                                             thread_ids[start:start + settings.CHECKPOINT_RETENTION_BATCH_SIZE])
+        if deleted:
+            logger.info("Checkpoint retention %s deleted %s rows", name, deleted)
+        return deleted
+
+    async def prune_evaluation_threads(self) -> int:
+        return await self.run_in_batches(
+            "evaluation",
+            lambda session, limit: select_thread_ids_by_prefix(session, EVALUATION_THREAD_ID_PREFIX, limit),
+            delete_threads)
+
+    async def prune_expired_threads(self) -> int:
+        before_ts = (datetime.now(timezone.utc) - timedelta(days=settings.CHECKPOINT_RETENTION_DAYS)).isoformat()
+
+        async def delete_expired_threads(session: AsyncSession, thread_ids: list[str]) -> int:
+            # 查询之后thread可能又恢复运行了，删除前按主键重新确认
+            thread_ids = await select_expired_thread_ids(session, before_ts, len(thread_ids), thread_ids)
+            return await delete_threads(session, thread_ids) if thread_ids else 0
+
+        return await self.run_in_batches(
+            "expired",
+            lambda session, limit: select_expired_thread_ids(session, before_ts, limit),
+            delete_expired_threads)
+
+    async def compact_idle_threads(self) -> int:
+        before_ts = (datetime.now(timezone.utc)
+                     - timedelta(minutes=settings.CHECKPOINT_COMPACT_IDLE_MINUTES)).isoformat()
+        return await self.run_in_batches(
+            "compact",
+            lambda session, limit: select_compactable_thread_ids(session, before_ts, limit),
+            compact_threads)
+
+    async def prune_content_blobs(self) -> int:
+        before = datetime.now(timezone.utc) - timedelta(days=settings.CHECKPOINT_RETENTION_DAYS) \
+                 - CONTENT_BLOB_EXTRA_RETENTION
+        deleted = 0
+        for _ in range(settings.CHECKPOINT_RETENTION_MAX_BATCHES):
+            async with AsyncSessionLocal() as session:
+                async with session.begin():
+                    await set_lock_timeout(session, LOCK_TIMEOUT_MS)
+                    count = await delete_unused_content_blobs(session, before, settings.CHECKPOINT_RETENTION_BATCH_SIZE)
+            deleted += count
+            if count < settings.CHECKPOINT_RETENTION_BATCH_SIZE:
+                break
+            await asyncio.sleep(settings.CHECKPOINT_RETENTION_BATCH_PAUSE_SECONDS)
+        if deleted:
+            logger.info("Checkpoint retention deleted %s content blobs", deleted)
+        return deleted
+
+    async def run_once(self) -> dict[str, int]:
+        """
+        依次执行各项清理，单项失败(例如等待锁超时)不影响其他项，下次执行时继续
+        """
+        try:
+            await self.ensure_indexes()
+        except Exception as e:
+            logger.warning("Checkpoint retention ensure indexes failed: %s", e)
+        result = {}
+        for name, job in [("evaluation", self.prune_evaluation_threads),
+                          ("expired", self.prune_expired_threads),
+                          ("compact", self.compact_idle_threads),
+                          ("content_blobs", self.prune_content_blobs)]:
+            try:
+                result[name] = await job()
+            except Exception as e:
+                logger.warning("Checkpoint retention %s failed: %s", name, e)
+                result[name] = -1
+        return result
+
+    async def run(self):
+        while True:
+            await self.run_once()
+            await asyncio.sleep(settings.CHECKPOINT_RETENTION_INTERVAL_SECONDS)
+
+
+default_checkpoint_retention_service = CheckpointRetentionService()
+
+__checkpoint_retention_task: asyncio.Task | None = None
+
+
+def start_checkpoint_retention():
+    global __checkpoint_retention_task
+    if not settings.CHECKPOINT_RETENTION_ENABLED or __checkpoint_retention_task is not None:
+        return
+    __checkpoint_retention_task = asyncio.create_task(default_checkpoint_retention_service.run())
+
+
+async def stop_checkpoint_retention():
+    global __checkpoint_retention_task
+    if __checkpoint_retention_task is not None:
+        __checkpoint_retention_task.cancel()
+        try:
+            await __checkpoint_retention_task
+        except asyncio.CancelledError:
+            pass
+    __checkpoint_retention_task = None
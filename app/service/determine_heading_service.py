@@ -1,6 +1,8 @@
 """
 确定类目服务
 """
+from typing import Callable
+
 from langchain_core.embeddings import Embeddings
 from langchain_core.output_parsers import PydanticOutputParser
 from langchain_core.prompts import PromptTemplate
@@ -9,8 +11,9 @@ from langchain_core.language_models import BaseChatModel
 from app.core.opensearch import get_async_opensearch_client
 from app.llm.prompt.prompt_template import determine_heading_template
 from app.schema.llm.llm import HeadingDetermineResponse, HeadingDetermineResponseDetail
-from app.service.rewrite_item_service import RewriteItemEmbeddingsService
+from app.llm.embedding import default_embeddings_service
 from app.core.constants import IndexName
+from app.service.llm_response_cache_service import default_llm_response_cache_service
 
 from datetime import datetime, timezone
 
@@ -20,9 +23,10 @@ class DetermineHeadingService:
     def __init__(self, llm: BaseChatModel, embeddings: Embeddings):
         self.llm = llm
         self.embeddings = embeddings
-        self.rewritten_item_embeddings_service = RewriteItemEmbeddingsService(embeddings=embeddings)
+        self.rewritten_item_embeddings_service = default_embeddings_service
 
-    async def determine_use_llm(self, rewritten_item, heading_documents: str):
+    async def determine_use_llm(self, rewritten_item, heading_documents: str,
+                                on_chunk: Callable[..., None] | None = None):
         """
         由LLM确定所属类目
         """
@@ -35,9 +39,11 @@ class DetermineHeadingService:
         human_message = prompt.invoke({"item": rewritten_item,
                                        "heading_scope": heading_documents}).to_messages()[0]
 
-        output = await self.llm.ainvoke(input=[human_message])
+        output, response = await default_llm_response_cache_service.ainvoke(
+            self.llm, "determine_heading", determine_heading_template, [human_message], parser.parse,
+            on_chunk=on_chunk)
 
-        return human_message, output, parser.parse(output.content)
+        return human_message, output, response
 
     async def save_simil_cache(self, origin_item_name: str, rewritten_item: dict, chapter_codes: list[str],
                                alternative_headings: list[dict] | None):
@@ -54,8 +60,8 @@ class DetermineHeadingService:
             "alternative_headings": alternative_headings,
             "created_at": datetime.now(timezone.utc)
         }
-        async with get_async_opensearch_client() as async_client:
-            await async_client.index(index=IndexName.HEADING_CLASSIFY, body=document)
+        async_client = get_async_opensearch_client()
+        await async_client.index(index=IndexName.HEADING_CLASSIFY, body=document)
 
     async def get_simil_cache(self, rewritten_item: dict, chapter_codes: list[str], ):
         """
@@ -64,36 +70,36 @@ class DetermineHeadingService:
         sorted_chapter_codes = str(sorted(chapter_codes))
         rewritten_item_vector = await self.rewritten_item_embeddings_service.get_rewritten_item_embeddings(
             rewritten_item)
-        async with get_async_opensearch_client() as async_client:
-            response = await async_client.search(index=IndexName.HEADING_CLASSIFY, body={
-                "query": {
-                    "bool": {
-                        "must": [
-                            {
-                                "knn": {
-                                    "rewritten_item_vector": {
-                                        "vector": rewritten_item_vector,
-                                        "k": 100
-                                    }
+        async_client = get_async_opensearch_client()
+        response = await async_client.search(index=IndexName.HEADING_CLASSIFY, body={
+            "query": {
+                "bool": {
+                    "must": [
+                        {
+                            "knn": {
+                                "rewritten_item_vector": {
+                                    "vector": rewritten_item_vector,
+                                    "k": 100
                                 }
                             }
-                        ],
-                        "filter": [
-                            {"term": {"chapter_codes": sorted_chapter_codes}}
-                        ]
-                    }
+                        }
+                    ],
+                    "filter": [
+                        {"term": {"chapter_codes": sorted_chapter_codes}}
+                    ]
+                }
+            }
+        })
+        if response["hits"]["total"]["value"] > 0:
+            score = response["hits"]["hits"][0]["_score"]
+            print(f"Heading cache similarity score:{score}")
+            # 相似度得分达到指定阈值的，直接返回结果，否则流程继续向下流转
+            if score > 0.95:
+                return {
+                    "hit_heading_cache": True,
+                    "alternative_headings": response["hits"]["hits"][0]["_source"]["alternative_headings"],
                 }
-            })
-            if response["hits"]["total"]["value"] > 0:
-                score = response["hits"]["hits"][0]["_score"]
-                print(f"Heading cache similarity score:{score}")
-                # 相似度得分达到指定阈值的，直接返回结果，否则流程继续向下流转
-                if score > 0.95:
-                    return {
-                        "hit_heading_cache": True,
-                        "alternative_headings": response["hits"]["hits"][0]["_source"]["alternative_headings"],
-                    }
-            return {"hit_heading_cache": False}
+        return {"hit_heading_cache": False}
 
     async def save_for_evaluation(self,
                                   evaluate_version: str,
@@ -114,5 +120,5 @@ class DetermineHeadingService:
             "matches": actual_heading in determine_heading_codes,
             "created_at": datetime.now(timezone.utc),
         }
-        async with get_async_opensearch_client() as async_client:
-            await async_client.index(index=IndexName.EVALUATE_LLM_CONFIRM_HEADING, body=document)
+        async_client = get_async_opensearch_client()
+        await async_client.index(index=IndexName.EVALUATE_LLM_CONFIRM_HEADING, body=document)
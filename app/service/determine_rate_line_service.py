@@ -1,13 +1,16 @@
+from typing import Callable
+
 from langchain_core.embeddings import Embeddings
 from langchain_core.language_models import BaseChatModel
 from langchain_core.output_parsers import PydanticOutputParser
 from langchain_core.prompts import PromptTemplate
 
-from app.service.rewrite_item_service import RewriteItemEmbeddingsService
+from app.llm.embedding import default_embeddings_service
 from app.schema.llm.llm import RateLineDetermineResponse
 from app.llm.prompt.prompt_template import determine_rate_line_template
 from app.core.opensearch import get_async_opensearch_client
 from app.core.constants import IndexName
+from app.service.llm_response_cache_service import default_llm_response_cache_service
 
 from datetime import datetime, timezone
 
@@ -17,9 +20,10 @@ class DetermineRateLineService:
     def __init__(self, llm: BaseChatModel, embeddings: Embeddings):
         self.llm = llm
         self.embeddings = embeddings
-        self.rewrite_item_embeddings_service = RewriteItemEmbeddingsService(embeddings=self.embeddings)
+        self.rewrite_item_embeddings_service = default_embeddings_service
 
-    async def determine_use_llm(self, rewritten_item: dict, rate_line_documents: str):
+    async def determine_use_llm(self, rewritten_item: dict, rate_line_documents: str,
+                                on_chunk: Callable[..., None] | None = None):
         parser = PydanticOutputParser(pydantic_object=RateLineDetermineResponse)
         format_instructions = parser.get_format_instructions()
         prompt = PromptTemplate(template=determine_rate_line_template,
@@ -29,9 +33,11 @@ class DetermineRateLineService:
         human_message = prompt.invoke({"item": rewritten_item,
                                        "rate_line_list": rate_line_documents}).to_messages()[0]
 
-        output = await self.llm.ainvoke(input=[human_message])
+        output, response = await default_llm_response_cache_service.ainvoke(
+            self.llm, "determine_rate_line", determine_rate_line_template, [human_message], parser.parse,
+            on_chunk=on_chunk)
 
-        return human_message, output, parser.parse(output.content)
+        return human_message, output, response
 
     async def save_simil_cache(self, origin_item_name: str, rewritten_item: dict,
                                subheading_codes: list[str], rate_line_result: dict):
@@ -45,43 +51,43 @@ class DetermineRateLineService:
             "rate_line_result": rate_line_result,
             "created_at": datetime.now(timezone.utc),
         }
-        async with get_async_opensearch_client() as async_client:
-            await async_client.index(index=IndexName.RATE_LINE_CLASSIFY.value, body=document)
+        async_client = get_async_opensearch_client()
+        await async_client.index(index=IndexName.RATE_LINE_CLASSIFY.value, body=document)
 
     async def get_simil_cache(self, rewritten_item: dict, subheading_codes: list[str]):
         sorted_subheading_codes = str(sorted(subheading_codes))
         rewritten_item_vector = await self.rewrite_item_embeddings_service.get_rewritten_item_embeddings(
             rewritten_item)
-        async with get_async_opensearch_client() as async_client:
-            response = await async_client.search(index=IndexName.RATE_LINE_CLASSIFY.value, body={
-                "query": {
-                    "bool": {
-                        "must": [
-                            {
-                                "knn": {
-                                    "rewritten_item_vector": {
-                                        "vector": rewritten_item_vector,
-                                        "k": 100
-                                    }
+        async_client = get_async_opensearch_client()
+        response = await async_client.search(index=IndexName.RATE_LINE_CLASSIFY.value, body={
+            "query": {
+                "bool": {
+                    "must": [
+                        {
+                            "knn": {
+                                "rewritten_item_vector": {
+                                    "vector": rewritten_item_vector,
+                                    "k": 100
                                 }
                             }
-                        ],
-                        "filter": [
-                            {"term": {"subheading_codes": sorted_subheading_codes}}
-                        ]
-                    }
+                        }
+                    ],
+                    "filter": [
+                        {"term": {"subheading_codes": sorted_subheading_codes}}
+                    ]
+                }
+            }
+        })
+        if response["hits"]["total"]["value"] > 0:
+            score = response["hits"]["hits"][0]["_score"]
+            print(f"RateLine cache similarity score:{score}")
+            # 相似度得分达到指定阈值的，直接返回结果，否则流程继续向下流转
+            if score > 0.95:
+                return {
+                    "hit_rate_line_cache": True,
+                    "main_rate_line": response["hits"]["hits"][0]["_source"]["rate_line_result"],
                 }
-            })
-            if response["hits"]["total"]["value"] > 0:
-                score = response["hits"]["hits"][0]["_score"]
-                print(f"RateLine cache similarity score:{score}")
-                # 相似度得分达到指定阈值的，直接返回结果，否则流程继续向下流转
-                if score > 0.95:
-                    return {
-                        "hit_rate_line_cache": True,
-                        "main_rate_line": response["hits"]["hits"][0]["_source"]["rate_line_result"],
-                    }
-            return {"hit_rate_line_cache": False}
+        return {"hit_rate_line_cache": False}
 
     async def save_for_evaluation(self, evaluate_version: str,
                                   origin_item_name: str,
@@ -94,5 +100,5 @@ class DetermineRateLineService:
             "llm_response": llm_response.model_dump(),
             "created_at": datetime.now(timezone.utc)
         }
-        async with get_async_opensearch_client() as async_client:
-            await async_client.index(index=IndexName.EVALUATE_LLM_CONFIRM_RATE_LINE.value, body=document)
+        async_client = get_async_opensearch_client()
+        await async_client.index(index=IndexName.EVALUATE_LLM_CONFIRM_RATE_LINE.value, body=document)
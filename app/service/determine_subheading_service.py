@@ -2,6 +2,7 @@
 确定子目服务
 """
 from datetime import datetime, timezone
+from typing import Callable
 
 from langchain_core.embeddings import Embeddings
 from langchain_core.language_models import BaseChatModel
@@ -11,8 +12,9 @@ from langchain_core.prompts import PromptTemplate
 from app.core.opensearch import get_async_opensearch_client
 from app.llm.prompt.prompt_template import determine_subheading_template
 from app.schema.llm.llm import SubheadingDetermineResponse
-from app.service.rewrite_item_service import RewriteItemEmbeddingsService
+from app.llm.embedding import default_embeddings_service
 from app.core.constants import IndexName
+from app.service.llm_response_cache_service import default_llm_response_cache_service
 
 
 class DetermineSubheadingService:
@@ -20,9 +22,10 @@ class DetermineSubheadingService:
     def __init__(self, llm: BaseChatModel, embeddings: Embeddings):
         self.llm = llm
         self.embeddings = embeddings
-        self.rewrite_item_embeddings_service = RewriteItemEmbeddingsService(embeddings=self.embeddings)
+        self.rewrite_item_embeddings_service = default_embeddings_service
 
-    async def determine_use_llm(self, rewritten_item: dict, subheading_documents: str):
+    async def determine_use_llm(self, rewritten_item: dict, subheading_documents: str,
+                                on_chunk: Callable[..., None] | None = None):
         """
         使用llm确定子目
         """
@@ -36,9 +39,11 @@ class DetermineSubheadingService:
         human_message = prompt.invoke({"item": rewritten_item,
                                        "subheading_list": subheading_documents}).to_messages()[0]
 
-        output = await self.llm.ainvoke(input=[human_message])
+        output, response = await default_llm_response_cache_service.ainvoke(
+            self.llm, "determine_subheading", determine_subheading_template, [human_message], parser.parse,
+            on_chunk=on_chunk)
 
-        return human_message, output, parser.parse(output.content)
+        return human_message, output, response
 
     async def save_simil_cache(self, origin_item_name: str, rewritten_item: dict,
                                heading_codes: list[str],
@@ -58,8 +63,8 @@ class DetermineSubheadingService:
             "alternative_subheadings": alternative_subheadings,
             "created_at": datetime.now(timezone.utc)
         }
-        async with get_async_opensearch_client() as async_client:
-            await async_client.index(index=IndexName.SUBHEADING_CLASSIFY.value, body=document)
+        async_client = get_async_opensearch_client()
+        await async_client.index(index=IndexName.SUBHEADING_CLASSIFY.value, body=document)
 
     async def get_simil_cache(self, rewritten_item: dict, heading_codes: list[str]):
         """
@@ -68,37 +73,37 @@ class DetermineSubheadingService:
         sorted_heading_codes = str(sorted(heading_codes))
         rewritten_item_vector = await self.rewrite_item_embeddings_service.get_rewritten_item_embeddings(
             rewritten_item)
-        async with get_async_opensearch_client() as async_client:
-            response = await async_client.search(index=IndexName.SUBHEADING_CLASSIFY.value, body={
-                "query": {
-                    "bool": {
-                        "must": [
-                            {
-                                "knn": {
-                                    "rewritten_item_vector": {
-                                        "vector": rewritten_item_vector,
-                                        "k": 100
-                                    }
+        async_client = get_async_opensearch_client()
+        response = await async_client.search(index=IndexName.SUBHEADING_CLASSIFY.value, body={
+            "query": {
+                "bool": {
+                    "must": [
+                        {
+                            "knn": {
+                                "rewritten_item_vector": {
+                                    "vector": rewritten_item_vector,
+                                    "k": 100
                                 }
                             }
-                        ],
-                        "filter": [
-                            {"term": {"heading_codes": sorted_heading_codes}}
-                        ]
-                    }
+                        }
+                    ],
+                    "filter": [
+                        {"term": {"heading_codes": sorted_heading_codes}}
+                    ]
                 }
-            })
-            if response["hits"]["total"]["value"] > 0:
-                score = response["hits"]["hits"][0]["_score"]
-                print(f"Subheading cache similarity score:{score}")
-                # 相似度得分达到指定阈值的，直接返回结果，否则流程继续向下流转
-                if score > 0.95:
-                    return {
-                        "hit_subheading_cache": True,
-                        "main_subheading": response["hits"]["hits"][0]["_source"]["main_subheading"],
-                        "alternative_subheadings": response["hits"]["hits"][0]["_source"]["alternative_subheadings"],
-                    }
-            return {"hit_subheading_cache": False}
+            }
+        })
+        if response["hits"]["total"]["value"] > 0:
+            score = response["hits"]["hits"][0]["_score"]
+            print(f"Subheading cache similarity score:{score}")
+            # 相似度得分达到指定阈值的，直接返回结果，否则流程继续向下流转
+            if score > 0.95:
+                return {
+                    "hit_subheading_cache": True,
+                    "main_subheading": response["hits"]["hits"][0]["_source"]["main_subheading"],
+                    "alternative_subheadings": response["hits"]["hits"][0]["_source"]["alternative_subheadings"],
+                }
+        return {"hit_subheading_cache": False}
 
     async def save_for_evaluation(self, evaluate_version: str, origin_item_name: str, subheading_documents: str,
                                   llm_response: SubheadingDetermineResponse, actual_subheading: str):
@@ -113,5 +118,5 @@ class DetermineSubheadingService:
             "actual_subheading": actual_subheading,
             "created_at": datetime.now(timezone.utc)
         }
-        async with get_async_opensearch_client() as async_client:
-            await async_client.index(index=IndexName.EVALUATE_LLM_CONFIRM_SUBHEADING, body=document)
+        async_client = get_async_opensearch_client()
+        await async_client.index(index=IndexName.EVALUATE_LLM_CONFIRM_SUBHEADING, body=document)
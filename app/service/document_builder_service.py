@@ -0,0 +1,128 @@
+"""
+按token预算组装各环节提示词中的文档
+
+检索到的文档按相关度排序后依次加入，超过预算的部分截断(至少保留最相关的一条)，并使用紧凑的JSON格式序列化
+"""
+import logging
+
+from app.core.config import settings
+from app.core.metrics import get_value_recorder
+from app.util.token_utils import estimate_tokens, dump_compact
+
+logger = logging.getLogger(__name__)
+
+
+def record_document_tokens(stage: str, documents: str, total_items: int, kept_items: int):
+    tokens = estimate_tokens(documents)
+    get_value_recorder(f"document_tokens.{stage}").observe(tokens)
+    if kept_items < total_items:
+        logger.info("Truncated %s documents to %s/%s items, about %s tokens", stage, kept_items, total_items, tokens)
+
+
+def build_heading_documents(headings: list[dict], chapter_scores: dict[str, float],
+                            heading_scores: dict[str, float]) -> tuple[str, dict[str, list[str]]]:
+    """
+    headings: 检索到的chapter下所有heading，包含chapter_code/chapter_title/heading_code/heading_title/
+        heading_includes/heading_common_examples
+    chapter_scores/heading_scores: 混合搜索的得分，chapter按得分排序，chapter内直接命中的heading排在前面
+
+    返回结构: {chapter_key: [{"c": heading_code, "t": heading_title, "i": heading_includes,
+        "e": heading_common_examples}]}，以及每个chapter保留的heading编码
+    """
+    ranked_headings = sorted(headings, key=lambda h: (-chapter_scores.get(h["chapter_code"], 0),
+                                                      h["chapter_code"],
+                                                      -heading_scores.get(h["heading_code"], 0),
+                                                      h["heading_code"]))
+    budget = settings.PROMPT_TOKEN_BUDGET_HEADING
+    used_tokens = 0
+    kept_headings = []
+    for heading in ranked_headings:
+        entry = {"c": heading["heading_code"], "t": heading["heading_title"],
+                 "i": list(heading["heading_includes"]), "e": list(heading["heading_common_examples"])}
+        tokens = estimate_tokens(dump_compact(entry))
+        if kept_headings and used_tokens + tokens > budget:
+            continue
+        used_tokens += tokens
+        kept_headings.append((heading, entry))
+
+    chapter_detail_dict: dict[str, list[dict]] = {}
+    candidate_heading_codes: dict[str, list[str]] = {}
+    # 保留的heading恢复为编码顺序输出
+    for heading, entry in sorted(kept_headings, key=lambda item: (item[0]["chapter_code"],
+                                                                  item[0]["heading_code"])):
+        chapter_key = f"{heading['chapter_code']}:{heading['chapter_title']}"
+        chapter_detail_dict.setdefault(chapter_key, []).append(entry)
+        candidate_heading_codes.setdefault(heading["chapter_code"], []).append(heading["heading_code"])
+    documents = dump_compact(chapter_detail_dict)
+    record_document_tokens("heading", documents, len(headings), len(kept_headings))
+    return documents, candidate_heading_codes
+
+
+def build_subheading_documents(heading_detail_dict: dict, ranked_heading_codes: list[str]) -> tuple[str, dict]:
+    """
+    heading_detail_dict: {chapter_key: {heading_key: [subheading, ...]}}
+    ranked_heading_codes: 按相关度排序的heading编码，超过预算时从最不相关的heading开始整体去掉
+
+    返回序列化后的文档及截断后的字典
+    """
+    keep = _select_within_budget(
+        {heading_key.split(":")[0]: dump_compact(subheadings)
+         for chapter_details in heading_detail_dict.values()
+         for heading_key, subheadings in chapter_details.items()},
+        ranked_heading_codes, settings.PROMPT_TOKEN_BUDGET_SUBHEADING)
+    result = _filter_second_level(heading_detail_dict, keep)
+    documents = dump_compact(result)
+    record_document_tokens("subheading", documents, len(ranked_heading_codes), len(keep))
+    return documents, result
+
+
+def build_rate_line_documents(subheading_tree: dict, ranked_subheading_codes: list[str]) -> tuple[str, dict]:
+    """
+    subheading_tree: {chapter_key: {heading_key: {subheading_key: [rate_line_tree, ...]}}}
+    ranked_subheading_codes: 主要子目在前的子目编码，超过预算时从最后的子目开始整体去掉
+
+    返回序列化后的文档及截断后的字典
+    """
+    keep = _select_within_budget(
+        {subheading_key.split(":")[0]: dump_compact(rate_lines)
+         for chapter_details in subheading_tree.values()
+         for heading_details in chapter_details.values()
+         for subheading_key, rate_lines in heading_details.items()},
+        ranked_subheading_codes, settings.PROMPT_TOKEN_BUDGET_RATE_LINE)
+    result = {}
+    for chapter_key, chapter_details in subheading_tree.items():
+        filtered_chapter = _filter_second_level(chapter_details, keep)
+        if filtered_chapter:
+            result[chapter_key] = filtered_chapter
+    documents = dump_compact(result)
+    record_document_tokens("rate_line", documents, len(ranked_subheading_codes), len(keep))
+    return documents, result
+
+
+def _select_within_budget(serialized: dict[str, str], ranked_codes: list[str], budget: int) -> set[str]:
+    """
+    按顺序选取编码，直到超过预算，至少保留第一个
+    """
+    keep = set()
+    used_tokens = 0
+    for code in dict.fromkeys(ranked_codes):
+        if code not in serialized:
+            continue
+        tokens = estimate_tokens(serialized[code])
+        if keep and used_tokens + tokens > budget:
+            continue
+        keep.add(code)
+        used_tokens += tokens
+    return keep
+
+
+def _filter_second_level(tree: dict, keep: set[str]) -> dict:
+    """
+    只保留第二层key中编码(key为"编码:标题")在keep中的节点，去掉因此变空的第一层节点
+    """
+    result = {}
+    for key, children in tree.items():
+        filtered = {child_key: value for child_key, value in children.items() if child_key.split(":")[0] in keep}
+        if filtered:
+            result[key] = filtered
+    return result
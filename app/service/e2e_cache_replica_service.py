@@ -0,0 +1,198 @@
+"""
+e2e相似度缓存索引(traffic_mind_classify_e2e)的进程内FAISS副本
+
+启动时通过scroll从OpenSearch全量加载，之后按created_at定时拉取新增文档，本进程保存的文档直接加入副本。
+副本只用于加速相似度查询，OpenSearch仍然是数据源，副本未就绪时查询回退到OpenSearch
+
+拉取的文档在线程中加入索引，本进程保存的文档及查询在事件循环中执行，索引及文档列表的读写都持有同一个锁:
+FAISS的HNSW索引不支持同时写入或者写入时查询，文档列表与索引中的向量编号也必须一起追加
+"""
+import asyncio
+import logging
+import threading
+from dataclasses import dataclass
+
+import faiss
+import numpy as np
+
+from app.core.config import settings
+from app.core.constants import IndexName, DEFAULT_EMBEDDINGS_DIMENSION
+from app.core.opensearch import get_async_opensearch_client
+
+logger = logging.getLogger(__name__)
+
+SOURCE_FIELDS = ["rewritten_item_vector", "rate_line_code", "final_description", "created_at"]
+
+
+@dataclass(frozen=True)
+class E2ECacheHit:
+    score: float
+    rate_line_code: str
+    final_description: str
+
+
+def to_opensearch_score(cosine: float) -> float:
+    """
+    将余弦相似度转换为OpenSearch cosinesimil空间的得分，保证本地查询与OpenSearch使用同一个阈值
+    """
+    return 1 / (2 - cosine)
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+class E2ECacheReplica:
+
+    def __init__(self, dimension: int):
+        self.dimension = dimension
+        self.index = self.new_index()
+        self.documents: list[tuple[str, str]] = []
+        self.doc_ids: set[str] = set()
+        self.last_created_at: str | None = None
+        self.ready = False
+        self.lock = threading.Lock()
+
+    def new_index(self) -> faiss.Index:
+        # 向量归一化后内积即为余弦相似度
+        index = faiss.IndexHNSWFlat(self.dimension, settings.E2E_CACHE_REPLICA_HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efSearch = settings.E2E_CACHE_REPLICA_HNSW_EF_SEARCH
+        return index
+
+    def add_hits(self, hits: list[dict]):
+        """
+        添加OpenSearch返回的文档，已经存在的文档跳过
+        """
+        with self.lock:
+            vectors = []
+            for hit in hits:
+                source = hit["_source"]
+                created_at = source.get("created_at")
+                if created_at and (self.last_created_at is None or created_at > self.last_created_at):
+                    self.last_created_at = created_at
+                if hit["_id"] in self.doc_ids or not source.get("rewritten_item_vector"):
+                    continue
+                self.doc_ids.add(hit["_id"])
+                self.documents.append((source["rate_line_code"], source["final_description"]))
+                vectors.append(source["rewritten_item_vector"])
+            if vectors:
+                self.index.add(normalize(np.asarray(vectors, dtype=np.float32)))
+
+    def search(self, vector: list[float]) -> E2ECacheHit | None:
+        query = normalize(np.asarray([vector], dtype=np.float32))
+        with self.lock:
+            if self.index.ntotal == 0:
+                return None
+            scores, ids = self.index.search(query, 1)
+            if ids[0][0] < 0:
+                return None
+            rate_line_code, final_description = self.documents[ids[0][0]]
+        return E2ECacheHit(score=to_opensearch_score(float(scores[0][0])),
+                           rate_line_code=rate_line_code,
+                           final_description=final_description)
+
+    async def bootstrap(self):
+        """
+        scroll读取全部文档，在线程中构建索引，不阻塞事件循环
+        """
+        async_client = get_async_opensearch_client()
+        hits = []
+        response = await async_client.search(index=IndexName.CLASSIFY_E2E_CACHE.value, scroll="2m",
+                                             body={"size": settings.E2E_CACHE_REPLICA_PAGE_SIZE,
+                                                   "_source": SOURCE_FIELDS,
+                                                   "query": {"match_all": {}}})
+        scroll_id = response.get("_scroll_id")
+        try:
+            while response["hits"]["hits"]:
+                hits.extend(response["hits"]["hits"])
+                response = await async_client.scroll(scroll_id=scroll_id, scroll="2m")
+                scroll_id = response.get("_scroll_id", scroll_id)
+        finally:
+            if scroll_id:
+                await async_client.clear_scroll(scroll_id=scroll_id, ignore=(404,))
+        await asyncio.to_thread(self.add_hits, hits)
+        self.ready = True
+        logger.info("E2E cache replica loaded %s documents", self.index.ntotal)
+
+    async def tail(self):
+        """
+        拉取上次之后新增的文档(包括其他进程保存的)
+
+        OpenSearch写入后需要refresh才能查到，查询范围向前多回溯一段时间，重复的文档通过_id去重
+        """
+        async_client = get_async_opensearch_client()
+        query = {"range": {"created_at": {
+            "gte": f"{self.last_created_at}||-{settings.E2E_CACHE_REPLICA_TAIL_LOOKBACK_SECONDS}s"}}} \
+            if self.last_created_at else {"match_all": {}}
+        search_after = None
+        while True:
+            body = {"size": settings.E2E_CACHE_REPLICA_PAGE_SIZE,
+                    "_source": SOURCE_FIELDS,
+                    "sort": [{"created_at": "asc"}],
+                    "query": query}
+            if search_after:
+                body["search_after"] = search_after
+            response = await async_client.search(index=IndexName.CLASSIFY_E2E_CACHE.value, body=body)
+            hits = response["hits"]["hits"]
+            await asyncio.to_thread(self.add_hits, hits)
+            if len(hits) < settings.E2E_CACHE_REPLICA_PAGE_SIZE:
+                return
+            search_after = hits[-1]["sort"]
+
+    def add_local(self, doc_id: str, document: dict):
+        """
+        本进程保存的文档直接加入副本，不更新拉取位置，其他进程同一时间保存的文档仍然由tail拉取
+        """
+        if not self.ready:
+            # 全量加载尚未完成时由tail补充
+            return
+        self.add_hits([{"_id": doc_id, "_source": {key: value for key, value in document.items()
+                                                   if key != "created_at"}}])
+
+    async def run(self):
+        while not self.ready:
+            try:
+                await self.bootstrap()
+            except Exception as e:
+                logger.warning("E2E cache replica bootstrap failed, retry later: %s", e)
+                await asyncio.sleep(settings.E2E_CACHE_REPLICA_TAIL_INTERVAL_SECONDS)
+        while True:
+            await asyncio.sleep(settings.E2E_CACHE_REPLICA_TAIL_INTERVAL_SECONDS)
+            try:
+                await self.tail()
+            except Exception as e:
+                logger.warning("E2E cache replica tail failed: %s", e)
+
+
+__e2e_cache_replica: E2ECacheReplica | None = None
+__e2e_cache_replica_task: asyncio.Task | None = None
+
+
+def get_e2e_cache_replica() -> E2ECacheReplica | None:
+    """
+    副本已经完成全量加载时返回，否则返回None，由调用方回退到OpenSearch
+    """
+    if __e2e_cache_replica is not None and __e2e_cache_replica.ready:
+        return __e2e_cache_replica
+    return None
+
+
+def start_e2e_cache_replica():
+    global __e2e_cache_replica, __e2e_cache_replica_task
+    if not settings.E2E_CACHE_REPLICA_ENABLED or __e2e_cache_replica_task is not None:
+        return
+    __e2e_cache_replica = E2ECacheReplica(DEFAULT_EMBEDDINGS_DIMENSION)
+    __e2e_cache_replica_task = asyncio.create_task(__e2e_cache_replica.run())
+
+
+async def stop_e2e_cache_replica():
+    global __e2e_cache_replica, __e2e_cache_replica_task
+    if __e2e_cache_replica_task is not None:
+        __e2e_cache_replica_task.cancel()
+        try:
+            await __e2e_cache_replica_task
+        except asyncio.CancelledError:
+            pass
+    __e2e_cache_replica_task = None
+    __e2e_cache_replica = None
@@ -1,90 +1,239 @@
+import asyncio
 import json
+import logging
+import sys
+from array import array
 
 from langchain.embeddings.base import Embeddings
 from collections import OrderedDict
 
+from app.core.config import settings
 from app.core.constants import RedisKeyPrefix
 from app.util.hash_utils import md5_hash
+from app.util.vector_codec import encode_vector, decode_vector, is_encoded_vector
 from app.core.redis import get_async_redis
 
+logger = logging.getLogger(__name__)
+
+# 旧的缓存key前缀，改写商品和用户输入分别缓存，现在统一使用RedisKeyPrefix.EMBEDDINGS
+LEGACY_KEY_PREFIXES = (RedisKeyPrefix.REWRITTEN_ITEM_EMBEDDINGS, RedisKeyPrefix.USER_INPUT_EMBEDDINGS)
+
+
+def encode_cached_vector(vector: list[float]) -> bytes:
+    return encode_vector(vector, settings.EMBEDDINGS_CACHE_DTYPE)
+
+
+def decode_cached_vector(data: bytes) -> list[float]:
+    return decode_vector(data)
+
+
+def rewritten_item_text(rewritten_item: dict) -> str:
+    """
+    改写商品按key排序后的JSON，作为获取embedding的文本
+    """
+    return json.dumps(OrderedDict(sorted(rewritten_item.items())), ensure_ascii=False)
+
+
+class LocalVectorCache:
+    """
+    进程内按字节数限制大小的LRU缓存
+
+    向量以float32数组保存(每维4字节)，比python的float列表(每维约32字节)节省内存，取出时转换为列表
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size_bytes = 0
+        self.entries: OrderedDict[str, array] = OrderedDict()
+
+    @staticmethod
+    def entry_size(key: str, vector: array) -> int:
+        return sys.getsizeof(key) + sys.getsizeof(vector)
+
+    def get(self, key: str) -> list[float] | None:
+        vector = self.entries.get(key)
+        if vector is None:
+            return None
+        self.entries.move_to_end(key)
+        return vector.tolist()
+
+    def put(self, key: str, vector: list[float]):
+        if self.max_bytes <= 0:
+            return
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.size_bytes -= self.entry_size(key, old)
+        data = array("f", vector)
+        self.entries[key] = data
+        self.size_bytes += self.entry_size(key, data)
+        while self.size_bytes > self.max_bytes and self.entries:
+            evicted_key, evicted = self.entries.popitem(last=False)
+            self.size_bytes -= self.entry_size(evicted_key, evicted)
+
 
 class EmbeddingsService:
+    """
+    所有服务共用的embedding缓存
+
+    进程内LRU -> redis -> 模型三级获取，同一个文本不管被哪个服务使用都对应同一个key，
+    并发请求同一个文本时只有一个协程真正查询redis/模型，其他协程等待其结果
+    """
+
     def __init__(self, embeddings: Embeddings, embeddings_name: str, dimension: int):
         self.embeddings = embeddings
         self.embeddings_name = embeddings_name
         self.dimension = dimension
+        self.local_cache = LocalVectorCache(settings.EMBEDDINGS_LOCAL_CACHE_MAX_BYTES)
+        self.inflight: dict[str, asyncio.Future] = dict()
+
+    def cache_key(self, text: str) -> str:
+        """
+        embedding缓存key: embeddings:{格式版本}:{模型}:{维度}:{文本md5}
+        """
+        return ":".join([RedisKeyPrefix.EMBEDDINGS.value, settings.EMBEDDINGS_CACHE_KEY_VERSION,
+                         self.embeddings_name, str(self.dimension), md5_hash(text)])
 
     async def get_rewritten_item_embeddings(self, rewritten_item: dict) -> list[float]:
         """
-        获取改写商品的embeddings，优先使用redis缓存，如果没有走接口获取，然后缓存到redis中
+        获取改写商品的embeddings，优先使用缓存，如果没有走接口获取，然后缓存到redis中
         """
-        rewritten_item_vector = None
-        ordered_rewritten_item = OrderedDict(sorted(rewritten_item.items()))
-        rewritten_item_json = json.dumps(ordered_rewritten_item, ensure_ascii=False)
-        redis_hash_key = (f"{RedisKeyPrefix.REWRITTEN_ITEM_EMBEDDINGS.value}"
-                          f":{self.embeddings_name}"
-                          f":{self.dimension}"
-                          f":{md5_hash(rewritten_item_json)}")
-        async_redis = await get_async_redis()
-        vector_json = await async_redis.get(redis_hash_key)
-        if vector_json:
-            rewritten_item_vector = json.loads(vector_json)
-        if rewritten_item_vector is None:
-            rewritten_item_vector = await self.embeddings.aembed_query(rewritten_item_json)
-            # 将llm返回的embedding缓存到redis
-            await async_redis.set(redis_hash_key, json.dumps(rewritten_item_vector, ensure_ascii=False))
-        return rewritten_item_vector
+        return await self.get_embeddings_for_str(rewritten_item_text(rewritten_item))
 
     async def get_embeddings_for_str(self, text: str, use_cache: bool = True) -> list[float]:
-        rewritten_item_vector = None
+        if not use_cache:
+            return await self.embeddings.aembed_query(text)
+        key = self.cache_key(text)
+        vector = self.local_cache.get(key)
+        if vector is not None:
+            return vector
+        future = self.inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self.load_embeddings(key, text))
+            self.inflight[key] = future
+            future.add_done_callback(lambda _: self.inflight.pop(key, None))
+        # 调用方被取消时不影响其他等待同一个结果的协程
+        return list(await asyncio.shield(future))
+
+    async def load_embeddings(self, key: str, text: str) -> list[float]:
         async_redis = await get_async_redis()
-        redis_hash_key = (f"{RedisKeyPrefix.USER_INPUT_EMBEDDINGS.value}"
-                          f":{self.embeddings_name}"
-                          f":{self.dimension}"
-                          f":{md5_hash(text)}")
-        if use_cache:
-            vector_json = await async_redis.get(redis_hash_key)
-            if vector_json:
-                rewritten_item_vector = json.loads(vector_json)
-        if rewritten_item_vector is None:
-            rewritten_item_vector = await self.embeddings.aembed_query(text)
+        vector_data = await async_redis.get(key)
+        if vector_data:
+            vector = decode_cached_vector(vector_data)
+        else:
+            vector = await self.embeddings.aembed_query(text)
             # 将llm返回的embedding缓存到redis
-            if use_cache:
-                await async_redis.set(redis_hash_key, json.dumps(rewritten_item_vector, ensure_ascii=False))
-        return rewritten_item_vector
+            await async_redis.set(key, encode_cached_vector(vector), ex=settings.EMBEDDINGS_CACHE_TTL_SECONDS)
+        self.local_cache.put(key, vector)
+        return vector
 
     async def get_embeddings_for_list(self, texts: list[str], use_cache: bool = True) -> list[list[float]]:
-        result = []
-        # 需要使用模型获取embedding的列表
-        texts_to_process = []
-        indices_to_process = []
-        async_redis = await get_async_redis()
+        """
+        批量获取embedding，结果顺序与texts一致
 
-        # 从缓存中获取embedding
-        for index, text in enumerate(texts):
-            cache_result = None
-            if use_cache:
-                for text in texts:
-                    redis_hash_key = (f"{RedisKeyPrefix.USER_INPUT_EMBEDDINGS.value}"
-                                      f":{self.embeddings_name}"
-                                      f":{self.dimension}"
-                                      f":{md5_hash(text)}")
-                    cache_result = await async_redis.get(redis_hash_key)
-            if cache_result:
-                result[index] = json.loads(cache_result)
-            else:
-                texts_to_process.append(text)
-                indices_to_process.append(index)
-        # 缓存中不存在的使用模型获取
-        if texts_to_process:
-            new_embeddings = await self.embeddings.aembed_documents(texts_to_process)
-            for idx, embedding in zip(indices_to_process, new_embeddings):
-                result[idx] = embedding
-                if use_cache:
-                    redis_hash_key = (f"{RedisKeyPrefix.USER_INPUT_EMBEDDINGS.value}"
-                                      f":{self.embeddings_name}"
-                                      f":{self.dimension}"
-                                      f":{md5_hash(texts[idx])}")
-                    await async_redis.set(redis_hash_key, json.dumps(embedding, ensure_ascii=False))
+        进程内未命中的使用一次MGET查询redis，仍未命中的文本去重后一次批量请求模型，新结果通过pipeline写回redis，
+        无论列表多长redis都只有固定的两次往返
+        """
+        if not texts:
+            return []
+        if not use_cache:
+            return await self.embeddings.aembed_documents(texts)
+        keys = [self.cache_key(text) for text in texts]
+        result: list[list[float] | None] = [self.local_cache.get(key) for key in keys]
 
+        # 进程内未命中的，正在被其他协程获取的等待其结果，其余的由当前协程批量获取
+        waiting: dict[str, asyncio.Future] = dict()
+        loading: dict[str, str] = dict()
+        for key, text, vector in zip(keys, texts, result):
+            if vector is not None or key in waiting or key in loading:
+                continue
+            if key in self.inflight:
+                waiting[key] = self.inflight[key]
+            else:
+                loading[key] = text
+        if loading:
+            loop = asyncio.get_running_loop()
+            futures = {key: loop.create_future() for key in loading}
+            self.inflight.update(futures)
+            try:
+                vectors = await self.load_embeddings_batch(loading)
+                for key, future in futures.items():
+                    future.set_result(vectors[key])
+            except asyncio.CancelledError:
+                for future in futures.values():
+                    future.cancel()
+                raise
+            except Exception as e:
+                for future in futures.values():
+                    future.set_exception(e)
+                    # 没有其他协程等待时避免"exception was never retrieved"警告
+                    future.exception()
+                raise
+            finally:
+                for key in futures:
+                    self.inflight.pop(key, None)
+            for index, key in enumerate(keys):
+                if key in vectors:
+                    result[index] = list(vectors[key])
+        for key, future in waiting.items():
+            vector = await asyncio.shield(future)
+            for index, k in enumerate(keys):
+                if k == key:
+                    result[index] = list(vector)
         return result
+
+    async def load_embeddings_batch(self, texts: dict[str, str]) -> dict[str, list[float]]:
+        async_redis = await get_async_redis()
+        keys = list(texts)
+        vectors: dict[str, list[float]] = dict()
+        for key, cache_result in zip(keys, await async_redis.mget(keys)):
+            if cache_result:
+                vectors[key] = decode_cached_vector(cache_result)
+        keys_to_process = [key for key in keys if key not in vectors]
+        if keys_to_process:
+            new_embeddings = await self.embeddings.aembed_documents([texts[key] for key in keys_to_process])
+            vectors.update(zip(keys_to_process, new_embeddings))
+            async with async_redis.pipeline(transaction=False) as pipe:
+                for key in keys_to_process:
+                    pipe.set(key, encode_cached_vector(vectors[key]), ex=settings.EMBEDDINGS_CACHE_TTL_SECONDS)
+                await pipe.execute()
+        for key, vector in vectors.items():
+            self.local_cache.put(key, vector)
+        return vectors
+
+    async def migrate_legacy_cache(self, batch_size: int = 500) -> int:
+        """
+        将旧key(rewritten_item_embeddings/user_input_embeddings，JSON或二进制格式)转换为当前的key及二进制格式，
+        并设置过期时间，转换后删除旧key
+
+        旧key的最后一段都是文本的md5，并且都是同一个模型生成的，可以直接对应到新key。
+        分批SCAN+MGET+pipeline写入，可以在后台运行，中途中断后再次运行会继续处理剩余的key
+        """
+        async_redis = await get_async_redis()
+        migrated = 0
+        for prefix in LEGACY_KEY_PREFIXES:
+            batch = []
+            async for key in async_redis.scan_iter(match=f"{prefix.value}:*", count=batch_size):
+                batch.append(key.decode() if isinstance(key, bytes) else key)
+                if len(batch) >= batch_size:
+                    migrated += await self.migrate_legacy_keys(batch)
+                    batch = []
+            if batch:
+                migrated += await self.migrate_legacy_keys(batch)
+        logger.info("Migrated %s legacy embeddings cache keys", migrated)
+        return migrated
+
+    async def migrate_legacy_keys(self, keys: list[str]) -> int:
+        async_redis = await get_async_redis()
+        values = await async_redis.mget(keys)
+        migrated = 0
+        async with async_redis.pipeline(transaction=False) as pipe:
+            for key, value in zip(keys, values):
+                if value is not None:
+                    new_key = ":".join([RedisKeyPrefix.EMBEDDINGS.value, settings.EMBEDDINGS_CACHE_KEY_VERSION,
+                                        self.embeddings_name, str(self.dimension), key.rsplit(":", 1)[-1]])
+                    data = value if is_encoded_vector(value) else encode_cached_vector(json.loads(value))
+                    pipe.set(new_key, data, ex=settings.EMBEDDINGS_CACHE_TTL_SECONDS, nx=True)
+                    migrated += 1
+                pipe.delete(key)
+            await pipe.execute()
+        return migrated
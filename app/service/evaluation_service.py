@@ -1,23 +1,46 @@
 import logging
 import uuid
-import pandas as pd
 import asyncio
 
 from fastapi import Request
 from langgraph.graph.state import CompiledStateGraph
 
-from app.core.constants import IndexName
+from app.core.constants import IndexName, EVALUATION_THREAD_ID_PREFIX
+from app.core.config import settings
 from app.core.opensearch import get_async_opensearch_client
+from app.llm.scheduler import Priority, with_priority
 
 logger = logging.getLogger(__name__)
 
 
+def new_evaluation_thread_id() -> str:
+    return f"{EVALUATION_THREAD_ID_PREFIX}{uuid.uuid4()}"
+
+
+async def delete_evaluation_thread(graph: CompiledStateGraph, thread_id: str):
+    """
+    评估结束后不需要恢复，立即删除checkpoint，删除失败时由定时清理任务处理
+    """
+    try:
+        await graph.checkpointer.adelete_thread(thread_id)
+    except Exception as e:
+        logger.warning("Delete evaluation thread %s failed: %s", thread_id, e)
+
+
 async def run_ignore_output(input: dict, graph, config):
-    async for step in graph.astream(input, config, stream_mode="updates", subgraphs=True):
-        pass
+    try:
+        async for step in graph.astream(input, config, stream_mode="updates", subgraphs=True,
+                                        durability=settings.CHECKPOINT_DURABILITY):
+            pass
+    finally:
+        await delete_evaluation_thread(graph, config["configurable"]["thread_id"])
 
 
+@with_priority(Priority.BATCH)
 async def do_batch_hts_classify_evaluation(request: Request, evaluate_version: str, evaluate_count: int):
+    # pandas只有评估时使用，不在启动时导入
+    import pandas as pd
+
     graph: CompiledStateGraph = request.app.state.hts_graph
     df = pd.read_csv("app/data/evaluate_processed.tsv", sep="\t", dtype=str)
     tasks = []
@@ -26,7 +49,7 @@ async def do_batch_hts_classify_evaluation(request: Request, evaluate_version: s
     for row in df.itertuples():
         item = row.item_en
         hscode = row.hscode
-        config = {"configurable": {"thread_id": str(uuid.uuid4()), "is_for_evaluation": True,
+        config = {"configurable": {"thread_id": new_evaluation_thread_id(), "is_for_evaluation": True,
                                    "evaluate_version": evaluate_version, "hscode": hscode}}
         tasks.append(run_ignore_output({"item": item}, graph, config))
         count += 1
@@ -62,143 +85,143 @@ async def get_hts_classify_evaluation_result(evaluate_version: str):
     }
 
 async def get_heading_document_recall_rate(evaluate_version: str):
-    async with get_async_opensearch_client() as async_client:
-        total_count = 0
-        hit_count = 0
-        recall_rate = 0
-        page_size = 10
-        page = 0
-        while True:
-            response = await async_client.search(index=IndexName.EVALUATE_RETRIEVE_HEADING.value, body={
-                "size": page_size,
-                "from": page * page_size,
-                "query": {
-                    "term": {
-                        "evaluate_version": {
-                            "value": evaluate_version
-                        }
+    async_client = get_async_opensearch_client()
+    total_count = 0
+    hit_count = 0
+    recall_rate = 0
+    page_size = 10
+    page = 0
+    while True:
+        response = await async_client.search(index=IndexName.EVALUATE_RETRIEVE_HEADING.value, body={
+            "size": page_size,
+            "from": page * page_size,
+            "query": {
+                "term": {
+                    "evaluate_version": {
+                        "value": evaluate_version
                     }
-                },
-                "sort": [
-                    {"_id": "asc"}
-                ]
-            })
-            if response["hits"]["total"]["value"] > 0:
-                hits = response["hits"]["hits"]
-                for hit in hits:
-                    total_count += 1
-                    matches = hit["_source"]["matches"]
-                    if matches:
-                        hit_count += 1
-
-                # 检查是否达到最后一页
-                if len(hits) < page_size:
-                    break
-            else:
-                # 一条数据都没有
+                }
+            },
+            "sort": [
+                {"_id": "asc"}
+            ]
+        })
+        if response["hits"]["total"]["value"] > 0:
+            hits = response["hits"]["hits"]
+            for hit in hits:
+                total_count += 1
+                matches = hit["_source"]["matches"]
+                if matches:
+                    hit_count += 1
+
+            # 检查是否达到最后一页
+            if len(hits) < page_size:
                 break
+        else:
+            # 一条数据都没有
+            break
 
-            page += 1
-            # 安全限制，避免意外无限循环
-            if page > 1000:
-                break
+        page += 1
+        # 安全限制，避免意外无限循环
+        if page > 1000:
+            break
 
-        if total_count > 0:
-            recall_rate = hit_count / total_count
+    if total_count > 0:
+        recall_rate = hit_count / total_count
     return total_count, hit_count, recall_rate
 
 
 async def get_determine_heading_accuracy_rate(evaluate_version: str):
-    async with get_async_opensearch_client() as async_client:
-        total_count = 0
-        hit_count = 0
-        accuracy_rate = 0
-        page_size = 10
-        page = 0
-        while True:
-            response = await async_client.search(index=IndexName.EVALUATE_LLM_CONFIRM_HEADING.value, body={
-                "size": page_size,
-                "from": page * page_size,
-                "query": {
-                    "term": {
-                        "evaluate_version": {
-                            "value": evaluate_version
-                        }
+    async_client = get_async_opensearch_client()
+    total_count = 0
+    hit_count = 0
+    accuracy_rate = 0
+    page_size = 10
+    page = 0
+    while True:
+        response = await async_client.search(index=IndexName.EVALUATE_LLM_CONFIRM_HEADING.value, body={
+            "size": page_size,
+            "from": page * page_size,
+            "query": {
+                "term": {
+                    "evaluate_version": {
+                        "value": evaluate_version
                     }
-                },
-                "sort": [
-                    {"_id": "asc"}
-                ]
-            })
-            if response["hits"]["total"]["value"] > 0:
-                hits = response["hits"]["hits"]
-                for hit in hits:
-                    total_count += 1
-                    matches = hit["_source"]["matches"]
-                    if matches:
-                        hit_count += 1
-
-                # 检查是否达到最后一页
-                if len(hits) < page_size:
-                    break
-            else:
-                # 一条数据都没有
+                }
+            },
+            "sort": [
+                {"_id": "asc"}
+            ]
+        })
+        if response["hits"]["total"]["value"] > 0:
+            hits = response["hits"]["hits"]
+            for hit in hits:
+                total_count += 1
+                matches = hit["_source"]["matches"]
+                if matches:
+                    hit_count += 1
+
+            # 检查是否达到最后一页
+            if len(hits) < page_size:
                 break
+        else:
+            # 一条数据都没有
+            break
 
-            page += 1
-            # 安全限制，避免意外无限循环
-            if page > 1000:
-                break
-        if total_count > 0:
-            accuracy_rate = hit_count / total_count
+        page += 1
+        # 安全限制，避免意外无限循环
+        if page > 1000:
+            break
+    if total_count > 0:
+        accuracy_rate = hit_count / total_count
     return total_count, hit_count, accuracy_rate
 
 
 async def get_determine_subheading_accuracy_rate(evaluate_version: str):
-    async with get_async_opensearch_client() as async_client:
-        total_count = 0
-        hit_count = 0
-        accuracy_rate = 0
-        page_size = 10
-        page = 0
-        while True:
-            response = await async_client.search(index=IndexName.EVALUATE_LLM_CONFIRM_SUBHEADING.value, body={
-                "size": page_size,
-                "from": page * page_size,
-                "query": {
-                    "term": {
-                        "evaluate_version": {
-                            "value": evaluate_version
-                        }
+    async_client = get_async_opensearch_client()
+    total_count = 0
+    hit_count = 0
+    accuracy_rate = 0
+    page_size = 10
+    page = 0
+    while True:
+        response = await async_client.search(index=IndexName.EVALUATE_LLM_CONFIRM_SUBHEADING.value, body={
+            "size": page_size,
+            "from": page * page_size,
+            "query": {
+                "term": {
+                    "evaluate_version": {
+                        "value": evaluate_version
                     }
-                },
-                "sort": [
-                    {"_id": "asc"}
-                ]
-            })
-            if response["hits"]["total"]["value"] > 0:
-                hits = response["hits"]["hits"]
-                for hit in hits:
-                    total_count += 1
-                    actual_subheading = hit["_source"]["actual_subheading"]
-                    main_subheading = hit["_source"]["llm_response"]["main_subheading"]
-                    alternative_subheadings = hit["_source"]["llm_response"]["alternative_subheadings"]
-                    all_subheadings = [main_subheading] + (alternative_subheadings if alternative_subheadings else [])
-                    subheading_codes = [subheading["subheading_code"] for subheading in all_subheadings]
-                    if actual_subheading in subheading_codes:
-                        hit_count += 1
-
-                # 检查是否达到最后一页
-                if len(hits) < page_size:
-                    break
-            else:
-                # 一条数据都没有
+                }
+            },
+            "sort": [
+                {"_id": "asc"}
+            ]
+        })
+        if response["hits"]["total"]["value"] > 0:
+            hits = response["hits"]["hits"]
+            for hit in hits:
+                total_count += 1
+                actual_subheading = hit["_source"]["actual_subheading"]
+                main_subheading = hit["_source"]["llm_response"]["main_subheading"]
+                alternative_subheadings = hit["_source"]["llm_response"]["alternative_subheadings"]
+                all_subheadings = [main_subheading] + (alternative_subheadings if alternative_subheadings else [])
+                subheading_codes = [subheading["subheading_code"] for subheading in all_subheadings]
+                if actual_subheading in subheading_codes:
+                    hit_count += 1
+
+            # 检查是否达到最后一页
+            if len(hits) < page_size:
                 break
+        else:
+            # 一条数据都没有
+            break
 
-            page += 1
-            # 安全限制，避免意外无限循环
-            if page > 1000:
-                break
-        if total_count > 0:
-            accuracy_rate = hit_count / total_count
+        page += 1
+        # 安全限制，避免意外无限循环
+        if page > 1000:
+            break
+    if total_count > 0:
+        accuracy_rate = hit_count / total_count
     return total_count, hit_count, accuracy_rate
@@ -1,4 +1,5 @@
 from datetime import datetime, timezone
+from typing import Callable
 
 from langchain_core.embeddings import Embeddings
 from langchain_core.language_models import BaseChatModel
@@ -10,9 +11,14 @@ from app.db.session import AsyncSessionLocal
 from app.llm.prompt.prompt_template import generate_final_output_template
 from app.model.hts_classify_cache_model import HtsClassifyE2ECache
 from app.repo.hts_classify_cache_repo import insert_e2e_cache
-from app.service.rewrite_item_service import RewriteItemEmbeddingsService
+from app.llm.embedding import default_embeddings_service
 from app.schema.llm.llm import GenerateFinalOutputResponse
 from app.core.constants import IndexName
+from app.service.e2e_cache_replica_service import get_e2e_cache_replica
+from app.service.llm_response_cache_service import default_llm_response_cache_service
+
+# e2e相似度缓存命中的最低得分(OpenSearch cosinesimil得分)
+E2E_SIMIL_CACHE_THRESHOLD = 0.95
 
 
 class FinalOutputService:
@@ -20,14 +26,15 @@ class FinalOutputService:
     def __init__(self, llm: BaseChatModel, embeddings: Embeddings):
         self.llm = llm
         self.embeddings = embeddings
-        self.rewrite_item_embeddings_service = RewriteItemEmbeddingsService(embeddings=self.embeddings)
+        self.rewrite_item_embeddings_service = default_embeddings_service
 
     async def get_final_output_from_llm(self, origin_item_name: str, rewritten_item: dict,
                                         heading_candidates: list, selected_heading: str, select_heading_reason: str,
                                         subheading_candidates: list, selected_subheading: str,
                                         select_subheading_reason: str,
                                         rate_line_candidates: list, selected_rate_line: str,
-                                        select_rate_line_reason: str):
+                                        select_rate_line_reason: str,
+                                        on_chunk: Callable[..., None] | None = None):
         parser = PydanticOutputParser(pydantic_object=GenerateFinalOutputResponse)
         format_instructions = parser.get_format_instructions()
 
@@ -52,9 +59,11 @@ class FinalOutputService:
                                        "reason_rate_line": select_rate_line_reason,
                                        "final_code": selected_rate_line}).to_messages()[0]
 
-        output = await self.llm.ainvoke(input=[human_message])
+        output, response = await default_llm_response_cache_service.ainvoke(
+            self.llm, "generate_final_output", generate_final_output_template, [human_message], parser.parse,
+            on_chunk=on_chunk)
 
-        return human_message, output, parser.parse(output.content)
+        return human_message, output, response
 
     async def save_e2e_exact_cache(self, origin_item_name: str, rewritten_item: dict,
                                    chapter_code,
@@ -101,29 +110,45 @@ class FinalOutputService:
             "final_description": final_output_response,
             "created_at": datetime.now(timezone.utc)
         }
-        async with get_async_opensearch_client() as async_client:
-            await async_client.index(index=IndexName.CLASSIFY_E2E_CACHE.value, body=document)
+        async_client = get_async_opensearch_client()
+        response = await async_client.index(index=IndexName.CLASSIFY_E2E_CACHE.value, body=document)
+        replica = get_e2e_cache_replica()
+        if replica:
+            replica.add_local(response["_id"], document)
 
     async def get_e2e_simil_cache(self, rewritten_item: dict):
-        async with get_async_opensearch_client() as async_client:
-            response = await async_client.search(index=IndexName.CLASSIFY_E2E_CACHE.value, body={
-                "query": {
-                    "knn": {
-                        "rewritten_item_vector": {
-                            "vector": await self.rewrite_item_embeddings_service.get_rewritten_item_embeddings(
-                                rewritten_item),
-                            "k": 1
-                        }
-                    }
+        rewritten_item_vector = await self.rewrite_item_embeddings_service.get_rewritten_item_embeddings(
+            rewritten_item)
+        # 优先查询进程内副本，副本未就绪时查询OpenSearch
+        replica = get_e2e_cache_replica()
+        if replica:
+            hit = replica.search(rewritten_item_vector)
+            if hit and hit.score > E2E_SIMIL_CACHE_THRESHOLD:
+                return {
+                    "hit_e2e_simil_cache": True,
+                    "final_rate_line_code": hit.rate_line_code,
+                    "final_description": hit.final_description
                 }
-            })
-            if response["hits"]["total"]["value"] > 0:
-                score = response["hits"]["hits"][0]["_score"]
-                print(f"English similarity score:{score}")
-                if score > 0.95:
-                    return {
-                        "hit_e2e_simil_cache": True,
-                        "final_rate_line_code": response["hits"]["hits"][0]["_source"]["rate_line_code"],
-                        "final_description": response["hits"]["hits"][0]["_source"]["final_description"]
-                    }
             return {"hit_e2e_simil_cache": False}
+
+        async_client = get_async_opensearch_client()
+        response = await async_client.search(index=IndexName.CLASSIFY_E2E_CACHE.value, body={
+            "query": {
+                "knn": {
+                    "rewritten_item_vector": {
+                        "vector": rewritten_item_vector,
+                        "k": 1
+                    }
+                }
+            }
+        })
+        if response["hits"]["total"]["value"] > 0:
+            score = response["hits"]["hits"][0]["_score"]
+            print(f"English similarity score:{score}")
+            if score > E2E_SIMIL_CACHE_THRESHOLD:
+                return {
+                    "hit_e2e_simil_cache": True,
+                    "final_rate_line_code": response["hits"]["hits"][0]["_source"]["rate_line_code"],
+                    "final_description": response["hits"]["hits"][0]["_source"]["final_description"]
+                }
+        return {"hit_e2e_simil_cache": False}
@@ -2,18 +2,24 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi import BackgroundTasks
 from datetime import datetime
 from collections import deque
+from typing import Iterable, Iterator
+import asyncio
+import json
 import logging
+import time
 import traceback
 
+from app.core.config import settings
 from app.core.exceptions import BackgroundTaskException
 from app.repo.hts_repo import select_current_version, delete_hts_by_version, save_update_record, \
-    select_rate_line_by_row_index, insert_rate_line, insert_rate_line_footnotes, insert_stat_suffix, \
-    insert_current_version, select_last_update_record, select_stat_suffix_by_row_index, disable_last_version, \
-    select_current_rate_lines_by_subheadings, select_rate_line_by_id, select_children_rate_lines_by_parent_id
-from app.repo.wco_hs_repo import select_subheading_by_code
+    insert_rate_lines, insert_rate_line_footnotes, insert_stat_suffixes, select_rate_line_id_block, \
+    insert_current_version, select_last_update_record, select_rate_line_ids_by_row_indexes, disable_last_version, \
+    update_record_checkpoint, \
+    select_rate_line_nodes_by_version, delete_rate_line_trees_by_version, insert_rate_line_trees, \
+    select_rate_line_trees_by_version
+from app.repo.wco_hs_repo import select_all_subheading_codes
 from app.db.session import AsyncSessionLocal
-from app.model.hts_model import HtsUpdateRecord, HtsRateLine, HtsRateLineFootnote, HtsStatSuffix, HtsVersionHistory
-from app.model.wco_hs_model import WcoHsSubheading
+from app.model.hts_model import HtsUpdateRecord, HtsVersionHistory
 from app.schema.hts import HtsRecord, HtsProcessResult, HtsInheritanceDequeElement, CheckUpdateResponse
 from app.util import hts_crawler_utils
 
@@ -71,19 +77,19 @@ async def get_current_version(session: AsyncSession):
 async def consume_last_update_task(record: HtsUpdateRecord):
     logger.info("Start resume update HTS data, release version: %s", record.update_version)
     data = await get_last_version_data(record.update_version)
-    logger.info("Get data from HTS successfully, data size: %s", len(data))
+    logger.info("Get data from HTS successfully")
 
     async with AsyncSessionLocal() as session:
         async with session.begin():
             record.update_status = "doing"
             record = await save_update_record(session, record)
-        result = await process_data(session, record.update_version, data, record.fail_row)
+        result = await process_data(session, record, data, record.fail_row or 0)
         async with session.begin():
             if result.success:
                 record.update_status = "success"
                 record.finish_at = datetime.now()
                 record.updated_at = datetime.now()
-                await process_after_update(session, record)
+                rate_line_trees = await process_after_update(session, record)
             else:
                 record.update_status = "fail"
                 record.fail_message = result.message
@@ -91,14 +97,17 @@ async def consume_last_update_task(record: HtsUpdateRecord):
                 record.can_continue = result.can_resume
                 record.finish_at = datetime.now() if not record.can_continue else None
                 record.updated_at = datetime.now()
-                await process_after_update(session, record)
+                rate_line_trees = await process_after_update(session, record)
+        # 事务提交之后再切换进程内缓存
+        if rate_line_trees is not None:
+            set_rate_line_trees_cache(record.update_version, rate_line_trees)
     logger.info("Finish resume update HTS data")
 
 
 async def start_new_update_task(current_release: str):
     logger.info("Start update HTS data, release version: %s", current_release)
     data = await get_last_version_data(current_release)
-    logger.info("Get data from HTS successfully, data size: %s", len(data))
+    logger.info("Get data from HTS successfully")
 
     async with AsyncSessionLocal() as session:
         async with session.begin():
@@ -107,50 +116,75 @@ async def start_new_update_task(current_release: str):
                                               HtsUpdateRecord(update_time=datetime.now(),
                                                               update_version=current_release,
                                                               update_status="doing"))
-        result = await process_data(session, current_release, data, 0)
+        result = await process_data(session, record, data, 0)
         async with session.begin():
             if result.success:
                 record.update_status = "success"
                 record.finish_at = datetime.now()
-                await process_after_update(session, record)
+                rate_line_trees = await process_after_update(session, record)
             else:
                 record.update_status = "fail"
                 record.fail_message = result.message
                 record.fail_row = result.failed_row
                 record.can_continue = result.can_resume
                 record.finish_at = datetime.now() if not record.can_continue else None
-                await process_after_update(session, record)
+                rate_line_trees = await process_after_update(session, record)
+        # 事务提交之后再切换进程内缓存
+        if rate_line_trees is not None:
+            set_rate_line_trees_cache(record.update_version, rate_line_trees)
     logger.info("Finish update HTS data")
 
 
-async def get_last_version_data(current_release_name) -> list[HtsRecord]:
+async def get_last_version_data(current_release_name) -> Iterator[HtsRecord]:
+    """
+    返回逐条读取导出文件的生成器，导入时按批次消费，内存占用不随导出文件大小增长
+    """
     return await hts_crawler_utils.read_data(current_release_name)
 
 
 async def process_data(session: AsyncSession,
-                       current_release: str,
-                       data: list[HtsRecord],
+                       record: HtsUpdateRecord,
+                       data: Iterable[HtsRecord],
                        start_row: int) -> HtsProcessResult:
+    """
+    批量导入HTS数据
+
+    父级关系通过缩进栈在内存中计算，税率线id从序列中按批次预先分配，每批数据多行插入并在同一个事务中
+    提交断点(record.fail_row记录下一批的起始行)，失败后从最后一个已提交批次之后继续
+    """
     logger.info("Start process data, start row: %s", start_row)
+    current_release = record.update_version
+    batch_size = settings.HTS_IMPORT_BATCH_SIZE
     inheritance_deque = deque()
-    wco_subheading_cache = dict()
-    current_process_row = start_row
+    checkpoint_row = start_row
+    batch = []
     try:
+        async with session.begin():
+            wco_subheading_codes = set(await select_all_subheading_codes(session))
         for index, datum in enumerate(data):
+            # 去除编码中的点(.)
+            if datum.htsno:
+                datum.htsno = datum.htsno.replace(".", "")
             if index < start_row:
+                # 断点之前的数据已经提交过了，只维护缩进栈，用于恢复父级关系
+                get_parent(inheritance_deque, datum, index)
                 continue
-            current_process_row = index
-            # 每行独立提交
-            await process_single_row(session, datum, index, inheritance_deque, wco_subheading_cache,
-                                     current_release, data)
-            if index + 1 % 1000 == 0:
+            if index == start_row and inheritance_deque:
+                await restore_inheritance_deque_ids(session, current_release, inheritance_deque)
+            batch.append((index, datum))
+            if len(batch) >= batch_size:
+                await process_batch(session, record, batch, inheritance_deque, wco_subheading_codes)
+                checkpoint_row = index + 1
+                batch = []
                 logger.info("Processed row: %s", index)
+        if batch:
+            await process_batch(session, record, batch, inheritance_deque, wco_subheading_codes)
     except Exception as e:
-        logger.exception("Process HTS failed, failed row: %s", current_process_row, exc_info=e)
+        logger.exception("Process HTS failed, checkpoint row: %s", checkpoint_row, exc_info=e)
         stack_trace = traceback.format_exc(2000)
         return HtsProcessResult(success=False,
                                 message=stack_trace[:2000] if len(stack_trace) > 2000 else stack_trace,
-                                failed_row=current_process_row,
+                                failed_row=checkpoint_row,
                                 can_resume=e.can_resume if isinstance(e, BackgroundTaskException) else True)
     else:
         logger.info("Process HTS successfully")
@@ -158,173 +192,135 @@ async def process_data(session: AsyncSession,
                                 message="success")
 
 
-async def process_single_row(session: AsyncSession,
-                             datum: HtsRecord,
-                             index: int,
-                             inheritance_deque: deque,
-                             wco_subheading_cache: dict,
-                             current_release: str,
-                             data: list):
+async def process_batch(session: AsyncSession,
+                        record: HtsUpdateRecord,
+                        batch: list[tuple[int, HtsRecord]],
+                        inheritance_deque: deque[HtsInheritanceDequeElement],
+                        wco_subheading_codes: set[str]):
+    """
+    处理一批数据，整批在一个事务中插入，并记录断点
+    """
+    current_release = record.update_version
+    rate_lines = []
+    footnotes = []
+    stat_suffixes = []
     async with session.begin():
-        # 去除编码中的点(.)
-        if datum.htsno:
-            datum.htsno = datum.htsno.replace(".", "")
-
-        # 获取父级
-        parent = await get_parent(session, inheritance_deque, index, data)
-
-        # 是否税率线(8位，存储了税率信息的记录)
-        is_rate_line = await check_is_rate_line(datum)
-        # 是否是统计后缀(10位，有些10位实际上是8为后面补零，其中也存储了税率信息)
-        is_stat_suffix = await check_is_stat_suffix(datum)
-        # 是否是单纯的10位统计后缀，如果是，则不需要插入rate_line表，只插入stat_suffix表
-        is_only_stat_suffix = await check_is_only_stat_suffix(datum)
-        rate_line = None
-        if not is_only_stat_suffix:
-            htsno = datum.htsno
-            if is_rate_line and is_stat_suffix:
-                htsno = datum.htsno[:-2]
-            wco_subheading_code = None
-            if is_rate_line:
-                wco_subheading = await get_wco_hs_subheading(session, datum, wco_subheading_cache)
-                wco_subheading_code = wco_subheading.subheading_code if wco_subheading else None
-
-            # 将当前行构建成持久化对象
-            rate_line = HtsRateLine(
-                rate_line_code=htsno,
-                rate_line_description=datum.description,
-                general_rate=datum.general,
-                special_rate=datum.special,
-                other=datum.other,
-                units=",".join(datum.units),
-                quota_quantity=datum.quotaQuantity,
-                additional_duties=datum.additionalDuties,
-                indent=datum.indent,
-                is_superior=datum.superior if datum.superior else False,
-                version=current_release,
-                parent_id=parent.id if parent else None,
-                wco_hs_subheading=wco_subheading_code,
-                is_rate_line=is_rate_line,
-                row_index=index
-            )
-
-            # 插入，拿到id
-            rate_line = await insert_rate_line(session, rate_line)
-            # 更新inheritance_deque最后添加的自己这个元素的id
-            inheritance_deque[-1].id = rate_line.id
-
-            # 如果有脚注则插入脚注信息
-            save_foot_notes = []
-            for foot_note in datum.footnotes if datum.footnotes else []:
-                save_foot_notes.append(
-                    HtsRateLineFootnote(
-                        rate_line_id=rate_line.id,
+        # 一次性从序列中分配这一批税率线需要的id
+        rate_line_ids = deque(await select_rate_line_id_block(
+            session, sum(1 for _, datum in batch if not check_is_only_stat_suffix(datum))))
+        for index, datum in batch:
+            # 获取父级
+            parent = get_parent(inheritance_deque, datum, index)
+
+            # 是否税率线(8位，存储了税率信息的记录)
+            is_rate_line = check_is_rate_line(datum)
+            # 是否是统计后缀(10位，有些10位实际上是8为后面补零，其中也存储了税率信息)
+            is_stat_suffix = check_is_stat_suffix(datum)
+            # 是否是单纯的10位统计后缀，如果是，则不需要插入rate_line表，只插入stat_suffix表
+            is_only_stat_suffix = check_is_only_stat_suffix(datum)
+            rate_line_id = None
+            if not is_only_stat_suffix:
+                htsno = datum.htsno
+                if is_rate_line and is_stat_suffix:
+                    htsno = datum.htsno[:-2]
+                wco_subheading_code = get_wco_hs_subheading(datum, wco_subheading_codes) if is_rate_line else None
+                rate_line_id = rate_line_ids.popleft()
+                # 更新inheritance_deque最后添加的自己这个元素的id
+                inheritance_deque[-1].id = rate_line_id
+                rate_lines.append(dict(
+                    id=rate_line_id,
+                    rate_line_code=htsno,
+                    rate_line_description=datum.description,
+                    general_rate=datum.general,
+                    special_rate=datum.special,
+                    other=datum.other,
+                    units=",".join(datum.units) if datum.units else "",
+                    quota_quantity=datum.quotaQuantity,
+                    additional_duties=datum.additionalDuties,
+                    indent=datum.indent,
+                    is_superior=datum.superior if datum.superior else False,
+                    version=current_release,
+                    # 父级是单纯的统计后缀时不在rate_line表中，不能作为外键
+                    parent_id=parent.id if parent and parent.type == 0 else None,
+                    wco_hs_subheading=wco_subheading_code,
+                    is_rate_line=is_rate_line,
+                    row_index=index
+                ))
+                # 如果有脚注则插入脚注信息
+                for foot_note in datum.footnotes if datum.footnotes else []:
+                    footnotes.append(dict(
+                        rate_line_id=rate_line_id,
                         related_column=",".join(foot_note.columns),
                         note_type=foot_note.type,
                         note_value=foot_note.value,
                         marker=foot_note.marker,
                         row_index=index,
                         version=current_release,
-                    )
-                )
-            if save_foot_notes:
-                await insert_rate_line_footnotes(session, save_foot_notes)
-
-        # 如果这条记录是统计后缀，则插入后缀表
-        if is_stat_suffix:
-            rate_line_id = await get_stat_suffix_parent_rate_line_id(datum, rate_line, inheritance_deque)
-            # 如果父类还是10位的，那么parent就是stat_suffix表的数据，则rate_parent_id就不能使用parent.id，设置为空，否则外键约束失败
-            if not parent:
-                rate_parent_id = None
-            elif await check_is_only_stat_suffix(
-                    HtsRecord(htsno=parent.code, indent=parent.indent, description=parent.description,
-                              general=parent.general, special=parent.special, other=parent.other, units=[])):
-                rate_parent_id = None
-            else:
-                rate_parent_id = parent.id
-            stat_suffix = HtsStatSuffix(
-                stat_code=datum.htsno,
-                stat_description=datum.description,
-                indent=datum.indent,
-                is_superior=datum.superior if datum.superior else False,
-                rate_line_id=rate_line_id,
-                rate_parent_id=rate_parent_id,
-                row_index=index,
-                version=current_release,
-            )
-            await insert_stat_suffix(session, stat_suffix)
-
-
-async def get_parent(session: AsyncSession,
-                     inheritance_deque: deque[HtsInheritanceDequeElement],
-                     current_index: int,
-                     data: list[HtsRecord]) -> HtsInheritanceDequeElement | None:
-    current_record = data[current_index]
-    # 从deque中寻找父级
+                    ))
+
+            # 如果这条记录是统计后缀，则插入后缀表
+            if is_stat_suffix:
+                # 如果父类还是10位的，那么parent就是stat_suffix表的数据，则rate_parent_id就不能使用parent.id，设置为空，否则外键约束失败
+                rate_parent_id = parent.id if parent and parent.type == 0 else None
+                stat_suffixes.append(dict(
+                    stat_code=datum.htsno,
+                    stat_description=datum.description,
+                    indent=datum.indent,
+                    is_superior=datum.superior if datum.superior else False,
+                    rate_line_id=rate_line_id if is_rate_line else get_stat_suffix_parent_rate_line_id(
+                        inheritance_deque),
+                    rate_parent_id=rate_parent_id,
+                    row_index=index,
+                    version=current_release,
+                ))
+
+        await insert_rate_lines(session, rate_lines)
+        await insert_rate_line_footnotes(session, footnotes)
+        await insert_stat_suffixes(session, stat_suffixes)
+        # 断点: 这一批之后的第一行
+        await update_record_checkpoint(session, record.id, batch[-1][0] + 1)
+
+
+def get_parent(inheritance_deque: deque[HtsInheritanceDequeElement],
+               current_record: HtsRecord,
+               current_index: int) -> HtsInheritanceDequeElement | None:
+    """
+    从缩进栈中找到父级，并将当前记录压入栈中
+    """
     parent = inheritance_deque[-1] if inheritance_deque else None
     while parent and parent.indent >= current_record.indent:
         inheritance_deque.pop()
         parent = inheritance_deque[-1] if inheritance_deque else None
-    # 如果找到了，将当前添加到继承中，然后返回parent
-    if not parent:
-        # 非最高级别，但是没有发信parent，说明是断点重试，则需要从数据库中构建继承关系(因为需要父级id,所以要重新从数据库构建)
-        if current_record.indent != 0:
-            search_index = current_index - 1
-            current_search_record = data[search_index]
-            deque_first_element_indent = current_record.indent
-            while search_index >= 0:
-                if current_search_record.indent < deque_first_element_indent:
-                    # 存在10位的父级还是10位的情况，这时候应该查找stat_suffix表寻找父级，否则找不到，rate_line表不存在stat suffix数据
-                    element = None
-                    if await check_is_only_stat_suffix(current_search_record):
-                        stat_suffix = await select_stat_suffix_by_row_index(session, search_index)
-                        if stat_suffix:
-                            element = HtsInheritanceDequeElement(code=stat_suffix.stat_code,
-                                                                 description=stat_suffix.stat_description,
-                                                                 indent=stat_suffix.indent,
-                                                                 is_superior=stat_suffix.is_superior,
-                                                                 id=stat_suffix.id,
-                                                                 type=1,
-                                                                 general=None,
-                                                                 special=None,
-                                                                 other=None)
-                    else:
-                        rate_line = await select_rate_line_by_row_index(session, search_index)
-                        if rate_line:
-                            element = HtsInheritanceDequeElement(code=rate_line.rate_line_code,
-                                                                 description=rate_line.rate_line_description,
-                                                                 indent=rate_line.indent,
-                                                                 is_superior=rate_line.is_superior,
-                                                                 id=rate_line.id,
-                                                                 type=0,
-                                                                 general=rate_line.general_rate,
-                                                                 special=rate_line.special_rate,
-                                                                 other=rate_line.other)
-                    if element:
-                        inheritance_deque.appendleft(element)
-                        deque_first_element_indent = current_search_record.indent
-                    else:
-                        raise BackgroundTaskException(can_resume=False, message="断点重试未获取到父级信息")
-                # 到达最高级直接退出
-                if current_search_record.indent == 0:
-                    break
-                search_index -= 1
-                current_search_record = data[search_index]
-            parent = inheritance_deque[-1] if inheritance_deque else None
     # 将当前元素添加到继承的末尾
     inheritance_deque.append(HtsInheritanceDequeElement(code=current_record.htsno,
                                                         description=current_record.description,
                                                         indent=current_record.indent,
                                                         is_superior=current_record.superior,
-                                                        type=1 if await check_is_only_stat_suffix(
-                                                            current_record) else 0,
+                                                        type=1 if check_is_only_stat_suffix(current_record) else 0,
                                                         general=current_record.general,
                                                         special=current_record.special,
-                                                        other=current_record.other))
+                                                        other=current_record.other,
+                                                        row_index=current_index))
     return parent
 
 
-async def check_is_rate_line(current_record: HtsRecord) -> bool:
+async def restore_inheritance_deque_ids(session: AsyncSession,
+                                        current_release: str,
+                                        inheritance_deque: deque[HtsInheritanceDequeElement]):
+    """
+    断点续传时，缩进栈是通过跳过的数据重建的，需要从数据库中补充栈中税率线的id
+    """
+    async with session.begin():
+        id_dict = await select_rate_line_ids_by_row_indexes(
+            session, current_release, [element.row_index for element in inheritance_deque if element.type == 0])
+    for element in inheritance_deque:
+        if element.type == 0:
+            if element.row_index not in id_dict:
+                raise BackgroundTaskException(can_resume=False, message="断点重试未获取到父级信息")
+            element.id = id_dict[element.row_index]
+
+
+def check_is_rate_line(current_record: HtsRecord) -> bool:
     if current_record.htsno and len(current_record.htsno) == 8:
         return True
     # 存在结尾不是00的，但是是10位的税率线数据
@@ -334,39 +330,31 @@ async def check_is_rate_line(current_record: HtsRecord) -> bool:
     return False
 
 
-async def check_is_stat_suffix(current_record: HtsRecord) -> bool:
+def check_is_stat_suffix(current_record: HtsRecord) -> bool:
     if current_record.htsno and len(current_record.htsno) == 10:
         return True
     return False
 
 
-async def check_is_only_stat_suffix(current_record: HtsRecord) -> bool:
+def check_is_only_stat_suffix(current_record: HtsRecord) -> bool:
     if current_record.htsno and len(current_record.htsno) == 10 and not (
             current_record.general or current_record.special or current_record.other):
         return True
     return False
 
 
-async def get_wco_hs_subheading(session: AsyncSession,
-                                current_record: HtsRecord,
-                                wco_heading_cache: dict[str, WcoHsSubheading]) -> WcoHsSubheading | None:
+def get_wco_hs_subheading(current_record: HtsRecord, wco_subheading_codes: set[str]) -> str | None:
     htsno = current_record.htsno
-    if await check_is_stat_suffix(current_record):
+    if check_is_stat_suffix(current_record):
         htsno = htsno[:-2]
-    if await check_is_rate_line(current_record):
+    if check_is_rate_line(current_record):
         htsno = htsno[:-2]
         # 检查一下是不是存在哦
-        if htsno not in wco_heading_cache:
-            wco_heading_cache[htsno] = await select_subheading_by_code(session, htsno)
-        return wco_heading_cache[htsno]
+        return htsno if htsno in wco_subheading_codes else None
     return None
 
 
-async def get_stat_suffix_parent_rate_line_id(current_record: HtsRecord,
-                                              current_rate_line: HtsRateLine,
-                                              inheritance_deque: deque) -> int | None:
-    if await check_is_rate_line(current_record):
-        return current_rate_line.id
+def get_stat_suffix_parent_rate_line_id(inheritance_deque: deque) -> int | None:
     # 倒序向上找父级
     for index, element in enumerate(reversed(inheritance_deque)):
         # 最后一个是当前元素
@@ -378,84 +366,148 @@ async def get_stat_suffix_parent_rate_line_id(current_record: HtsRecord,
     return None
 
 
-async def process_after_update(session: AsyncSession, record: HtsUpdateRecord):
+async def process_after_update(session: AsyncSession, record: HtsUpdateRecord) -> dict[str, str] | None:
+    """
+    返回新版本的税率线树，调用方在事务提交之后再更新进程内缓存
+    """
     await save_update_record(session, record)
     if record.update_status == "success":
         await disable_last_version(session)
         await insert_current_version(session, HtsVersionHistory(version=record.update_version, is_current_used=True,
                                                                 enabled_time=datetime.now()))
+        # 预先构建每个WCO子目的税率线树，和版本切换在同一个事务中提交
+        await delete_rate_line_trees_by_version(session, record.update_version)
+        rate_line_trees = await build_rate_line_trees(session, record.update_version)
+        await save_rate_line_trees(session, record.update_version, rate_line_trees)
+        return rate_line_trees
+    return None
 
 
-async def get_rate_lines_by_wco_subheadings(subheadings: list[str]):
-    subheading_detail_dict = dict()
-    parent_cache = dict()
-    top_level_group_id_set = set()
-    async with (AsyncSessionLocal() as session):
-        current_version_record = await select_current_version(session)
-        if not current_version_record:
-            raise Exception("HTS数据未初始化，请初始化后重试")
-        current_version = current_version_record.version
-        rate_lines = await select_current_rate_lines_by_subheadings(session, current_version, subheadings)
-        for rate_line in rate_lines:
-            # 准备好此RateLine对应的subheading插槽
-            subheading_code = rate_line.wco_hs_subheading
-            if subheading_code not in subheading_detail_dict:
-                subheading_detail_dict.update({subheading_code: []})
-            subheading_detail = subheading_detail_dict.get(subheading_code)
-
-            # 获取上级
-            parent_id = rate_line.parent_id
-            # 如果上级为空，则直接将当前RateLine添加到插槽中
-            if not parent_id:
-                subheading_detail.append({
-                    "rate_line_code": rate_line.rate_line_code,
-                    "rate_line_description": rate_line.rate_line_description
-                })
-            else:
-                # 如果有上级，获取上级，查看上级是否是说明信息
-                while parent_id:
-                    if parent_id not in parent_cache:
-                        parent = await select_rate_line_by_id(session, parent_id)
-                        logger.info(f"parent_id: {parent_id},  parent's parent_id: {parent.parent_id}")
-                        parent_cache.update({parent_id: parent})
-                    else:
-                        parent = parent_cache.get(parent_id)
-                    if not parent.is_superior:
-                        break
-                    parent_id = parent.parent_id
-
-                # 从最上层parent_id构建整个树，然后添加到插槽中
-                if parent_id in top_level_group_id_set:
-                    # 按最上层的来看，已经存在了就直接跳过，不重复添加到插槽中
-                    continue
-                else:
-                    subheading_detail.append(await construct_rate_line_tree(session, parent_id))
-                    top_level_group_id_set.add(parent_id)
-
-    return subheading_detail_dict
-
-
-async def construct_rate_line_tree(session: AsyncSession, parent_id: int):
+__rate_line_trees_cache: tuple[str, dict[str, str]] | None = None
+__rate_line_trees_checked_at: float = 0.0
+__rate_line_trees_lock: asyncio.Lock | None = None
+
+
+def _get_rate_line_trees_lock() -> asyncio.Lock:
+    global __rate_line_trees_lock
+    if __rate_line_trees_lock is None:
+        __rate_line_trees_lock = asyncio.Lock()
+    return __rate_line_trees_lock
+
+
+def set_rate_line_trees_cache(version: str, rate_line_trees: dict[str, str]):
+    global __rate_line_trees_cache, __rate_line_trees_checked_at
+    __rate_line_trees_cache = (version, rate_line_trees)
+    __rate_line_trees_checked_at = time.monotonic()
+
+
+async def build_rate_line_trees(session: AsyncSession, version: str) -> dict[str, str]:
     """
-    递归构建 RateLine 树结构
+    一次查询出整个版本的税率线，在内存中构建每个WCO子目对应的税率线树
+
+    :return: {subheading_code: 税率线树json}
     """
-    rate_line = await select_rate_line_by_id(session, parent_id)
-    # 节点结构
-    node = {rate_line.rate_line_description: []}
-
-    # 获取所有子节点
-    children = await select_children_rate_lines_by_parent_id(session, parent_id)
-    slot = node[rate_line.rate_line_description]
-
-    for child in (children if children else []):
-        if child.is_superior:
-            # 分组节点，递归构建
-            slot.append(await construct_rate_line_tree(session, child.id))
-        else:
-            # 叶子节点，直接添加
-            slot.append({
-                "rate_line_code": child.rate_line_code,
-                "rate_line_description": child.rate_line_description
+    rate_lines = await select_rate_line_nodes_by_version(session, version)
+    rate_line_dict = {rate_line.id: rate_line for rate_line in rate_lines}
+    children_dict = dict()
+    for rate_line in rate_lines:
+        if rate_line.parent_id:
+            children_dict.setdefault(rate_line.parent_id, []).append(rate_line)
+    node_cache = dict()
+
+    def construct_rate_line_tree(node_id: int):
+        """
+        构建 RateLine 树结构，同一个上级节点被多个子目引用时只构建一次
+        """
+        if node_id in node_cache:
+            return node_cache[node_id]
+        node_rate_line = rate_line_dict[node_id]
+        slot = []
+        for child in children_dict.get(node_id, []):
+            if child.is_superior:
+                # 分组节点，递归构建
+                slot.append(construct_rate_line_tree(child.id))
+            else:
+                # 叶子节点，直接添加
+                slot.append({
+                    "rate_line_code": child.rate_line_code,
+                    "rate_line_description": child.rate_line_description
+                })
+        node = {node_rate_line.rate_line_description: slot}
+        node_cache[node_id] = node
+        return node
+
+    subheading_detail_dict = dict()
+    top_level_group_ids = dict()
+    for rate_line in rate_lines:
+        subheading_code = rate_line.wco_hs_subheading
+        if not subheading_code:
+            continue
+        # 准备好此RateLine对应的subheading插槽
+        subheading_detail = subheading_detail_dict.setdefault(subheading_code, [])
+        top_level_group_id_set = top_level_group_ids.setdefault(subheading_code, set())
+        # 向上查找，直到上级不是说明信息为止
+        parent_id = rate_line.parent_id
+        while parent_id and parent_id in rate_line_dict:
+            parent = rate_line_dict[parent_id]
+            if not parent.is_superior:
+                break
+            parent_id = parent.parent_id
+        # 没有上级，直接将当前RateLine添加到插槽中
+        if not parent_id or parent_id not in rate_line_dict:
+            subheading_detail.append({
+                "rate_line_code": rate_line.rate_line_code,
+                "rate_line_description": rate_line.rate_line_description
             })
+        # 从最上层parent_id构建整个树，已经存在了就直接跳过，不重复添加到插槽中
+        elif parent_id not in top_level_group_id_set:
+            subheading_detail.append(construct_rate_line_tree(parent_id))
+            top_level_group_id_set.add(parent_id)
+
+    logger.info("Built rate line trees of version %s, subheading size: %s", version, len(subheading_detail_dict))
+    return {subheading_code: json.dumps(subheading_detail, ensure_ascii=False)
+            for subheading_code, subheading_detail in subheading_detail_dict.items()}
+
 
-    return node
\ No newline at end of file
+async def save_rate_line_trees(session: AsyncSession, version: str, rate_line_trees: dict[str, str]):
+    await insert_rate_line_trees(session, [{"wco_hs_subheading": subheading_code,
+                                            "rate_line_tree": rate_line_tree,
+                                            "version": version}
+                                           for subheading_code, rate_line_tree in rate_line_trees.items()])
+
+
+async def get_current_rate_line_trees() -> dict[str, str]:
+    """
+    获取当前版本所有子目的税率线树，进程内缓存，超过检查间隔才会查询一次当前版本
+    """
+    cache = __rate_line_trees_cache
+    if cache and time.monotonic() - __rate_line_trees_checked_at < settings.HTS_RATE_LINE_TREE_VERSION_CHECK_SECONDS:
+        return cache[1]
+    async with _get_rate_line_trees_lock():
+        cache = __rate_line_trees_cache
+        if cache and time.monotonic() - __rate_line_trees_checked_at < \
+                settings.HTS_RATE_LINE_TREE_VERSION_CHECK_SECONDS:
+            return cache[1]
+        async with AsyncSessionLocal() as session:
+            current_version_record = await select_current_version(session)
+            if not current_version_record:
+                raise Exception("HTS数据未初始化，请初始化后重试")
+            current_version = current_version_record.version
+            if cache and cache[0] == current_version:
+                rate_line_trees = cache[1]
+            else:
+                rate_line_trees = {row.wco_hs_subheading: row.rate_line_tree
+                                   for row in await select_rate_line_trees_by_version(session, current_version)}
+                if not rate_line_trees:
+                    # 历史版本导入时还没有预先构建，这里补充构建一次
+                    rate_line_trees = await build_rate_line_trees(session, current_version)
+                    await save_rate_line_trees(session, current_version, rate_line_trees)
+                    await session.commit()
+        set_rate_line_trees_cache(current_version, rate_line_trees)
+        return rate_line_trees
+
+
+async def get_rate_lines_by_wco_subheadings(subheadings: list[str]):
+    rate_line_trees = await get_current_rate_line_trees()
+    return {subheading_code: json.loads(rate_line_trees[subheading_code])
+            for subheading_code in subheadings if subheading_code in rate_line_trees}
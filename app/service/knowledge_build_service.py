@@ -0,0 +1,210 @@
+"""
+向量知识库(chapter、heading)的后台构建
+
+每个collection在knowledge_build_manifest中记录构建逻辑版本、WCO HS数据版本及源数据内容哈希:
+    1. 启动时只比较版本号(两次查询，不读取源数据)，一致时直接加载collection
+    2. 不一致时在后台构建: 计算源数据内容哈希，与清单不一致的collection逐条比较已有记录，删除源数据中已经删除的编码，
+       重新写入内容变化或构建逻辑版本不一致的编码，全部完成后才在清单中记录新的版本及哈希并标记为ready
+    3. 多个进程(worker、pod)同时启动时通过PostgreSQL advisory lock只由一个进程构建，其他进程等待锁释放后
+       重新检查清单，构建已经完成时直接加载collection
+    4. collection曾经构建成功过时，构建期间使用已有的数据提供服务；从未构建成功时，构建完成前/ready返回未就绪
+"""
+import asyncio
+import logging
+from datetime import datetime
+from typing import Awaitable, Callable
+
+from pymilvus import AsyncMilvusClient
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.core.constants import MilvusCollectionName
+from app.core.db import async_engine
+from app.core.milvus import get_async_milvus_client, load_knowledge_collection
+from app.db.session import AsyncSessionLocal
+from app.init.embeddings_init import build_chapter_knowledge_collection, build_heading_knowledge_collection
+from app.init.knowledge_pipeline import KNOWLEDGE_BUILD_VERSION
+from app.model.knowledge_build_model import KnowledgeBuildManifest
+from app.repo.knowledge_build_repo import select_manifests, save_manifest, try_advisory_lock, advisory_unlock
+from app.service.wco_hs_service import get_current_version, get_current_version_chapters, \
+    get_current_version_headings
+from app.util.hash_utils import sha256_hash
+
+logger = logging.getLogger(__name__)
+
+BUILD_STATUS_BUILDING = "building"
+BUILD_STATUS_READY = "ready"
+BUILD_STATUS_FAILED = "failed"
+
+# 构建锁的键，所有进程相同
+KNOWLEDGE_BUILD_LOCK_KEY = 7310520011
+
+# heading的知识依赖chapter的知识，按顺序构建
+KNOWLEDGE_COLLECTIONS = (MilvusCollectionName.KNOWLEDGE_CHAPTER, MilvusCollectionName.KNOWLEDGE_HEADING)
+
+
+def is_manifest_current(manifest: KnowledgeBuildManifest | None, source_version: str | None) -> bool:
+    return (manifest is not None and manifest.status == BUILD_STATUS_READY
+            and manifest.build_version == KNOWLEDGE_BUILD_VERSION and manifest.source_version == source_version)
+
+
+class KnowledgeBuildService:
+
+    def __init__(self):
+        self.ready = False
+        self.building = False
+        self.last_error: str | None = None
+
+    async def check_manifests(self) -> tuple[bool, bool]:
+        """
+        返回(清单是否与当前版本一致, 是否每个collection都曾经构建成功)
+        """
+        async with AsyncSessionLocal() as session:
+            source_version = await get_current_version(session)
+            manifests = await select_manifests(session)
+        current = source_version is not None and all(
+            is_manifest_current(manifests.get(collection.value), source_version) for collection in KNOWLEDGE_COLLECTIONS)
+        usable = all(manifests.get(collection.value) is not None and manifests[collection.value].built_at is not None
+                     for collection in KNOWLEDGE_COLLECTIONS)
+        return current, usable
+
+    @staticmethod
+    async def load_collections():
+        client = get_async_milvus_client()
+        for collection in KNOWLEDGE_COLLECTIONS:
+            await load_knowledge_collection(client, collection)
+
+    @staticmethod
+    async def update_manifest(collection: MilvusCollectionName, **values):
+        async with AsyncSessionLocal() as session:
+            async with session.begin():
+                await save_manifest(session, collection.value, **values)
+
+    async def build_collection(self, collection: MilvusCollectionName, manifest: KnowledgeBuildManifest | None,
+                               source_version: str, content_hash: str, item_count: int,
+                               build: Callable[[AsyncSession, AsyncMilvusClient], Awaitable[None]]):
+        if is_manifest_current(manifest, source_version) and manifest.content_hash == content_hash:
+            logger.info("Knowledge collection %s is up to date", collection.value)
+            return
+        logger.info("Start build knowledge collection %s, source version: %s", collection.value, source_version)
+        # 版本及哈希在构建完成后才更新，构建中断时清单仍然记录已有数据对应的版本
+        await self.update_manifest(collection, status=BUILD_STATUS_BUILDING, error_message=None)
+        client = get_async_milvus_client()
+        await load_knowledge_collection(client, collection)
+        try:
+            async with AsyncSessionLocal() as session:
+                await build(session, client)
+        except Exception as e:
+            await self.update_manifest(collection, status=BUILD_STATUS_FAILED, error_message=str(e)[:2000])
+            raise
+        await self.update_manifest(collection, status=BUILD_STATUS_READY, build_version=KNOWLEDGE_BUILD_VERSION,
+                                   source_version=source_version, content_hash=content_hash, item_count=item_count,
+                                   built_at=datetime.now())
+        logger.info("Finish build knowledge collection %s", collection.value)
+
+    async def build(self):
+        """
+        源数据及构建逻辑版本没有变化的collection不重新构建；构建本身是增量的，与当前条目一致的记录保留，
+        只有变化的编码重新调用LLM
+        """
+        async with AsyncSessionLocal() as session:
+            source_version = await get_current_version(session)
+            chapters = await get_current_version_chapters(session)
+            headings = await get_current_version_headings(session)
+            manifests = await select_manifests(session)
+        chapter_hash = sha256_hash("\n".join(sorted(f"{chapter.chapter_code}\t{chapter.chapter_title}"
+                                                    for chapter in chapters)))
+        # heading的知识中包含chapter的描述，chapter变化时heading也需要重新构建
+        heading_hash = sha256_hash("\n".join([chapter_hash, *sorted(f"{heading.heading_code}\t{heading.heading_title}"
+                                                                    for heading in headings)]))
+        await self.build_collection(MilvusCollectionName.KNOWLEDGE_CHAPTER,
+                                    manifests.get(MilvusCollectionName.KNOWLEDGE_CHAPTER.value),
+                                    source_version, chapter_hash, len(chapters), build_chapter_knowledge_collection)
+        await self.build_collection(MilvusCollectionName.KNOWLEDGE_HEADING,
+                                    manifests.get(MilvusCollectionName.KNOWLEDGE_HEADING.value),
+                                    source_version, heading_hash, len(headings), build_heading_knowledge_collection)
+
+    async def build_exclusively(self) -> bool:
+        """
+        持有构建锁时构建，返回是否获取到锁；锁使用单独的连接，构建期间一直持有
+        """
+        async with async_engine.connect() as connection:
+            if not await try_advisory_lock(connection, KNOWLEDGE_BUILD_LOCK_KEY):
+                return False
+            try:
+                await self.build()
+            finally:
+                try:
+                    await advisory_unlock(connection, KNOWLEDGE_BUILD_LOCK_KEY)
+                except BaseException:
+                    # 释放失败时关闭连接，避免持有锁的连接回到连接池
+                    await connection.invalidate()
+                    raise
+        return True
+
+    async def run(self):
+        """
+        构建失败时间隔一段时间重试，直到构建成功；其他进程正在构建时等待其完成，之后的构建检查清单后直接跳过
+        """
+        self.building = True
+        try:
+            while True:
+                try:
+                    if await self.build_exclusively():
+                        await self.load_collections()
+                        self.ready = True
+                        self.last_error = None
+                        return
+                    logger.info("Knowledge collections are being built by another process, wait")
+                    delay = settings.KNOWLEDGE_BUILD_LOCK_WAIT_SECONDS
+                except Exception as e:
+                    logger.exception("Build knowledge collections failed")
+                    self.last_error = str(e)
+                    delay = settings.KNOWLEDGE_BUILD_RETRY_SECONDS
+                await asyncio.sleep(delay)
+        finally:
+            self.building = False
+
+    def snapshot(self) -> dict:
+        return {"ready": self.ready, "building": self.building, "build_version": KNOWLEDGE_BUILD_VERSION,
+                "last_error": self.last_error}
+
+
+default_knowledge_build_service = KnowledgeBuildService()
+
+__knowledge_build_task: asyncio.Task | None = None
+
+
+def is_knowledge_ready() -> bool:
+    return default_knowledge_build_service.ready
+
+
+async def start_knowledge_build():
+    """
+    启动时检查构建清单，需要构建时在后台执行，不阻塞服务启动
+    """
+    global __knowledge_build_task
+    service = default_knowledge_build_service
+    current, usable = await service.check_manifests()
+    if current or usable:
+        await service.load_collections()
+        service.ready = True
+    if current:
+        return
+    if not settings.KNOWLEDGE_BUILD_ON_STARTUP:
+        # 从未构建成功时collection为空，保持未就绪
+        logger.warning("Knowledge collections are outdated and KNOWLEDGE_BUILD_ON_STARTUP is disabled")
+        return
+    if __knowledge_build_task is None or __knowledge_build_task.done():
+        __knowledge_build_task = asyncio.create_task(service.run())
+
+
+async def stop_knowledge_build():
+    global __knowledge_build_task
+    if __knowledge_build_task is not None:
+        __knowledge_build_task.cancel()
+        try:
+            await __knowledge_build_task
+        except asyncio.CancelledError:
+            pass
+    __knowledge_build_task = None
@@ -0,0 +1,140 @@
+"""
+LLM响应缓存
+
+相同的模型、相同的提示词模板、渲染后完全相同的消息，直接返回之前的响应，重复的商品及评估重跑不再调用LLM。
+进程内LRU -> redis两级缓存，只有响应能被正确解析时才会缓存
+"""
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Callable, TypeVar
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage, message_chunk_to_message
+
+from app.core.config import settings
+from app.core.constants import RedisKeyPrefix
+from app.core.metrics import get_value_recorder
+from app.core.redis import get_async_redis
+from app.util.hash_utils import md5_hash
+from app.util.token_utils import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+def get_model_name(llm: BaseChatModel) -> str:
+    return getattr(llm, "model_name", None) or getattr(llm, "model", None) or type(llm).__name__
+
+
+class LlmResponseCacheService:
+
+    def __init__(self, local_max_entries: int, ttl_seconds: int):
+        self.local_max_entries = local_max_entries
+        self.ttl_seconds = ttl_seconds
+        # key -> (过期时间, 响应内容)
+        self.local_cache: OrderedDict[str, tuple[float, str]] = OrderedDict()
+
+    @staticmethod
+    def cache_key(llm: BaseChatModel, template_name: str, template: str, messages: list[BaseMessage]) -> str:
+        """
+        llm_response:{模型}:{模板名称}:{模板内容md5}:{消息md5}，修改模板后自动使用新的key
+        """
+        messages_json = json.dumps([[message.type, message.content] for message in messages], ensure_ascii=False)
+        return ":".join([RedisKeyPrefix.LLM_RESPONSE.value, get_model_name(llm), template_name,
+                         md5_hash(template)[:8], md5_hash(messages_json)])
+
+    def get_local(self, key: str) -> str | None:
+        entry = self.local_cache.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del self.local_cache[key]
+            return None
+        self.local_cache.move_to_end(key)
+        return entry[1]
+
+    def put_local(self, key: str, content: str):
+        if self.local_max_entries <= 0:
+            return
+        self.local_cache[key] = (time.monotonic() + self.ttl_seconds, content)
+        self.local_cache.move_to_end(key)
+        while len(self.local_cache) > self.local_max_entries:
+            self.local_cache.popitem(last=False)
+
+    async def get(self, key: str) -> str | None:
+        content = self.get_local(key)
+        if content is not None:
+            return content
+        async_redis = await get_async_redis()
+        data = await async_redis.get(key)
+        if data is None:
+            return None
+        content = data.decode() if isinstance(data, bytes) else data
+        self.put_local(key, content)
+        return content
+
+    async def set(self, key: str, content: str):
+        self.put_local(key, content)
+        async_redis = await get_async_redis()
+        await async_redis.set(key, content, ex=self.ttl_seconds)
+
+    @staticmethod
+    async def call_llm(llm: BaseChatModel, messages: list[BaseMessage],
+                       on_chunk: Callable[..., None] | None) -> BaseMessage:
+        """
+        on_chunk不为空时流式调用，每收到一个片段回调一次累积的内容，结束时以final=True再回调一次
+        """
+        if on_chunk is None:
+            return await llm.ainvoke(input=messages)
+        output = None
+        async for chunk in llm.astream(input=messages):
+            output = chunk if output is None else output + chunk
+            on_chunk(output.content)
+        if output is None:
+            return await llm.ainvoke(input=messages)
+        on_chunk(output.content, final=True)
+        return message_chunk_to_message(output)
+
+    async def ainvoke(self, llm: BaseChatModel, template_name: str, template: str, messages: list[BaseMessage],
+                      parse: Callable[[str], T], on_chunk: Callable[..., None] | None = None) -> tuple[BaseMessage, T]:
+        """
+        优先从缓存获取响应，未命中时调用LLM，解析成功后写入缓存
+
+        缓存读写失败不影响LLM调用；on_chunk用于推送LLM的增量输出，命中缓存时以完整内容回调一次
+        """
+        get_value_recorder(f"prompt_tokens.{template_name}").observe(
+            sum(estimate_tokens(str(message.content)) for message in messages))
+        if not settings.LLM_RESPONSE_CACHE_ENABLED:
+            output = await self.call_llm(llm, messages, on_chunk)
+            return output, parse(output.content)
+        key = self.cache_key(llm, template_name, template, messages)
+        try:
+            content = await self.get(key)
+        except Exception as e:
+            logger.warning("Get llm response cache failed: %s", e)
+            content = None
+        if content is not None:
+            try:
+                response = parse(content)
+                if on_chunk is not None:
+                    on_chunk(content, final=True)
+                return AIMessage(content=content, response_metadata={"cache_hit": True}), response
+            except Exception as e:
+                # 解析逻辑变化后旧的缓存可能无法解析，重新调用LLM
+                logger.warning("Cached llm response can not be parsed: %s", e)
+
+        output = await self.call_llm(llm, messages, on_chunk)
+        response = parse(output.content)
+        try:
+            await self.set(key, output.content)
+        except Exception as e:
+            logger.warning("Save llm response cache failed: %s", e)
+        return output, response
+
+
+default_llm_response_cache_service = LlmResponseCacheService(
+    local_max_entries=settings.LLM_RESPONSE_CACHE_LOCAL_MAX_ENTRIES,
+    ttl_seconds=settings.LLM_RESPONSE_CACHE_TTL_SECONDS)
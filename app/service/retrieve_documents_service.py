@@ -1,14 +1,18 @@
+import asyncio
 import json
 
 from datetime import datetime, timezone
 from pymilvus import AsyncMilvusClient, RRFRanker, AnnSearchRequest, WeightedRanker
 
+from app.core.config import settings
 from app.core.opensearch import get_async_opensearch_client
 from app.core.constants import IndexName, MilvusCollectionName
 from app.llm.embedding import default_embeddings_service
 from app.service.wco_hs_service import  get_subheading_detail_by_heading_codes, \
     get_subheading_dict_by_subheading_codes
 from app.service.hts_service import get_rate_lines_by_wco_subheadings
+from app.service.document_builder_service import build_heading_documents, build_subheading_documents, \
+    build_rate_line_documents
 
 
 class RetrieveDocumentsService:
@@ -16,14 +20,50 @@ class RetrieveDocumentsService:
     def __init__(self, async_milvus_client: AsyncMilvusClient):
         self.async_milvus_client = async_milvus_client
 
-    async def retrieve_heading_documents(self, rewritten_item: dict):
+    async def retrieve_heading_documents(self, rewritten_item: dict, early_chapter_codes: list[str] | None = None):
         """
         直接获取组合后的heading层信息，不先获取chapter层了
+
+        early_chapter_codes是改写期间使用原始商品信息提前检索到的chapter(按相关度排序)，
+        按配置与改写后的检索结果合并，或者直接复用
+        """
+        heading_scores = {}
+        if early_chapter_codes and settings.EARLY_RETRIEVAL_MODE == "reuse":
+            chapter_scores = {}
+        else:
+            # 增加根据语义相似度获取到的heading信息
+            query_text = json.dumps(rewritten_item, ensure_ascii=False)
+            query_vector = await default_embeddings_service.get_rewritten_item_embeddings(rewritten_item)
+            chapter_scores, heading_scores = await self.search_simil_codes(query_text, query_vector)
+        # 提前检索到的chapter排在改写后检索到的chapter之后
+        for index, chapter_code in enumerate(early_chapter_codes or []):
+            chapter_scores.setdefault(chapter_code, -index - 1)
+
+        # 检索chapter下所有heading
+        filter_chapter_codes = ", ".join(f"'{item}'" for item in chapter_scores)
+        all_heading_response = await self.async_milvus_client.query(
+            collection_name=MilvusCollectionName.KNOWLEDGE_HEADING.value,
+            filter=f"chapter_code in [{filter_chapter_codes}]",
+            limit=1000,
+            output_fields=["heading_code", "heading_title", "heading_includes", "heading_common_examples",
+                           "chapter_code", "chapter_title"],
+        )
+        # 按token预算截断，相关度低的chapter及heading优先去掉
+        return build_heading_documents(all_heading_response, chapter_scores, heading_scores)
+
+    async def early_retrieve_chapter_codes(self, item: str) -> list[str]:
+        """
+        使用用户输入的原始商品信息检索chapter，在LLM改写的同时执行，返回按相关度排序的chapter编码
+        """
+        query_vector = await default_embeddings_service.get_embeddings_for_str(item)
+        chapter_scores, _ = await self.search_simil_codes(item, query_vector)
+        return sorted(chapter_scores, key=lambda code: -chapter_scores[code])
+
+    async def search_simil_codes(self, query_text: str,
+                                 query_vector: list[float]) -> tuple[dict[str, float], dict[str, float]]:
+        """
+        heading和chapter两个知识库同时进行混合搜索，返回相关chapter及直接命中的heading的得分(RRF)
         """
-        # 增加根据语义相似度获取到的heading信息
-        query_text = json.dumps(rewritten_item, ensure_ascii=False)
-        query_vector = await default_embeddings_service.get_rewritten_item_embeddings(rewritten_item)
-        simil_chapter_codes = set()
         # 采用混合搜索
         sparse_search_params = {"metric_type": "BM25"}
         dense_search_params = {"metric_type": "COSINE"}
@@ -35,15 +75,6 @@ class RetrieveDocumentsService:
         heading_dense_request = AnnSearchRequest(
             [query_vector], "heading_description_vector", dense_search_params, limit=10
         )
-        heading_response = await self.async_milvus_client.hybrid_search(
-            collection_name=MilvusCollectionName.KNOWLEDGE_HEADING.value,
-            reqs=[heading_sparse_request, heading_dense_request],
-            ranker=RRFRanker(),
-            limit=10,
-            output_fields=['chapter_code'])
-        for hits in heading_response:
-            for hit in hits:
-                simil_chapter_codes.add(hit["entity"]["chapter_code"])
         # Chapter
         chapter_sparse_request = AnnSearchRequest(
             [query_text], "content_sparse_vector", sparse_search_params, limit=10
@@ -51,53 +82,30 @@ class RetrieveDocumentsService:
         chapter_dense_request = AnnSearchRequest(
             [query_vector], "content_vector", dense_search_params, limit=10
         )
-        chapter_response = await self.async_milvus_client.hybrid_search(
-            collection_name=MilvusCollectionName.KNOWLEDGE_CHAPTER.value,
-            reqs=[chapter_sparse_request, chapter_dense_request],
-            ranker=RRFRanker(),
-            limit=5,
-            output_fields=['chapter_code'])
-        for hits in chapter_response:
-            for hit in hits:
-                simil_chapter_codes.add(hit["entity"]["chapter_code"])
-
-        # 检索chapter下所有heading
-        filter_chapter_codes = ", ".join(f"'{item}'" for item in simil_chapter_codes)
-        all_heading_response = await self.async_milvus_client.query(
-            collection_name=MilvusCollectionName.KNOWLEDGE_HEADING.value,
-            filter=f"chapter_code in [{filter_chapter_codes}]",
-            limit=1000,
-            output_fields=["heading_code", "heading_title", "heading_includes", "heading_common_examples",
-                           "chapter_code", "chapter_title"],
-        )
-        chapter_detail_dict = {}
-        candidate_heading_codes = {}
-        for hit in all_heading_response:
-            heading_code = hit["heading_code"]
-            heading_title = hit["heading_title"]
-            heading_includes = list(hit["heading_includes"])
-            heading_common_examples = list(hit["heading_common_examples"])
-            chapter_code = hit["chapter_code"]
-            chapter_title = hit["chapter_title"]
-            chapter_key = f"{chapter_code}:{chapter_title}"
-            if chapter_key in chapter_detail_dict:
-                chapter_details = chapter_detail_dict.get(chapter_key)
-            else:
-                chapter_details = []
-                chapter_detail_dict.update({chapter_key: chapter_details})
-            chapter_details.append({
-                "heading_code": heading_code,
-                "heading_title": heading_title,
-                "heading_includes": heading_includes,
-                "heading_common_examples": heading_common_examples
-            })
-
-        for chapter_code_and_title, chapter_detail in chapter_detail_dict.items():
-            chapter_code = chapter_code_and_title.split(":")[0]
-            heading_codes = [heading.get("heading_code") for heading in chapter_detail]
-            candidate_heading_codes[chapter_code] = heading_codes
-        return json.dumps(chapter_detail_dict, ensure_ascii=False), candidate_heading_codes
-
+        heading_response, chapter_response = await asyncio.gather(
+            self.async_milvus_client.hybrid_search(
+                collection_name=MilvusCollectionName.KNOWLEDGE_HEADING.value,
+                reqs=[heading_sparse_request, heading_dense_request],
+                ranker=RRFRanker(),
+                limit=10,
+                output_fields=['chapter_code', 'heading_code']),
+            self.async_milvus_client.hybrid_search(
+                collection_name=MilvusCollectionName.KNOWLEDGE_CHAPTER.value,
+                reqs=[chapter_sparse_request, chapter_dense_request],
+                ranker=RRFRanker(),
+                limit=5,
+                output_fields=['chapter_code']))
+        chapter_scores = {}
+        heading_scores = {}
+        for response in (heading_response, chapter_response):
+            for hits in response:
+                for hit in hits:
+                    chapter_code = hit["entity"]["chapter_code"]
+                    chapter_scores[chapter_code] = max(chapter_scores.get(chapter_code, 0), hit["distance"])
+                    heading_code = hit["entity"].get("heading_code")
+                    if heading_code:
+                        heading_scores[heading_code] = max(heading_scores.get(heading_code, 0), hit["distance"])
+        return chapter_scores, heading_scores
 
     async def save_heading_retrieve_evaluation(self, evaluate_version: str, origin_item_name: str, rewritten_item: dict,
                                                candidate_heading_codes: list[str], actual_heading: str):
@@ -111,43 +119,44 @@ class RetrieveDocumentsService:
             "matches": actual_heading in candidate_heading_codes,
             "created_at": datetime.now(timezone.utc),
         }
-        async with get_async_opensearch_client() as async_client:
-            await async_client.index(index=IndexName.EVALUATE_RETRIEVE_HEADING, body=document)
+        async_client = get_async_opensearch_client()
+        await async_client.index(index=IndexName.EVALUATE_RETRIEVE_HEADING, body=document)
 
 
     async def retrieve_subheading_documents(self, heading_codes: list[str]):
         """
-        根据heading编码检索subheading信息
+        根据heading编码检索subheading信息，heading_codes按相关度排序，超过token预算时去掉排在后面的heading
         """
         heading_detail_dict = await get_subheading_detail_by_heading_codes(heading_codes)
+        documents, heading_detail_dict = build_subheading_documents(heading_detail_dict, heading_codes)
         candidate_subheading_codes = {}
         for chapter_code_and_title, chapter_details in heading_detail_dict.items():
             for heading_code_and_title, heading_details in chapter_details.items():
                 heading_code = heading_code_and_title.split(":")[0]
                 subheading_codes = [subheading.get("subheading_code") for subheading in heading_details]
                 candidate_subheading_codes[heading_code] = subheading_codes
-        return json.dumps(heading_detail_dict, ensure_ascii=False), candidate_subheading_codes
+        return documents, candidate_subheading_codes
 
     async def retrieve_rate_line_documents(self, subheading_codes: list[str]):
         """
-        检索子目下面的税率线信息
+        检索子目下面的税率线信息，subheading_codes主要子目在前，超过token预算时去掉排在后面的子目
         """
         sub_heading_tree = await get_subheading_dict_by_subheading_codes(subheading_codes)
         sub_heading_detail_dict = await get_rate_lines_by_wco_subheadings(subheading_codes)
-        print(sub_heading_tree)
-        print(sub_heading_detail_dict)
-        candidate_rate_line_codes = {}
         for chapter_key, chapter_details in sub_heading_tree.items():
             for heading_key, heading_details in chapter_details.items():
                 for subheading_key, _ in heading_details.items():
                     subheading_code = subheading_key.split(":")[0]
-                    subheading_details = sub_heading_detail_dict.get(subheading_code)
-                    heading_details.update({subheading_key: subheading_details})
+                    heading_details.update({subheading_key: sub_heading_detail_dict.get(subheading_code)})
+        documents, sub_heading_tree = build_rate_line_documents(sub_heading_tree, subheading_codes)
+        candidate_rate_line_codes = {}
+        for chapter_key, chapter_details in sub_heading_tree.items():
+            for heading_key, heading_details in chapter_details.items():
+                for subheading_key, subheading_details in heading_details.items():
                     codes = []
-                    print(subheading_code)
                     self.get_rate_line_codes(subheading_details, codes)
-                    candidate_rate_line_codes[subheading_code] = codes
-        return json.dumps(sub_heading_tree, ensure_ascii=False), candidate_rate_line_codes
+                    candidate_rate_line_codes[subheading_key.split(":")[0]] = codes
+        return documents, candidate_rate_line_codes
 
     def get_rate_line_codes(self, subheading_details: list, codes: []):
         if subheading_details:
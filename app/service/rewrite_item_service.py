@@ -4,19 +4,21 @@ from app.db.session import AsyncSessionLocal
 from app.model.hts_classify_cache_model import ItemRewriteCache
 from app.repo.hts_classify_cache_repo import insert_item_rewrite_cache, select_item_rewrite_cache
 from app.core.opensearch import get_async_opensearch_client
-from app.core.constants import IndexName, RedisKeyPrefix
+from app.core.constants import IndexName
 from app.schema.llm.llm import ItemRewriteResponse
 from app.llm.prompt.prompt_template import rewrite_item_template
-from app.util.hash_utils import md5_hash
-from app.core.redis import get_async_redis
+from app.llm.embedding import default_embeddings_service
+from app.util.async_utils import first_completed
 
 from datetime import datetime, timezone
-from collections import OrderedDict
 from langchain.embeddings.base import Embeddings
 from langchain_core.output_parsers import PydanticOutputParser
 from langchain_core.prompts import PromptTemplate
 
-import json
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
 
 
 class ItemRewriteCacheService:
@@ -30,8 +32,26 @@ class ItemRewriteCacheService:
     async def get_from_cache(self, item:str):
         """
         从缓存获取之前的改写结果
+
+        数据库精确查询、中文名称相似度、英文名称相似度三层缓存并发查询，任意一层命中就直接返回并取消其他查询，
+        未命中时的耗时取决于最慢的一层，而不是所有层相加
+        """
+        # 中英文相似度查询共用同一个向量，只获取一次
+        item_vector_task = asyncio.ensure_future(default_embeddings_service.get_embeddings_for_str(item))
+        try:
+            return await first_completed([
+                self.get_from_exact_cache(item),
+                self.get_from_simil_cache(item_vector_task, "origin_item_ch_name_vector", "Chinese"),
+                self.get_from_simil_cache(item_vector_task, "origin_item_en_name_vector", "English"),
+            ])
+        finally:
+            if not item_vector_task.done():
+                item_vector_task.cancel()
+
+    async def get_from_exact_cache(self, item: str):
+        """
+        使用原始名称从数据库精确查询
         """
-        # 首先使用原始名称从数据库精确查询
         async with AsyncSessionLocal() as session:
             cache = await select_item_rewrite_cache(session, item)
             if cache:
@@ -40,52 +60,35 @@ class ItemRewriteCacheService:
                     "is_real_item": cache.is_real_item,
                     "rewritten_item": cache.rewritten_item
                 }
+        return None
 
-        # 如果精确查询没有匹配，使用向量字段进行相似度查询
-        async with get_async_opensearch_client() as async_client:
-            item_vector = self.embeddings.embed_query(item)
-            # 中文相似度
-            response = await async_client.search(index=IndexName.ITEM_REWRITE.value, body={
-                "query": {
-                    "knn": {
-                        "origin_item_ch_name_vector": {
-                            "vector": item_vector,
-                            "k": 1
-                        }
+    async def get_from_simil_cache(self, item_vector_task: asyncio.Future, vector_field: str, language: str):
+        """
+        使用向量字段进行相似度查询
+        """
+        item_vector = await asyncio.shield(item_vector_task)
+        async_client = get_async_opensearch_client()
+        response = await async_client.search(index=IndexName.ITEM_REWRITE.value, body={
+            "query": {
+                "knn": {
+                    vector_field: {
+                        "vector": item_vector,
+                        "k": 1
                     }
                 }
-            })
-            if response["hits"]["total"]["value"] > 0:
-                score = response["hits"]["hits"][0]["_score"]
-                print(f"Chinese similarity score:{score}")
-                # 相似度得分达到指定阈值的，直接返回结果，否则流程继续向下流转
-                if score > 0.95:
-                    return {
-                        "hit_rewrite_cache": True,
-                        "is_real_item": True,
-                        "rewritten_item": response["hits"]["hits"][0]["_source"]["rewritten_item"]
-                    }
-
-            # 英文相似度
-            response = await async_client.search(index=IndexName.ITEM_REWRITE.value, body={
-                "query": {
-                    "knn": {
-                        "origin_item_en_name_vector": {
-                            "vector": item_vector,
-                            "k": 1
-                        }
-                    }
+            }
+        })
+        if response["hits"]["total"]["value"] > 0:
+            score = response["hits"]["hits"][0]["_score"]
+            logger.debug("%s similarity score: %s", language, score)
+            # 相似度得分达到指定阈值的，直接返回结果，否则流程继续向下流转
+            if score > 0.95:
+                return {
+                    "hit_rewrite_cache": True,
+                    "is_real_item": True,
+                    "rewritten_item": response["hits"]["hits"][0]["_source"]["rewritten_item"]
                 }
-            })
-            if response["hits"]["total"]["value"] > 0:
-                score = response["hits"]["hits"][0]["_score"]
-                print(f"English similarity score:{score}")
-                if score > 0.95:
-                    return {
-                        "hit_rewrite_cache": True,
-                        "is_real_item": True,
-                        "rewritten_item": response["hits"]["hits"][0]["_source"]["rewritten_item"]
-                    }
+        return None
 
     async def save_exact_cache(self, item: str, rewrite_success: bool, rewritten_item: dict[str, str]):
         """
@@ -103,8 +106,8 @@ class ItemRewriteCacheService:
         """
         ch_name = rewritten_item.get("cn_name", item)
         en_name = rewritten_item.get("en_name", item)
-        ch_name_vector = await self.embeddings.aembed_query(ch_name)
-        en_name_vector = await self.embeddings.aembed_query(en_name)
+        # 中英文名称同时提交，由embeddings合并为一次批量请求
+        ch_name_vector, en_name_vector = await default_embeddings_service.get_embeddings_for_list([ch_name, en_name])
         document = {
             "origin_item_name": item,
             "origin_item_ch_name": ch_name,
@@ -116,8 +119,8 @@ class ItemRewriteCacheService:
             "thread_id": config.get("configurable", {}).get("thread_id", ""),
             "created_at": datetime.now(timezone.utc),
         }
-        async with get_async_opensearch_client() as async_client:
-            await async_client.index(index=IndexName.ITEM_REWRITE.value, body=document)
+        async_client = get_async_opensearch_client()
+        await async_client.index(index=IndexName.ITEM_REWRITE.value, body=document)
 
 
     async def rewrite_use_llm(self, item: str):
@@ -145,28 +148,3 @@ class ItemRewriteCacheService:
             rewrite_result = parser.parse(output.content)
 
         return human_message, output, rewrite_result
-
-
-
-class RewriteItemEmbeddingsService:
-
-    def __init__(self, embeddings: Embeddings):
-        self.embeddings = embeddings
-
-    async def get_rewritten_item_embeddings(self, rewritten_item: dict) -> list[float]:
-        """
-        获取改写商品的embeddings，优先使用redis缓存，如果没有走接口获取，然后缓存到redis中
-        """
-        rewritten_item_vector = None
-        ordered_rewritten_item = OrderedDict(sorted(rewritten_item.items()))
-        rewritten_item_json = json.dumps(ordered_rewritten_item, ensure_ascii=False)
-        redis_hash_key = f"{RedisKeyPrefix.REWRITTEN_ITEM_EMBEDDINGS.value}:{md5_hash(rewritten_item_json)}"
-        async_redis = await get_async_redis()
-        vector_json = await async_redis.get(redis_hash_key)
-        if vector_json:
-            rewritten_item_vector = json.loads(vector_json)
-        if rewritten_item_vector is None:
-            rewritten_item_vector = await self.embeddings.aembed_query(rewritten_item_json)
-            # 将llm返回的embedding缓存到redis
-            await async_redis.set(redis_hash_key, json.dumps(rewritten_item_vector, ensure_ascii=False))
-        return rewritten_item_vector
\ No newline at end of file
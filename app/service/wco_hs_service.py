@@ -3,6 +3,7 @@ from pyexpat.errors import messages
 from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi import BackgroundTasks
 from datetime import datetime
+import asyncio
 import logging
 import copy
 
@@ -15,8 +16,8 @@ from app.repo.wco_hs_repo import insert_update_record, insert_sections, update_r
     insert_chapters, insert_headings, insert_subheadings, select_last_update_record, select_sections_by_version, \
     select_chapters_by_section, select_headings_by_chapter, select_wco_current_version, \
     delete_wco_section_by_version, disable_last_version, insert_current_version, select_all_chapters, \
-    select_current_version_chapters_by_codes, select_current_version_headings_by_codes, select_subheadings_by_heading, \
-    select_current_version_subheadings_by_codes, select_all_headings
+    select_current_version_chapters_by_codes, select_all_headings
+from app.service.wco_hs_taxonomy_service import get_wco_hs_taxonomy, rebuild_wco_hs_taxonomy
 from app.model.wco_hs_model import WcoHsSection, WcoHsUpdateRecord, WcoHsChapter, WcoHsHeading, WcoHsSubheading, \
     WcoHsVersionHistory
 from app.schema.wco_hs import CheckUpdateResponse, WcoHsProcessResult
@@ -100,6 +101,7 @@ async def update_wco_hs_code_task(newest_version):
                 record.updated_at = datetime.now()
                 await save_record_result(session, record)
                 logger.info("Finish update wco hs success")
+        await refresh_taxonomy_after_commit(session, record)
 
 
 async def process_wco_update(newest_version) -> WcoHsProcessResult:
@@ -108,18 +110,21 @@ async def process_wco_update(newest_version) -> WcoHsProcessResult:
     current_heading_code = ""
     try:
         section_list = await process_sections(newest_version)
-        for section in section_list:
+        # 先并发抓取所有页面(并发数及速率由爬虫按host限制)，再按原来的顺序逐级保存
+        # 保存顺序以及失败时记录的位置和逐页处理时一致，断点续传的逻辑不需要变化
+        crawled_sections = await asyncio.gather(*(crawl_section(section) for section in section_list))
+        for section, (chapter_list, crawled_chapters) in zip(section_list, crawled_sections):
             logger.debug("Start process section %s", section.section_code)
             current_section_code = section.section_code
-            chapter_list = await process_chapters(section)
-            for chapter in chapter_list:
+            chapters = await save_chapters(section, unwrap_crawl_result(chapter_list))
+            for chapter, (heading_list, crawled_headings) in zip(chapters or [], crawled_chapters):
                 logger.debug("Start process chapter %s", chapter.chapter_code)
                 current_chapter_code = chapter.chapter_code
-                heading_list = await process_headings(chapter)
-                for heading in heading_list:
+                headings = await save_headings(chapter, unwrap_crawl_result(heading_list))
+                for heading, subheading_list in zip(headings or [], crawled_headings):
                     logger.debug("Start process heading %s", heading.heading_code)
                     current_heading_code = heading.heading_code
-                    await process_subheadings(heading)
+                    await save_subheadings(heading, unwrap_crawl_result(subheading_list))
     except Exception as e:
         logger.exception("Update failed", exc_info=e)
         return WcoHsProcessResult(success=False, message=str(e)[:2000] if len(str(e)) > 2000 else str(e),
@@ -130,6 +135,45 @@ async def process_wco_update(newest_version) -> WcoHsProcessResult:
         return WcoHsProcessResult(success=True, message="Success", can_resume=False)
 
 
+async def capture_crawl_result(coroutine):
+    """
+    抓取失败时返回异常对象而不是直接抛出，保存到失败的位置时再抛出
+    """
+    try:
+        return await coroutine
+    except Exception as e:
+        return e
+
+
+def unwrap_crawl_result(result):
+    if isinstance(result, Exception):
+        raise result
+    return result
+
+
+async def crawl_section(section: WcoHsSection):
+    """
+    并发抓取section下的章节、类目、子目
+
+    :return: (chapter_list, [(heading_list, [subheading_list, ...]), ...])，抓取失败的位置为异常对象
+    """
+    chapter_list = await capture_crawl_result(wco_crawler_utils.get_chapter(section))
+    if isinstance(chapter_list, Exception) or not chapter_list:
+        return chapter_list, []
+    chapter_list = [chapter for chapter in chapter_list if chapter["code"]]
+    return chapter_list, await asyncio.gather(*(crawl_chapter(chapter) for chapter in chapter_list))
+
+
+async def crawl_chapter(chapter: dict):
+    heading_list = await capture_crawl_result(wco_crawler_utils.get_heading_by_url(chapter["list_url"]))
+    if isinstance(heading_list, Exception) or not heading_list:
+        return heading_list, []
+    heading_list = [heading for heading in heading_list if heading["code"]]
+    return heading_list, await asyncio.gather(
+        *(capture_crawl_result(wco_crawler_utils.get_subheading_by_url(heading["list_url"]))
+          for heading in heading_list))
+
+
 async def recovery_update_task(record: WcoHsUpdateRecord, version: str):
     # 更新当前记录为doing
     logger.info("Start resume update wco hs")
@@ -161,6 +205,7 @@ async def recovery_update_task(record: WcoHsUpdateRecord, version: str):
                 record.updated_at = datetime.now()
                 await save_record_result(session, record)
                 logger.info("Finish resume update wco hs success")
+        await refresh_taxonomy_after_commit(session, record)
 
 
 async def process_resume_wco_update(record, session, version) -> WcoHsProcessResult:
@@ -248,6 +293,14 @@ async def save_record_result(session: AsyncSession, record):
     return record
 
 
+async def refresh_taxonomy_after_commit(session: AsyncSession, record):
+    """
+    版本切换的事务提交之后再重建进程内的分类树，事务回滚时不会使用不存在的版本
+    """
+    if record.update_status == "success":
+        await rebuild_wco_hs_taxonomy(session, record.update_version)
+
+
 async def process_sections(version: str) -> list[WcoHsSection] | None:
     """
     获取并保存section列表到数据库
@@ -259,10 +312,11 @@ async def process_sections(version: str) -> list[WcoHsSection] | None:
     section_list = await wco_crawler_utils.get_section(version)
     if section_list:
         async with AsyncSessionLocal() as session:
-            sections = [WcoHsSection(section_code=section["code"], section_title=section["title"],
-                                     load_children_url=section["list_url"], version=version)
-                        for section in section_list if section["code"]]
-            return await insert_sections(session, sections)
+            async with session.begin():
+                sections = [WcoHsSection(section_code=section["code"], section_title=section["title"],
+                                         load_children_url=section["list_url"], version=version)
+                            for section in section_list if section["code"]]
+                return await insert_sections(session, sections)
     else:
         raise Exception("没有获取到Section数据")
 
@@ -273,14 +327,18 @@ async def process_chapters(section: WcoHsSection) -> list[WcoHsChapter] | None:
     :param section: 所属分类
     :return: None
     """
-    chapter_list = await wco_crawler_utils.get_chapter(section)
+    return await save_chapters(section, await wco_crawler_utils.get_chapter(section))
+
+
+async def save_chapters(section: WcoHsSection, chapter_list: list[dict] | None) -> list[WcoHsChapter] | None:
     if chapter_list:
         async with AsyncSessionLocal() as session:
-            chapters = [WcoHsChapter(chapter_code=chapter["code"].zfill(2), chapter_title=chapter["title"],
-                                     load_children_url=chapter["list_url"], section_id=section.id,
-                                     version=section.version)
-                        for chapter in chapter_list if chapter["code"]]
-            return await insert_chapters(session, chapters)
+            async with session.begin():
+                chapters = [WcoHsChapter(chapter_code=chapter["code"].zfill(2), chapter_title=chapter["title"],
+                                         load_children_url=chapter["list_url"], section_id=section.id,
+                                         version=section.version)
+                            for chapter in chapter_list if chapter["code"]]
+                return await insert_chapters(session, chapters)
     return None
 
 
@@ -290,14 +348,18 @@ async def process_headings(chapter: WcoHsChapter) -> list[WcoHsHeading] | None:
     :param chapter: 所属章节
     :return: None
     """
-    heading_list = await wco_crawler_utils.get_heading(chapter)
+    return await save_headings(chapter, await wco_crawler_utils.get_heading(chapter))
+
+
+async def save_headings(chapter: WcoHsChapter, heading_list: list[dict] | None) -> list[WcoHsHeading] | None:
     if heading_list:
         async with AsyncSessionLocal() as session:
-            headings = [WcoHsHeading(heading_code=heading["code"], heading_title=heading["title"],
-                                     load_children_url=heading["list_url"], chapter_id=chapter.id,
-                                     version=chapter.version)
-                        for heading in heading_list if heading["code"]]
-            return await insert_headings(session, headings)
+            async with session.begin():
+                headings = [WcoHsHeading(heading_code=heading["code"], heading_title=heading["title"],
+                                         load_children_url=heading["list_url"], chapter_id=chapter.id,
+                                         version=chapter.version)
+                            for heading in heading_list if heading["code"]]
+                return await insert_headings(session, headings)
     return None
 
 
@@ -307,13 +369,19 @@ async def process_subheadings(heading: WcoHsHeading) -> list[WcoHsSubheading] |
     :param heading: 所属类目
     :return: None
     """
-    subheading_list = await wco_crawler_utils.get_subheading(heading)
+    return await save_subheadings(heading, await wco_crawler_utils.get_subheading(heading))
+
+
+async def save_subheadings(heading: WcoHsHeading,
+                           subheading_list: list[dict] | None) -> list[WcoHsSubheading] | None:
     if subheading_list:
         async with AsyncSessionLocal() as session:
-            subheadings = [WcoHsSubheading(subheading_code=subheading["code"], subheading_title=subheading["title"],
-                                           heading_id=heading.id, version=heading.version)
-                           for subheading in subheading_list if subheading["code"]]
-            return await insert_subheadings(session, subheadings)
+            async with session.begin():
+                subheadings = [WcoHsSubheading(subheading_code=subheading["code"],
+                                               subheading_title=subheading["title"],
+                                               heading_id=heading.id, version=heading.version)
+                               for subheading in subheading_list if subheading["code"]]
+                return await insert_subheadings(session, subheadings)
     return None
 
 
@@ -349,18 +417,6 @@ async def get_chapters_by_chapter_codes(session: AsyncSession, chapter_codes: li
         return await select_current_version_chapters_by_codes(session, current_version, chapter_codes)
     raise Exception("没有获取到当前版本，请先初始化数据！")
 
-async def get_headings_by_heading_codes(session: AsyncSession, heading_codes: list[str]):
-    current_version = await get_current_version(session)
-    if current_version:
-        return await select_current_version_headings_by_codes(session, current_version, heading_codes)
-    raise Exception("没有获取到当前版本，请先初始化数据！")
-
-async def get_subheadings_by_subheading_codes(session: AsyncSession, subheading_codes: list[str]):
-    current_version = await get_current_version(session)
-    if current_version:
-        return await select_current_version_subheadings_by_codes(session, current_version, subheading_codes)
-    raise Exception("没有获取到当前版本，请先初始化数据！")
-
 async def get_headings_by_chapter_code(session: AsyncSession, chapter_code: str):
     chapters = await get_chapters_by_chapter_codes(session, [chapter_code])
     if chapters:
@@ -384,38 +440,10 @@ async def get_heading_detail_by_chapter_codes(chapter_codes: list):
 
 
 async def get_subheading_detail_by_heading_codes(heading_codes: list):
-    chapter_heading_detail_dict = dict()
-    async with AsyncSessionLocal() as session:
-        headings = await get_headings_by_heading_codes(session, heading_codes)
-        for heading in headings:
-            chapter = await heading.awaitable_attrs.chapter
-            chapter_key = chapter.chapter_code + ":" + chapter.chapter_title
-            if chapter_key not in chapter_heading_detail_dict:
-                chapter_heading_detail_dict.update({chapter_key: dict()})
-            subheadings = await select_subheadings_by_heading(session, heading.id)
-            if subheadings:
-                heading_details = chapter_heading_detail_dict.get(chapter_key)
-                heading_details.update({heading.heading_code + ":" + heading.heading_title:
-                                            [{"subheading_code": subheading.subheading_code,
-                                              "subheading_title": subheading.subheading_title}
-                                             for subheading in subheadings]})
-    return chapter_heading_detail_dict
+    taxonomy = await get_wco_hs_taxonomy()
+    return taxonomy.get_subheading_detail_by_heading_codes(heading_codes)
 
 
 async def get_subheading_dict_by_subheading_codes(subheading_codes: list):
-    chapter_heading_detail_dict = dict()
-    async with AsyncSessionLocal() as session:
-        sub_headings = await get_subheadings_by_subheading_codes(session, subheading_codes)
-        for sub_heading in sub_headings:
-            heading = await sub_heading.awaitable_attrs.heading
-            chapter = await heading.awaitable_attrs.chapter
-            heading_key = heading.heading_code + ":" + heading.heading_title
-            chapter_key = chapter.chapter_code + ":" + chapter.chapter_title
-            if chapter_key not in chapter_heading_detail_dict:
-                chapter_heading_detail_dict.update({chapter_key: dict()})
-            chapter_details = chapter_heading_detail_dict.get(chapter_key)
-            if heading_key not in chapter_details:
-                chapter_details.update({heading_key: dict()})
-            header_details = chapter_details.get(heading_key)
-            header_details.update({sub_heading.subheading_code + ":" + sub_heading.subheading_title: list()})
-    return chapter_heading_detail_dict
\ No newline at end of file
+    taxonomy = await get_wco_hs_taxonomy()
+    return taxonomy.get_subheading_dict_by_subheading_codes(subheading_codes)
@@ -0,0 +1,164 @@
+"""
+进程内的WCO HS分类树
+
+chapter/heading/subheading数据对于同一个版本(WcoHsVersionHistory)来说是静态的，
+每个版本只从数据库加载一次，之后的查询全部使用字典完成，避免每次分类都逐个heading查询数据库
+"""
+import asyncio
+import logging
+import time
+from types import MappingProxyType
+from typing import Mapping
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.db.session import AsyncSessionLocal
+from app.repo.wco_hs_repo import select_wco_current_version, select_all_chapters, select_all_headings, \
+    select_all_subheadings
+from app.schema.wco_hs import WcoTaxonomyChapter, WcoTaxonomyHeading, WcoTaxonomySubheading
+
+logger = logging.getLogger(__name__)
+
+
+class WcoHsTaxonomy:
+    """
+    某个版本的WCO HS分类树，创建之后不再修改，切换版本时整体替换
+    """
+
+    def __init__(self, version: str, chapters: list[WcoTaxonomyChapter], headings: list[WcoTaxonomyHeading],
+                 subheadings: list[WcoTaxonomySubheading]):
+        self.version = version
+        self.chapters: Mapping[str, WcoTaxonomyChapter] = MappingProxyType(
+            {chapter.chapter_code: chapter for chapter in sorted(chapters, key=lambda c: c.chapter_code)})
+        self.headings: Mapping[str, WcoTaxonomyHeading] = MappingProxyType(
+            {heading.heading_code: heading for heading in sorted(headings, key=lambda h: h.heading_code)})
+        self.subheadings: Mapping[str, WcoTaxonomySubheading] = MappingProxyType(
+            {subheading.subheading_code: subheading
+             for subheading in sorted(subheadings, key=lambda s: s.subheading_code)})
+        chapter_headings: dict[str, list[WcoTaxonomyHeading]] = {}
+        for heading in self.headings.values():
+            chapter_headings.setdefault(heading.chapter_code, []).append(heading)
+        heading_subheadings: dict[str, list[WcoTaxonomySubheading]] = {}
+        for subheading in self.subheadings.values():
+            heading_subheadings.setdefault(subheading.heading_code, []).append(subheading)
+        self._chapter_headings = MappingProxyType({code: tuple(items) for code, items in chapter_headings.items()})
+        self._heading_subheadings = MappingProxyType(
+            {code: tuple(items) for code, items in heading_subheadings.items()})
+
+    def get_headings_by_chapter_code(self, chapter_code: str) -> tuple[WcoTaxonomyHeading, ...]:
+        return self._chapter_headings.get(chapter_code, ())
+
+    def get_subheadings_by_heading_code(self, heading_code: str) -> tuple[WcoTaxonomySubheading, ...]:
+        return self._heading_subheadings.get(heading_code, ())
+
+    def chapter_key(self, chapter_code: str) -> str:
+        chapter = self.chapters[chapter_code]
+        return chapter.chapter_code + ":" + chapter.chapter_title
+
+    def get_subheading_detail_by_heading_codes(self, heading_codes: list) -> dict:
+        """
+        返回结构: {chapter_key: {heading_key: [{"subheading_code": ..., "subheading_title": ...}]}}
+        """
+        chapter_heading_detail_dict = dict()
+        for heading_code in sorted(set(heading_codes)):
+            heading = self.headings.get(heading_code)
+            if heading is None or heading.chapter_code not in self.chapters:
+                continue
+            heading_details = chapter_heading_detail_dict.setdefault(self.chapter_key(heading.chapter_code), dict())
+            subheadings = self.get_subheadings_by_heading_code(heading_code)
+            if subheadings:
+                heading_details.update({heading.heading_code + ":" + heading.heading_title:
+                                            [{"subheading_code": subheading.subheading_code,
+                                              "subheading_title": subheading.subheading_title}
+                                             for subheading in subheadings]})
+        return chapter_heading_detail_dict
+
+    def get_subheading_dict_by_subheading_codes(self, subheading_codes: list) -> dict:
+        """
+        返回结构: {chapter_key: {heading_key: {subheading_key: []}}}
+        """
+        chapter_heading_detail_dict = dict()
+        for subheading_code in sorted(set(subheading_codes)):
+            subheading = self.subheadings.get(subheading_code)
+            heading = self.headings.get(subheading.heading_code) if subheading else None
+            if heading is None or heading.chapter_code not in self.chapters:
+                continue
+            chapter_details = chapter_heading_detail_dict.setdefault(self.chapter_key(heading.chapter_code), dict())
+            heading_details = chapter_details.setdefault(heading.heading_code + ":" + heading.heading_title, dict())
+            heading_details.update({subheading.subheading_code + ":" + subheading.subheading_title: list()})
+        return chapter_heading_detail_dict
+
+
+__current_taxonomy: WcoHsTaxonomy | None = None
+__last_version_check: float = 0.0
+__taxonomy_lock: asyncio.Lock | None = None
+
+
+def _get_taxonomy_lock() -> asyncio.Lock:
+    global __taxonomy_lock
+    if __taxonomy_lock is None:
+        __taxonomy_lock = asyncio.Lock()
+    return __taxonomy_lock
+
+
+async def load_wco_hs_taxonomy(session: AsyncSession, version: str) -> WcoHsTaxonomy:
+    """
+    从数据库加载指定版本的分类树，固定三次查询
+    """
+    chapters = await select_all_chapters(session, version)
+    headings = await select_all_headings(session, version)
+    subheadings = await select_all_subheadings(session, version)
+    chapter_codes = {chapter.id: chapter.chapter_code for chapter in chapters}
+    heading_codes = {heading.id: heading.heading_code for heading in headings}
+    taxonomy = WcoHsTaxonomy(
+        version=version,
+        chapters=[WcoTaxonomyChapter(chapter_code=chapter.chapter_code, chapter_title=chapter.chapter_title)
+                  for chapter in chapters],
+        headings=[WcoTaxonomyHeading(heading_code=heading.heading_code, heading_title=heading.heading_title,
+                                     chapter_code=chapter_codes[heading.chapter_id])
+                  for heading in headings if heading.chapter_id in chapter_codes],
+        subheadings=[WcoTaxonomySubheading(subheading_code=subheading.subheading_code,
+                                           subheading_title=subheading.subheading_title,
+                                           heading_code=heading_codes[subheading.heading_id])
+                     for subheading in subheadings if subheading.heading_id in heading_codes])
+    logger.info("Loaded wco hs taxonomy %s: %s chapters, %s headings, %s subheadings", version,
+                len(taxonomy.chapters), len(taxonomy.headings), len(taxonomy.subheadings))
+    return taxonomy
+
+
+async def rebuild_wco_hs_taxonomy(session: AsyncSession, version: str) -> WcoHsTaxonomy:
+    """
+    切换版本的事务提交之后调用，加载新版本后整体替换
+    """
+    global __current_taxonomy, __last_version_check
+    async with _get_taxonomy_lock():
+        taxonomy = await load_wco_hs_taxonomy(session, version)
+        __current_taxonomy = taxonomy
+        __last_version_check = time.monotonic()
+    return taxonomy
+
+
+async def get_wco_hs_taxonomy() -> WcoHsTaxonomy:
+    """
+    获取当前版本的分类树
+
+    已加载时直接返回，只有超过检查间隔才会查询一次当前版本，版本变化时重新加载
+    """
+    global __current_taxonomy, __last_version_check
+    taxonomy = __current_taxonomy
+    if taxonomy and time.monotonic() - __last_version_check < settings.WCO_HS_TAXONOMY_VERSION_CHECK_SECONDS:
+        return taxonomy
+    async with _get_taxonomy_lock():
+        # 等待锁期间可能已经被其他协程刷新过了
+        if __current_taxonomy and time.monotonic() - __last_version_check < \
+                settings.WCO_HS_TAXONOMY_VERSION_CHECK_SECONDS:
+            return __current_taxonomy
+        async with AsyncSessionLocal() as session:
+            version_record = await select_wco_current_version(session)
+            if not version_record:
+                raise Exception("没有获取到当前版本，请先初始化数据！")
+            if __current_taxonomy is None or __current_taxonomy.version != version_record.version:
+                __current_taxonomy = await load_wco_hs_taxonomy(session, version_record.version)
+        __last_version_check = time.monotonic()
+        return __current_taxonomy
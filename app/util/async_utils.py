@@ -0,0 +1,29 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Iterable
+
+logger = logging.getLogger(__name__)
+
+
+async def first_completed(awaitables: Iterable[Awaitable],
+                          accept: Callable[[Any], bool] = lambda result: result is not None):
+    """
+    并发执行所有任务，返回第一个满足条件的结果，并取消其他还没有完成的任务
+
+    单个任务异常只记录日志，不影响其他任务；全部任务都没有满足条件的结果时返回None
+    """
+    tasks = [asyncio.ensure_future(awaitable) for awaitable in awaitables]
+    try:
+        for next_completed in asyncio.as_completed(tasks):
+            try:
+                result = await next_completed
+            except Exception as e:
+                logger.warning("Concurrent task failed: %r", e)
+                continue
+            if accept(result):
+                return result
+        return None
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
@@ -2,4 +2,7 @@
 import hashlib
 
 def md5_hash(text: str):
-    return hashlib.md5(text.encode("utf-8")).hexdigest()
\ No newline at end of file
+    return hashlib.md5(text.encode("utf-8")).hexdigest()
+
+def sha256_hash(text: str):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
@@ -1,9 +1,11 @@
 import requests
 import os
 import json
+import asyncio
+from typing import Iterator
 
 from app.core.config import settings
-from app.schema.hts import HtsRecord
+from app.schema.hts import HtsRecord, HtsRecordFootnote
 
 
 # ?from=0101.&to=9999.&format=JSON&styles=false
@@ -39,30 +41,122 @@ async def download_file_to_cache(url: str, filename: str):
     if os.path.exists(file_path):
         return file_path
 
-    # 下载文件
-    response = requests.get(url)
-    response.raise_for_status()  # 确保请求成功
-
-    # 保存文件
-    with open(file_path, 'wb') as f:
-        f.write(response.content)
+    # 流式下载到临时文件，下载完成后再改名，避免整个文件读入内存以及缓存不完整的文件
+    await asyncio.to_thread(_download_file, url, file_path)
 
     return file_path
 
-async def read_json_file_to_objects(file_path: str, model_class) -> list:
+
+def _download_file(url: str, file_path: str):
+    temp_file_path = file_path + ".downloading"
+    with requests.get(url, stream=True) as response:
+        response.raise_for_status()  # 确保请求成功
+        with open(temp_file_path, 'wb') as f:
+            for chunk in response.iter_content(chunk_size=1024 * 1024):
+                f.write(chunk)
+    os.replace(temp_file_path, file_path)
+
+
+def iter_json_file(file_path: str, chunk_size: int = 64 * 1024) -> Iterator[dict]:
+    """
+    增量读取json文件，顶层是数组时逐个返回数组中的元素，顶层是对象时返回这个对象
+
+    每次只在内存中保留当前正在解析的元素，内存占用与文件大小无关
+    """
+    decoder = json.JSONDecoder()
     with open(file_path, 'r', encoding='utf-8') as file:
-        data = json.load(file)
-
-    # 如果数据是列表，逐个转换为模型对象
-    if isinstance(data, list):
-        return [model_class(**item) for item in data]
-    # 如果是单个对象，包装成列表
-    elif isinstance(data, dict):
-        return [model_class(**data)]
-    else:
-        raise ValueError("JSON数据格式不正确，应为对象或对象列表")
-
-async def read_data(current_release_name: str) -> list[HtsRecord]:
+        buffer = ""
+        position = 0
+        eof = False
+
+        def fill() -> bool:
+            # 丢弃已经解析过的部分，再读入下一块
+            nonlocal buffer, position, eof
+            chunk = file.read(chunk_size)
+            buffer = buffer[position:] + chunk
+            position = 0
+            eof = not chunk
+            return bool(chunk)
+
+        def skip_whitespace():
+            nonlocal position
+            while True:
+                while position < len(buffer) and buffer[position].isspace():
+                    position += 1
+                if position < len(buffer) or not fill():
+                    return
+
+        skip_whitespace()
+        if position >= len(buffer):
+            raise ValueError("JSON数据格式不正确，应为对象或对象列表")
+        is_array = buffer[position] == "["
+        if is_array:
+            position += 1
+        while True:
+            skip_whitespace()
+            if is_array and position < len(buffer) and buffer[position] == "]":
+                return
+            if position >= len(buffer):
+                raise ValueError("JSON数据不完整")
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+                # 元素刚好在块的末尾结束时无法确定是否完整(比如数字)，需要再读一块确认
+                if end >= len(buffer) and not eof:
+                    raise json.JSONDecodeError("incomplete", buffer, end)
+            except json.JSONDecodeError:
+                if fill():
+                    continue
+                if eof and position < len(buffer):
+                    item, end = decoder.raw_decode(buffer, position)
+                else:
+                    raise
+            if not isinstance(item, dict):
+                raise ValueError("JSON数据格式不正确，应为对象或对象列表")
+            position = end
+            yield item
+            if not is_array:
+                return
+            skip_whitespace()
+            if position < len(buffer) and buffer[position] == ",":
+                position += 1
+
+
+def to_hts_record(item: dict) -> HtsRecord:
+    """
+    导出文件是可信数据，跳过pydantic的完整校验，只做必要的类型转换
+    """
+    superior = item.get("superior")
+    if isinstance(superior, str):
+        superior = superior.lower() == "true"
+    footnotes = item.get("footnotes")
+    return HtsRecord.model_construct(
+        htsno=item.get("htsno") or "",
+        indent=int(item.get("indent") or 0),
+        description=item.get("description") or "",
+        superior=superior,
+        units=item.get("units"),
+        general=item.get("general"),
+        special=item.get("special"),
+        other=item.get("other"),
+        footnotes=[HtsRecordFootnote.model_construct(columns=footnote.get("columns") or [],
+                                                     marker=footnote.get("marker"),
+                                                     value=footnote.get("value") or "",
+                                                     type=footnote.get("type") or "")
+                   for footnote in footnotes] if footnotes else None,
+        quotaQuantity=item.get("quotaQuantity"),
+        additionalDuties=item.get("additionalDuties"),
+    )
+
+
+def iter_hts_records(file_path: str) -> Iterator[HtsRecord]:
+    for item in iter_json_file(file_path):
+        yield to_hts_record(item)
+
+
+async def read_data(current_release_name: str) -> Iterator[HtsRecord]:
+    """
+    下载(已缓存则直接使用)导出文件，返回逐条读取的生成器
+    """
     url = settings.HTS_EXPORT_CURRENT_JSON_URL + "?from=0101.&to=9999.&format=JSON&styles=false"
     file_path = await download_file_to_cache(url, current_release_name + ".json")
-    return await read_json_file_to_objects(file_path, HtsRecord)
\ No newline at end of file
+    return iter_hts_records(file_path)
\ No newline at end of file
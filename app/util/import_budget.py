@@ -0,0 +1,73 @@
+"""
+启动导入耗时检查
+
+在子进程中以python -X importtime导入应用入口，统计所有模块的导入耗时，超过预算或者导入了不应在启动时导入的模块
+(模型供应商的客户端、pandas等只在首次使用时导入)时以非0状态退出，可以在CI中执行:
+    python -m app.util.import_budget
+    python -m app.util.import_budget --budget-ms 3000 --top 30
+"""
+import argparse
+import re
+import subprocess
+import sys
+
+DEFAULT_MODULE = "app.main"
+DEFAULT_BUDGET_MS = 4000
+# 启动时不应导入的模块，由注册表、服务工厂函数在首次使用时导入
+LAZY_MODULES = (
+    "pandas",
+    "dashscope",
+    "openai",
+    "langchain_deepseek",
+    "langchain_community.chat_models.tongyi",
+)
+
+__import_time_pattern = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)\s*$")
+
+
+def measure_imports(module: str) -> list[tuple[str, int, int]]:
+    """
+    返回(模块名, 自身耗时, 累计耗时)，单位微秒
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"Import {module} failed:\n{result.stderr[-2000:]}")
+    imports = []
+    for line in result.stderr.splitlines():
+        matched = __import_time_pattern.match(line)
+        if matched:
+            imports.append((matched.group(4), int(matched.group(1)), int(matched.group(2))))
+    return imports
+
+
+def check_import_budget(module: str, budget_ms: float, top: int) -> bool:
+    imports = measure_imports(module)
+    total_ms = sum(self_us for _, self_us, _ in imports) / 1000
+    print(f"Import {module}: {total_ms:.0f}ms, {len(imports)} modules, budget {budget_ms:.0f}ms")
+    for name, self_us, cumulative_us in sorted(imports, key=lambda item: item[1], reverse=True)[:top]:
+        print(f"  {self_us / 1000:8.1f}ms self {cumulative_us / 1000:8.1f}ms cumulative  {name}")
+
+    passed = True
+    imported = {name for name, _, _ in imports}
+    eager = [name for name in LAZY_MODULES if name in imported]
+    if eager:
+        print(f"FAIL: modules should be imported on first use: {eager}")
+        passed = False
+    if total_ms > budget_ms:
+        print(f"FAIL: import time {total_ms:.0f}ms exceeds budget {budget_ms:.0f}ms")
+        passed = False
+    return passed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the import time of the application entry")
+    parser.add_argument("--module", default=DEFAULT_MODULE)
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS)
+    parser.add_argument("--top", type=int, default=20, help="print the slowest modules")
+    args = parser.parse_args()
+    sys.exit(0 if check_import_budget(args.module, args.budget_ms, args.top) else 1)
+
+
+if __name__ == "__main__":
+    main()
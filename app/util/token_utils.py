@@ -0,0 +1,43 @@
+"""
+提示词token数估算
+
+默认使用字符数估算(中日韩字符每个约1个token，其他字符约4个一个token)，配置PROMPT_TOKENIZER=dashscope时
+使用dashscope的本地qwen分词器，分词器不可用时回退到估算
+"""
+import json
+import logging
+import re
+from functools import lru_cache
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+__cjk_pattern = re.compile(r"[　-〿぀-ヿ㐀-䶿一-鿿가-힯＀-￯]")
+
+
+@lru_cache(maxsize=1)
+def get_tokenizer():
+    if settings.PROMPT_TOKENIZER != "dashscope":
+        return None
+    try:
+        from dashscope import get_tokenizer as get_dashscope_tokenizer
+        return get_dashscope_tokenizer("qwen-turbo")
+    except Exception as e:
+        logger.warning("Load dashscope tokenizer failed, use heuristic estimate: %s", e)
+        return None
+
+
+def estimate_tokens(text: str) -> int:
+    tokenizer = get_tokenizer()
+    if tokenizer is not None:
+        return len(tokenizer.encode(text))
+    cjk_count = len(__cjk_pattern.findall(text))
+    return cjk_count + (len(text) - cjk_count + 3) // 4
+
+
+def dump_compact(obj) -> str:
+    """
+    不带缩进及多余空格的JSON，减少提示词token数
+    """
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
@@ -0,0 +1,56 @@
+"""
+redis中embedding向量的二进制编码
+
+格式: b"VEC" + 格式版本(1字节) + 数据类型(1字节) + 小端序的float数组
+2048维的向量float32约8KB、float16约4KB，JSON格式约40KB，并且解码时不需要json.loads
+"""
+import json
+import struct
+import sys
+from array import array
+
+MAGIC = b"VEC"
+FORMAT_VERSION = 1
+HEADER_SIZE = len(MAGIC) + 2
+
+FLOAT32 = "float32"
+FLOAT16 = "float16"
+__dtype_codes = {FLOAT32: 1, FLOAT16: 2}
+__code_dtypes = {code: dtype for dtype, code in __dtype_codes.items()}
+
+
+def encode_vector(vector: list[float], dtype: str = FLOAT32) -> bytes:
+    if dtype not in __dtype_codes:
+        raise ValueError(f"不支持的向量类型: {dtype}")
+    header = MAGIC + bytes((FORMAT_VERSION, __dtype_codes[dtype]))
+    if dtype == FLOAT16:
+        return header + struct.pack(f"<{len(vector)}e", *vector)
+    data = array("f", vector)
+    if sys.byteorder == "big":
+        data.byteswap()
+    return header + data.tobytes()
+
+
+def decode_vector(data: bytes) -> list[float]:
+    """
+    解码二进制向量，兼容旧的JSON格式
+    """
+    if not is_encoded_vector(data):
+        return json.loads(data)
+    if data[len(MAGIC)] != FORMAT_VERSION:
+        raise ValueError(f"不支持的向量格式版本: {data[len(MAGIC)]}")
+    dtype = __code_dtypes.get(data[len(MAGIC) + 1])
+    body = data[HEADER_SIZE:]
+    if dtype == FLOAT16:
+        return list(struct.unpack(f"<{len(body) // 2}e", body))
+    if dtype == FLOAT32:
+        values = array("f")
+        values.frombytes(body)
+        if sys.byteorder == "big":
+            values.byteswap()
+        return values.tolist()
+    raise ValueError(f"不支持的向量类型: {data[len(MAGIC) + 1]}")
+
+
+def is_encoded_vector(data: bytes) -> bool:
+    return data[:len(MAGIC)] == MAGIC
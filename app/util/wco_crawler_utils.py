@@ -1,10 +1,18 @@
-import requests
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import httpx
 from bs4 import BeautifulSoup
-from tenacity import retry, stop_after_attempt, wait_fixed
+from tenacity import retry, stop_after_attempt, wait_exponential_jitter, retry_if_exception
 
 from app.core.config import settings
 from app.model.wco_hs_model import WcoHsSection, WcoHsChapter, WcoHsHeading
 
+logger = logging.getLogger(__name__)
+
 common_headers = {
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
                   "AppleWebKit/537.36 (KHTML, like Gecko) "
@@ -13,19 +21,112 @@ common_headers = {
 
 main_url = settings.WCO_HSCODE_MAIN_URL
 
-
-@retry(stop=stop_after_attempt(3), wait=wait_fixed(2))  # 重试3次，每次间隔2秒
+__async_http_client: httpx.AsyncClient | None = None
+__parse_executor: ThreadPoolExecutor | None = None
+__host_limiters: dict[str, "HostLimiter"] = dict()
+
+
+class HostLimiter:
+    """
+    单个host的并发数及请求速率限制，避免全量更新时把对方网站打挂或者被封
+    """
+
+    def __init__(self, max_concurrency: int, rate_per_second: float):
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.interval = 1 / rate_per_second if rate_per_second > 0 else 0
+        self.next_request_time = 0.0
+
+    async def __aenter__(self):
+        await self.semaphore.acquire()
+        if self.interval:
+            # 预约下一个可以发请求的时间点，单线程事件循环中这里不需要额外加锁
+            now = time.monotonic()
+            request_time = max(now, self.next_request_time)
+            self.next_request_time = request_time + self.interval
+            if request_time > now:
+                await asyncio.sleep(request_time - now)
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.semaphore.release()
+
+
+def get_async_http_client() -> httpx.AsyncClient:
+    """
+    所有抓取共用一个keep-alive的http客户端
+    """
+    global __async_http_client
+    if __async_http_client is None:
+        __async_http_client = httpx.AsyncClient(
+            headers=common_headers,
+            timeout=httpx.Timeout(settings.WCO_CRAWLER_TIMEOUT_SECONDS),
+            limits=httpx.Limits(max_connections=settings.WCO_CRAWLER_MAX_CONCURRENCY,
+                                max_keepalive_connections=settings.WCO_CRAWLER_MAX_CONCURRENCY),
+            follow_redirects=True)
+    return __async_http_client
+
+
+def get_parse_executor() -> ThreadPoolExecutor:
+    """
+    BeautifulSoup解析是CPU密集操作，放到单独的线程池中执行，不阻塞事件循环
+    """
+    global __parse_executor
+    if __parse_executor is None:
+        __parse_executor = ThreadPoolExecutor(max_workers=settings.WCO_CRAWLER_PARSE_WORKERS,
+                                              thread_name_prefix="wco-parser")
+    return __parse_executor
+
+
+def get_host_limiter(url: str) -> HostLimiter:
+    host = urlsplit(url).netloc
+    if host not in __host_limiters:
+        __host_limiters[host] = HostLimiter(settings.WCO_CRAWLER_MAX_CONCURRENCY,
+                                            settings.WCO_CRAWLER_RATE_LIMIT_PER_SECOND)
+    return __host_limiters[host]
+
+
+async def close_wco_crawler():
+    global __async_http_client, __parse_executor
+    if __async_http_client is not None:
+        await __async_http_client.aclose()
+        __async_http_client = None
+    if __parse_executor is not None:
+        __parse_executor.shutdown(wait=False)
+        __parse_executor = None
+
+
+def is_transient_error(e: BaseException) -> bool:
+    """
+    网络异常、超时、429以及5xx可以重试，其他错误直接抛出
+    """
+    if isinstance(e, httpx.HTTPStatusError):
+        return e.response.status_code == 429 or e.response.status_code >= 500
+    return isinstance(e, httpx.TransportError)
+
+
+# 指数退避并增加随机抖动，避免并发请求同时重试
+@retry(stop=stop_after_attempt(settings.WCO_CRAWLER_MAX_ATTEMPTS),
+       wait=wait_exponential_jitter(initial=1, max=30),
+       retry=retry_if_exception(is_transient_error),
+       reraise=True)
 async def fetch_page(url, is_ajax):
-    headers = common_headers.copy()
-    if is_ajax:
-        headers.update({"X-Requested-With": "XMLHttpRequest"})
-    response = requests.get(url, headers=headers)
+    headers = {"X-Requested-With": "XMLHttpRequest"} if is_ajax else None
+    async with get_host_limiter(url):
+        response = await get_async_http_client().get(url, headers=headers)
     response.raise_for_status()  # 请求失败则抛出异常
     return response.text
 
 
+async def run_in_parse_executor(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(get_parse_executor(), func, *args)
+
+
 async def get_newest_version(html):
     """获取当前最新版本"""
+    return await run_in_parse_executor(parse_newest_version, html)
+
+
+def parse_newest_version(html):
     soup = BeautifulSoup(html, "html.parser")
     select = soup.find("select", id="filter-edition")
     first_option = select.find("option")
@@ -34,6 +135,10 @@ async def get_newest_version(html):
 
 
 async def get_code_and_title(html, class_name, code_prefix="", process_code=False):
+    return await run_in_parse_executor(parse_code_and_title, html, class_name, code_prefix, process_code)
+
+
+def parse_code_and_title(html, class_name, code_prefix="", process_code=False):
     soup = BeautifulSoup(html, "html.parser")
     # 查找所有class中包含class_name的div标签
     divs = soup.find_all("div", class_=class_name)
@@ -68,31 +173,43 @@ async def get_section(version):
 
 
 async def get_chapter(section: WcoHsSection):
-    chapter_url = main_url + section.load_children_url + "?_wrapper_format=ajax"
-    chapter_html = await fetch_page(chapter_url, True)
-    chapter_list = await get_code_and_title(chapter_html, "chapter-item", "Chapter ", True)
+    chapter_list = await get_chapter_by_url(section.load_children_url)
     if not chapter_list:
-        print("No Chapter Found Under %s", section.section_code)
+        logger.warning("No Chapter Found Under %s", section.section_code)
     return chapter_list
 
 
-async def get_heading(chapter:WcoHsChapter):
-    heading_url = main_url + chapter.load_children_url + "?_wrapper_format=ajax"
-    heading_html = await fetch_page(heading_url, True)
-    heading_list = await get_code_and_title(heading_html, "heading-item", "Heading ",True)
+async def get_chapter_by_url(load_children_url: str):
+    chapter_url = main_url + load_children_url + "?_wrapper_format=ajax"
+    chapter_html = await fetch_page(chapter_url, True)
+    return await get_code_and_title(chapter_html, "chapter-item", "Chapter ", True)
+
+
+async def get_heading(chapter: WcoHsChapter):
+    heading_list = await get_heading_by_url(chapter.load_children_url)
     if not heading_list:
-        print("No Heading Found Under %s", chapter.chapter_code)
+        logger.warning("No Heading Found Under %s", chapter.chapter_code)
     return heading_list
 
 
-async def get_subheading(heading:WcoHsHeading):
-    if heading.load_children_url:
-        subheading_url = main_url + heading.load_children_url + "?_wrapper_format=ajax"
+async def get_heading_by_url(load_children_url: str):
+    heading_url = main_url + load_children_url + "?_wrapper_format=ajax"
+    heading_html = await fetch_page(heading_url, True)
+    return await get_code_and_title(heading_html, "heading-item", "Heading ", True)
+
+
+async def get_subheading(heading: WcoHsHeading):
+    subheading_list = await get_subheading_by_url(heading.load_children_url)
+    if subheading_list is not None and not subheading_list:
+        logger.warning("No HSCode Found Under %s", heading.heading_code)
+    return subheading_list
+
+
+async def get_subheading_by_url(load_children_url: str | None):
+    if load_children_url:
+        subheading_url = main_url + load_children_url + "?_wrapper_format=ajax"
         subheading_html = await fetch_page(subheading_url, True)
-        subheading_list = await get_code_and_title(subheading_html, "subheading-item", "",True)
-        if not subheading_list:
-            print("No HSCode Found Under %s", heading.heading_code)
-        return subheading_list
+        return await get_code_and_title(subheading_html, "subheading-item", "", True)
     return None
 
 
@@ -0,0 +1,70 @@
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("faiss")
+
+import numpy as np
+
+from app.service.e2e_cache_replica_service import E2ECacheReplica
+
+DIMENSION = 16
+
+
+def random_vectors(count: int, seed: int) -> list[list[float]]:
+    return np.random.default_rng(seed).standard_normal((count, DIMENSION)).astype(np.float32).tolist()
+
+
+def to_hit(doc_id: str, vector: list[float]) -> dict:
+    return {"_id": doc_id, "_source": {"rewritten_item_vector": vector, "rate_line_code": doc_id,
+                                       "final_description": f"description of {doc_id}"}}
+
+
+class SlowAddIndex:
+    """
+    第一次写入(tail批次)开始时通知测试，并在真正写入前暂停，让本进程保存的文档在tail批次写入的中途到达
+    """
+
+    def __init__(self, index, adding: threading.Event):
+        self.index = index
+        self.adding = adding
+
+    def add(self, vectors):
+        if not self.adding.is_set():
+            self.adding.set()
+            time.sleep(0.2)
+        self.index.add(vectors)
+
+    def search(self, vectors, k):
+        return self.index.search(vectors, k)
+
+    @property
+    def ntotal(self):
+        return self.index.ntotal
+
+
+def test_add_local_during_tailed_batch_keeps_documents_aligned():
+    replica = E2ECacheReplica(DIMENSION)
+    replica.ready = True
+    adding = threading.Event()
+    replica.index = SlowAddIndex(replica.index, adding)
+
+    tailed = {f"tail-{i}": vector for i, vector in enumerate(random_vectors(20, seed=1))}
+    local = {f"local-{i}": vector for i, vector in enumerate(random_vectors(5, seed=2))}
+
+    tail_thread = threading.Thread(target=replica.add_hits,
+                                   args=([to_hit(doc_id, vector) for doc_id, vector in tailed.items()],))
+    tail_thread.start()
+    assert adding.wait(timeout=5)
+    for doc_id, vector in local.items():
+        replica.add_local(doc_id, to_hit(doc_id, vector)["_source"])
+    tail_thread.join(timeout=5)
+
+    assert replica.index.ntotal == len(replica.documents) == len(tailed) + len(local)
+    for doc_id, vector in {**tailed, **local}.items():
+        hit = replica.search(vector)
+        assert hit is not None
+        assert hit.rate_line_code == doc_id
+        assert hit.final_description == f"description of {doc_id}"
+        assert hit.score == pytest.approx(1.0, abs=1e-4)